@@ -1,11 +1,33 @@
-from fastapi import FastAPI, HTTPException
-from typing import List, Tuple
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, ContextManager, Dict, Iterator, List, Optional, Set, Tuple
+import asyncio
+import datetime
+import decimal
+import json
+import time
 from connection_manager import ConnectionManager
 from models import *
 import re
 from re import Match
 import os
-from model_controller import ModelController
+from model_controller import ModelController, ModelHooks
+from db_pool import PoolTimeoutError, get_pool
+from cost_guard import CostGuard
+from pagination import PageToken, Paginator, keyset_key
+from schema_cache import SchemaSnapshot, get_schema_cache
+from dimension_cache import get_dimension_cache
+from question_cache import QuestionCache
+from result_cache import ResultCache, is_cacheable, normalize_sql, referenced_tables
+from connection_manager import MovieData, register_query_listener, register_write_listener
+from export import EXPORT_FORMATS, FILE_EXTENSIONS, MEDIA_TYPES, arrow_available, arrow_chunks, csv_chunks
+from index_advisor import IndexAdvisor, IndexRecommendation
+from metrics import OLLAMA_REQUESTS, OLLAMA_TOKENS, REQUEST_DURATION, STAGE_DURATION, record_ollama_response, registry
+from app_logging import get_logger, logging_stats, shutdown_logging
+from versions import DataVersions, etag_matches
+from tracing import SPAN_KIND_CLIENT, TRACE_ENABLED, TRACE_ID_HEADER, TRACEPARENT_HEADER, Span, exporter, finish_trace, outgoing_headers, span, start_trace, trace_store
 
 """
 Questo file contiene il codice del server backend FastAPI che gestisce le richieste HTTP, l'interazione con il database attraverso la 
@@ -13,66 +35,549 @@ classe ConnectionManager e gestisce e comunica con il modello di IA di Ollama at
 Questi sono gli endpoint principali:
 1. /search: richiedere informazioni sui film, registi e piattaforme.
 2. /sql_search: per eseguire query SQL dirette sul database.
+   I risultati sono limitati a RESULT_PAGE_SIZE righe: se ce ne sono altre, la risposta contiene next_page_token,
+   da inviare nel campo page_token della richiesta successiva per ottenere la pagina seguente (vedi pagination.py).
 3. /schema_summary: per ottenere lo schema del database, ovvero i nomi delle tabelle e le colonne di ogni tabella.
-4. /add: per aggiungere un nuovo film al database.
+   Lo schema è mantenuto in una cache in memoria (vedi schema_cache.py), invalidabile con /schema_summary/invalidate.
+4. /add: per aggiungere un nuovo film al database; /add_batch per aggiungerne molti in una sola transazione.
+5. /pool_stats: per consultare le metriche del pool di connessioni al database.
+6. /cache_stats: per consultare le metriche delle cache del backend.
+7. /export: per scaricare tutto il risultato di una SELECT in formato CSV o Arrow IPC (vedi export.py).
+8. /index_advisor: per consultare gli indici suggeriti in base alle query eseguite e, con /index_advisor/apply,
+   crearli misurando i tempi del carico di prova prima e dopo (vedi index_advisor.py).
+9. /metrics: per consultare le metriche del backend nel formato di Prometheus (vedi metrics.py): durata delle richieste
+   e delle fasi di /search e /sql_search, token e durate di Ollama, pool di connessioni e cache.
+10. /debug/traces: per consultare le tracce delle richieste lente recenti, con la durata di ogni fase (vedi tracing.py).
+
+Ogni richiesta riceve un ConnectionManager tramite la dipendenza get_connection_manager: la connessione viene presa dal pool
+al primo utilizzo e restituita al termine della richiesta.
+Gli endpoint /search e /sql_search sono asincroni: la generazione della query con Ollama non occupa un thread del server,
+mentre le operazioni sul database vengono eseguite nel threadpool. Se il client si disconnette, la generazione in corso
+viene interrotta e la query in esecuzione sul database viene fermata con KILL QUERY.
+Le query hanno un tempo massimo di esecuzione per endpoint (SEARCH_QUERY_TIMEOUT, SQL_SEARCH_QUERY_TIMEOUT), applicato da MariaDB:
+una query che lo supera restituisce lo stato "timeout".
+
+/search e /sql_search accettano il parametro opzionale ?format=ndjson: in questo caso la risposta è in streaming (NDJSON),
+una riga JSON per volta. La prima riga contiene la query, l'esito della validazione e le colonne; ogni riga successiva
+è un risultato con la stessa forma di SearchResult, scritto appena viene letto dal database.
+Con ?format=columnar la risposta è compatta: i nomi delle colonne una sola volta e, per ogni colonna, l'array dei valori
+con il loro tipo (numeri, stringhe, null) invece di una Property con il valore convertito in stringa per ogni cella.
+
+I messaggi vengono scritti con il logging del backend (vedi app_logging.py): le righe lette dal database e le risposte
+complete sono a livello DEBUG e vengono campionate, quindi con LOG_LEVEL=INFO non vengono nemmeno formattate.
+
+Ogni richiesta ha una traccia (vedi tracing.py): se il frontend invia l'intestazione traceparent la traccia continua
+quella del frontend, e il suo identificativo viene restituito nell'intestazione X-Trace-Id. Le fasi di /search e /sql_search,
+le richieste a Ollama e le query sul database sono span della traccia.
+
+/schema_summary e /sql_search (formato JSON predefinito, solo SELECT sulle tabelle del catalogo) restituiscono un ETag
+costruito dalle versioni delle tabelle lette e dello schema (vedi versions.py). Se il client invia lo stesso ETag
+in If-None-Match e i dati non sono cambiati, la risposta è 304 senza corpo e la query non viene eseguita.
 """
 
-app = FastAPI()
+logger = get_logger("backend")
 
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
+# Ogni quanti secondi verificare se il client di una richiesta lunga si è disconnesso
+DISCONNECT_POLL_INTERVAL: float = float(os.getenv("DISCONNECT_POLL_INTERVAL", 0.5))
+# Numero di righe lette dal database a ogni fetchmany nelle risposte in streaming
+STREAM_CHUNK_SIZE: int = int(os.getenv("STREAM_CHUNK_SIZE", 500))
+# Secondi massimi di esecuzione di una query sul database, per endpoint (0 = nessun limite)
+SEARCH_QUERY_TIMEOUT: float = float(os.getenv("SEARCH_QUERY_TIMEOUT", 10))
+SQL_SEARCH_QUERY_TIMEOUT: float = float(os.getenv("SQL_SEARCH_QUERY_TIMEOUT", 30))
+EXPORT_QUERY_TIMEOUT: float = float(os.getenv("EXPORT_QUERY_TIMEOUT", 300))
+# Numero di righe per ogni blocco (record batch Arrow o porzione di CSV) dell'esportazione
+EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", 10000))
+# Numero massimo di righe accettate da /add_batch in una richiesta
+ADD_BATCH_MAX_LINES: int = int(os.getenv("ADD_BATCH_MAX_LINES", 10000))
+# Frazione delle risposte di cui scrivere nel log (a livello DEBUG) le righe lette dal database
+DATA_LOG_SAMPLE_RATE: float = float(os.getenv("LOG_DATA_SAMPLE_RATE", 0.1))
+# Secondi indicati nell'intestazione Retry-After quando il pool di connessioni è esaurito
+POOL_RETRY_AFTER: int = int(os.getenv("DB_POOL_RETRY_AFTER", 5))
+
+# Formato di una riga di /add: Titolo*,Regista*,Età_autore*,Anno*,Genere*,Piattaforma1,Piattaforma2 (* = obbligatorio)
+DATA_LINE_PATTERN: str = r'^([^,]+),([^,]+),(\d{1,3}),(\d{4}),([^,]+),([^,]*),([^,]*)$'
+# Intestazione del file TSV dei film (vedi load_db/data.tsv), ignorata se presente nel corpo di /add_batch
+TSV_HEADER_PREFIX: str = "Titolo\t"
+
+class BackendModelHooks(ModelHooks):
+    """
+    Questa classe collega le richieste del ModelController a Ollama alle metriche (metrics.py) e alle tracce (tracing.py) del backend.
+    """
+    def span(self, name: str, **attributes: Any) -> ContextManager[Optional[Span]]:
+        # Gli span del ModelController sono le chiamate a Ollama, che riceve il traceparent
+        return span(name, SPAN_KIND_CLIENT, **attributes)
+
+    def outgoing_headers(self) -> Dict[str, str]:
+        return outgoing_headers()
+
+    def record_response(self, response: Any) -> None:
+        record_ollama_response(response)
+
+    def record_outcome(self, model: str, outcome: str, eval_tokens: int = 0) -> None:
+        OLLAMA_REQUESTS.inc(model, outcome)
+        if eval_tokens:
+            OLLAMA_TOKENS.inc(model, "eval", amount=eval_tokens)
+
+mc: ModelController = ModelController(OLLAMA_API_URL, hooks=BackendModelHooks())
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    All'avvio del server il modello viene caricato; alla chiusura viene chiuso il client HTTP verso Ollama,
+    vengono chiuse le connessioni libere del pool, viene salvata la cache delle domande e vengono scritti i messaggi
+    di log ancora in coda.
+    """
+    is_model_loaded: bool = await mc.pull_model()
+    if not is_model_loaded:
+        raise HTTPException(status_code=500, detail="Failed to load the model. Please check the OLLAMA API URL or the model name.")
+    yield
+    await mc.aclose()
+    get_pool().close_all()
+    question_cache.flush()
+    shutdown_logging()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError) -> JSONResponse:
+    """
+    Se nessuna connessione del pool si libera entro DB_POOL_TIMEOUT secondi, la richiesta termina con lo status 503
+    e l'intestazione Retry-After, invece di un errore 500: il backend è saturo, non guasto.
+    """
+    logger.warning("Database pool exhausted: %s %s rejected", request.method, request.url.path)
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(POOL_RETRY_AFTER)})
+
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """
+    Questo middleware registra la durata di ogni richiesta per metodo, endpoint e codice di stato.
+    L'endpoint è il percorso della route (ad esempio /search), così i percorsi sconosciuti non creano nuove serie.
+    Per le risposte in streaming viene misurato il tempo fino all'invio delle intestazioni.
+    """
+    start: float = time.perf_counter()
+    status: int = 500
+    try:
+        response: Response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        endpoint: str = route.path if route is not None else "unmatched"
+        REQUEST_DURATION.observe(time.perf_counter() - start, request.method, endpoint, str(status))
+
+@app.middleware("http")
+async def trace_request(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """
+    Questo middleware apre lo span radice della traccia di ogni richiesta e restituisce il suo identificativo in X-Trace-Id.
+    Come per le metriche, per le risposte in streaming la traccia termina all'invio delle intestazioni.
+    """
+    if not TRACE_ENABLED:
+        return await call_next(request)
+    root, token = start_trace(f"{request.method} {request.url.path}", request.headers.get(TRACEPARENT_HEADER),
+                              **{"http.method": request.method, "http.target": request.url.path})
+    status: int = 500
+    try:
+        response: Response = await call_next(request)
+        status = response.status_code
+        response.headers[TRACE_ID_HEADER] = root.trace.trace_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        if route is not None:
+            root.name = f"{request.method} {route.path}"
+        root.set_attributes(**{"http.status_code": status})
+        finish_trace(root, token, "error" if status >= 500 else None)
+
+@contextmanager
+def stage(endpoint: str, name: str) -> Iterator[None]:
+    """
+    Questo context manager misura una fase di elaborazione: la durata viene registrata nelle metriche e come span della traccia.
+    """
+    with span(name, endpoint=endpoint), STAGE_DURATION.time(endpoint, name):
+        yield
+
+# Stima del costo delle query generate dal modello, eseguita prima di lanciarle sul database
+cost_guard: CostGuard = CostGuard.from_env()
+
+# Numero massimo di righe per risposta e token per la pagina successiva
+paginator: Paginator = Paginator.from_env()
+
+# Cache domanda -> query SQL, caricata dal file QUESTION_CACHE_PATH se presente
+question_cache: QuestionCache = QuestionCache.from_env()
+
+# Cache dei risultati di /sql_search, invalidata dalle scritture sulle tabelle lette da ciascuna query
+result_cache: ResultCache = ResultCache.from_env()
+register_write_listener(result_cache.invalidate_tables)
+
+# Versioni delle tabelle, aumentate da ogni scrittura, da cui vengono costruiti gli ETag
+data_versions: DataVersions = DataVersions.from_env()
+register_write_listener(data_versions.bump)
+
+# Registro delle SELECT eseguite, analizzato da /index_advisor
+index_advisor: IndexAdvisor = IndexAdvisor.from_env()
+register_query_listener(index_advisor.record)
+
+# Pool e cache vengono letti solo quando viene richiesto /metrics
+registry.register_stats("text2sql_db_pool", "Metriche del pool di connessioni", lambda: get_pool().stats())
+registry.register_stats("text2sql_cache", "Metriche della cache", lambda: get_schema_cache().stats(), {"cache": "schema"})
+registry.register_stats("text2sql_cache", "Metriche della cache", question_cache.stats, {"cache": "question"})
+registry.register_stats("text2sql_cache", "Metriche della cache", result_cache.stats, {"cache": "result"})
+registry.register_stats("text2sql_cache", "Metriche della cache", lambda: get_dimension_cache().stats(), {"cache": "dimension"})
+registry.register_stats("text2sql_log", "Metriche del logging", logging_stats)
+registry.register_stats("text2sql_data_version", "Scritture registrate per tabella", data_versions.stats)
+registry.register_stats("text2sql_traces", "Metriche delle tracce in memoria", trace_store.stats)
+if exporter is not None:
+    registry.register_stats("text2sql_trace_export", "Metriche dell'esportazione delle tracce", exporter.stats)
+
+# Lo schema viene caricato in cache all'avvio, così la prima ricerca non deve leggere information_schema
+try:
+    with ConnectionManager() as startup_cm:
+        get_schema_cache().get(startup_cm)
+except Exception as e:
+    logger.warning("Schema summary not loaded at startup: %s", e)
+
+# Anche gli id di registi e piattaforme vengono caricati all'avvio, per gli inserimenti di /add e /add_batch
+try:
+    with ConnectionManager() as startup_cm:
+        startup_cm.load_dimension_cache()
+except Exception as e:
+    logger.warning("Dimension cache not loaded at startup: %s", e)
+
+def get_connection_manager() -> Iterator[ConnectionManager]:
+    """
+    Questa dipendenza fornisce a ogni richiesta un ConnectionManager e restituisce la sua connessione al pool al termine della richiesta.
+    """
+    cm: ConnectionManager = ConnectionManager()
+    try:
+        yield cm
+    finally:
+        cm.close()
+
+async def run_until_disconnected(request: Request, awaitable: Awaitable[Any]) -> Any:
+    """
+    Questa funzione attende il risultato di un'operazione lunga controllando periodicamente se il client è ancora connesso.
+    Se il client si disconnette, l'operazione viene cancellata e la richiesta termina con lo status 499.
+    """
+    task: asyncio.Future = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client disconnected, request cancelled.")
+                raise HTTPException(status_code=499, detail="Client disconnected.")
+    finally:
+        # Se la richiesta termina (o viene cancellata) prima dell'operazione, anche l'operazione viene cancellata
+        task.cancel()
+
+async def run_query_until_disconnected(request: Request, cm: ConnectionManager, func: Callable[..., Any], *args: Any,
+                                       stream_cm: Optional[ConnectionManager] = None) -> Any:
+    """
+    Questa funzione esegue nel threadpool un'operazione sul database del ConnectionManager, controllando se il client è ancora connesso.
+    Il thread non può essere cancellato: se il client si disconnette, la query viene interrotta con KILL QUERY
+    e si attende che il thread termini prima di restituire la connessione al pool.
+    stream_cm è la connessione dedicata di una risposta NDJSON (vedi execute_ndjson), se l'operazione ne usa una:
+    anche la sua query viene interrotta e, dato che la risposta non verrà inviata, la connessione torna al pool.
+    """
+    task: asyncio.Future = asyncio.ensure_future(run_in_threadpool(func, *args))
+    try:
+        return await run_until_disconnected(request, asyncio.shield(task))
+    except HTTPException as e:
+        if e.status_code == 499:
+            if not task.done():
+                await run_in_threadpool(cm.cancel_query)
+                if stream_cm is not None:
+                    await run_in_threadpool(stream_cm.cancel_query)
+                await asyncio.wait({task})
+            if stream_cm is not None:
+                await run_in_threadpool(stream_cm.close)
+        raise
+
+def build_search_results(columns: List[str], data: List[Tuple]) -> List[SearchResult]:
+    """
+    Questa funzione trasforma le righe restituite dal database in una lista di SearchResult.
+    La colonna "titolo" viene rinominata in "name".
+    """
+    return [
+        SearchResult(
+            item_type="film",
+            properties=[
+                Property(property_name="name" if columns[i] == "titolo" else columns[i],
+                         property_value=str(row[i]))
+                for i in range(len(columns))
+            ]
+        )
+        for row in data
+    ]
+
+PageResult = Tuple[str, Optional[Tuple[List[str], List[Tuple]]], Optional[str], bool]
+
+def read_page_token(page_token: str) -> PageToken:
+    """
+    Questa funzione legge il token della pagina inviato dal client e lancia un'eccezione 422 se non è valido.
+    """
+    try:
+        return paginator.decode_token(page_token)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+def page_result(query: str, key: str, page: Tuple[List[str], List[Tuple]]) -> PageResult:
+    """
+    Questa funzione riduce una pagina letta con una riga in più alla dimensione della pagina
+    e, se la riga in più c'era, crea il token per la pagina successiva.
+    Se la chiave non compare una sola volta tra le colonne, la pagina viene solo troncata.
+    """
+    columns, rows = page
+    if len(rows) <= paginator.page_size:
+        return ("valid", page, None, False)
+    rows = rows[:paginator.page_size]
+    if columns.count(key) != 1:
+        return ("valid", (columns, rows), None, True)
+    token: PageToken = PageToken(sql=query, key=key, after=rows[-1][columns.index(key)])
+    return ("valid", (columns, rows), paginator.encode_token(token), False)
+
+def execute_paginated(cm: ConnectionManager, query: str) -> PageResult:
+    """
+    Questa funzione esegue la query una sola volta, leggendo dal database al massimo una pagina più una riga.
+    Se la query può essere paginata con keyset (vedi pagination.keyset_key), la prima pagina viene letta ordinata per chiave
+    e, se il risultato non sta in una pagina, viene restituito il token della pagina successiva.
+    Altrimenti la query viene limitata a una pagina più una riga mantenendo il suo ordinamento e, se la riga in più c'è,
+    il risultato viene troncato.
+    Restituisce una tupla (sql_validation, risultati, token della pagina successiva, troncato).
+    """
+    key: Optional[str] = keyset_key(query)
+    if key is not None:
+        sql_validation, page = cm.execute_page(query, paginator, key)
+        if sql_validation != "valid":
+            return (sql_validation, None, None, False)
+        return page_result(query, key, page)
+
+    sql_validation, results = cm.validate_and_execute(query, paginator.page_size + 1)
+    if sql_validation != "valid" or len(results[1]) <= paginator.page_size:
+        return (sql_validation, results, None, False)
+    logger.info("Result truncated to %d rows.", paginator.page_size)
+    return ("valid", (results[0], results[1][:paginator.page_size]), None, True)
+
+def fetch_page(cm: ConnectionManager, token: PageToken) -> PageResult:
+    """
+    Questa funzione legge la pagina indicata dal token, ripartendo dall'ultimo valore della chiave della pagina precedente.
+    """
+    sql_validation, page = cm.execute_page(token.sql, paginator, token.key, token.after)
+    if sql_validation != "valid":
+        return (sql_validation, None, None, False)
+    return page_result(token.sql, token.key, page)
+
+def json_value(value: Any) -> Any:
+    """
+    Questa funzione converte i valori restituiti da MariaDB che non hanno un tipo JSON:
+    date e orari in formato ISO 8601, decimali in stringhe (un float perderebbe le cifre oltre la sua precisione),
+    dati binari in stringhe.
+    """
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return str(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+def columnar_response(header: Dict[str, Any], results: Optional[Tuple[List[str], List[Tuple]]]) -> Response:
+    """
+    Questa funzione crea la risposta nel formato colonnare: l'intestazione (query, validazione, paginazione),
+    i nomi delle colonne e un array di valori per ogni colonna, nello stesso ordine delle colonne.
+    Il JSON viene scritto direttamente, senza creare e validare un modello Pydantic per ogni cella.
+    """
+    if results is not None:
+        columns, rows = results
+        header["columns"] = ["name" if column == "titolo" else column for column in columns]
+        header["data"] = [list(values) for values in zip(*rows)] if rows else [[] for _ in columns]
+    else:
+        header["columns"] = None
+        header["data"] = None
+    return Response(content=json.dumps(header, ensure_ascii=False, default=json_value), media_type="application/json")
+
+def ndjson_result_line(columns: List[str], row: Tuple) -> str:
+    """
+    Questa funzione serializza una riga del risultato come riga NDJSON con la stessa forma di SearchResult,
+    senza costruire gli oggetti Property e SearchResult.
+    """
+    return json.dumps({
+        "item_type": "film",
+        "properties": [
+            {"property_name": "name" if columns[i] == "titolo" else columns[i], "property_value": str(row[i])}
+            for i in range(len(columns))
+        ],
+    }, ensure_ascii=False) + "\n"
 
-mc: ModelController = ModelController(OLLAMA_API_URL)
-# All'inizio del server, il modello viene caricato
-is_model_loaded: bool = mc.pull_model()
-if not is_model_loaded:
-    raise HTTPException(status_code=500, detail="Failed to load the model. Please check the OLLAMA API URL or the model name.")
+def stream_search_results(header: Dict[str, Any], results: Optional[Tuple[List[str], Iterator[List[Tuple]]]],
+                          cm: Optional[ConnectionManager] = None) -> Iterator[str]:
+    """
+    Questo generatore produce la risposta NDJSON: la riga di intestazione e poi una riga per ogni risultato, un blocco alla volta.
+    Il ConnectionManager, se presente, appartiene al generatore e la sua connessione torna al pool quando lo streaming termina.
+    Se il database restituisce un errore a metà risultato, lo streaming si chiude con una riga {"error": ...}.
+    """
+    finished: bool = False
+    try:
+        header["columns"] = results[0] if results is not None else None
+        yield json.dumps(header, ensure_ascii=False) + "\n"
+        if results is not None:
+            columns, chunks = results
+            try:
+                for rows in chunks:
+                    yield "".join(ndjson_result_line(columns, row) for row in rows)
+            except Exception as e:
+                logger.error("Error streaming results: %s", e)
+                yield json.dumps({"error": str(e)}) + "\n"
+        finished = True
+    finally:
+        # Se il client si disconnette a metà, la query viene interrotta e il cursore non bufferizzato viene chiuso
+        # prima di restituire la connessione al pool
+        if not finished and cm is not None:
+            cm.cancel_query()
+        if results is not None and hasattr(results[1], "close"):
+            results[1].close()
+        if cm is not None:
+            cm.close()
+
+def ndjson_response(header: Dict[str, Any], results: Optional[Tuple[List[str], Iterator[List[Tuple]]]] = None,
+                    cm: Optional[ConnectionManager] = None) -> StreamingResponse:
+    """
+    Questa funzione crea la risposta NDJSON in streaming a partire dall'intestazione e dai risultati (se la query è valida).
+    """
+    return StreamingResponse(stream_search_results(header, results, cm), media_type="application/x-ndjson")
+
+def execute_ndjson(stream_cm: ConnectionManager, query: str, header: Dict[str, Any]) -> Tuple[str, StreamingResponse]:
+    """
+    Questa funzione esegue la query con un cursore non bufferizzato sulla connessione dedicata stream_cm e restituisce l'esito
+    della validazione e la risposta in streaming, che restituisce la connessione al pool quando termina.
+    La connessione non può essere quella della dipendenza get_connection_manager, che viene restituita al pool
+    prima che la risposta in streaming inizi. stream_cm viene creato dall'endpoint (con il suo tempo massimo di esecuzione)
+    e passato anche a run_query_until_disconnected, così la query viene interrotta se il client si disconnette.
+    """
+    try:
+        sql_validation, results = stream_cm.validate_and_stream(query, STREAM_CHUNK_SIZE)
+    except Exception:
+        stream_cm.close()
+        raise
+    logger.info("SQL Validation: %s", sql_validation)
+    header["sql_validation"] = sql_validation
+    return (sql_validation, ndjson_response(header, results, stream_cm))
 
 # ---------------------------------------------------------- ENDPOINT /search ---------------------------------------------------
 
 @app.post("/search")
-def search(search_request: SearchRequest) -> SearchResponse:
+async def search(request: Request, search_request: SearchRequest, cm: ConnectionManager = Depends(get_connection_manager),
+                 response_format: Optional[str] = Query(None, alias="format")) -> SearchResponse:
     """
     Questo metodo prende in input una stringa di ricerca e la passa al modello di IA per generare una query SQL.
-    Se la query è valida, viene eseguita sul database e restituisce i risultati.
-    Se la query è "unsafe" o "invalid", lo segnala.
+    Se la stessa domanda, o una domanda molto simile, ha già ricevuto una query valida (con lo stesso modello e lo stesso schema),
+    la query viene presa dalla cache senza interrogare il modello e viene solo rieseguita sul database.
+    Prima dell'esecuzione il costo della query viene stimato con EXPLAIN: se è troppo alto la query viene rifiutata
+    ("too_expensive") oppure limitata con un LIMIT aggiunto automaticamente.
+    La query viene validata ed eseguita sul database una sola volta e, se è valida, restituisce i risultati.
+    Se la query è "unsafe", "invalid", "too_expensive" o "timeout" (tempo massimo SEARCH_QUERY_TIMEOUT superato), lo segnala.
+    Le operazioni sul database vengono eseguite nel threadpool, la richiesta al modello viene attesa in modo asincrono.
+    I risultati sono restituiti una pagina alla volta: con page_token viene letta la pagina successiva della stessa query,
+    senza interrogare di nuovo il modello (question e model non sono richiesti); il formato richiesto vale anche per questa pagina.
+    Anche la query del token passa dalla stima del costo, perché i token di /sql_search sono firmati con la stessa chiave.
+    Con ?format=ndjson i risultati vengono inviati in streaming, una riga per volta; con ?format=columnar in formato colonnare.
     """
-    if not search_request.question:
-        raise HTTPException(status_code=422, detail="'question' is a necessary field.")
+    cm.set_statement_timeout(SEARCH_QUERY_TIMEOUT)
+    next_page_token: Optional[str] = None
+    truncated: bool = False
+    # Motivo del rifiuto di una query "too_expensive"
+    detail: Optional[str] = None
+    if search_request.page_token:
+        # Pagina successiva di una ricerca già fatta: la query è nel token, il modello non viene interrogato
+        token: PageToken = read_page_token(search_request.page_token)
+        query: str = token.sql
+        # Lo stesso token può essere creato da /sql_search, che non stima il costo: la query del token viene ricontrollata.
+        # Il LIMIT aggiunto automaticamente non serve, perché la pagina è già limitata a RESULT_PAGE_SIZE righe
+        with stage("search", "cost_check"):
+            cost_check, _, detail = await run_in_threadpool(cm.check_query_cost, query, cost_guard)
+        if cost_check == "ok":
+            with stage("search", "execute"):
+                sql_validation, results, next_page_token, truncated = await run_query_until_disconnected(request, cm, fetch_page, cm, token)
+        else:
+            sql_validation, results = cost_check, None
+        if response_format == "ndjson":
+            return ndjson_response({"sql": query, "sql_validation": sql_validation, "next_page_token": next_page_token,
+                                    "truncated": truncated, "detail": detail},
+                                   (results[0], iter([results[1]])) if results is not None else None)
+    else:
+        if not search_request.question:
+            raise HTTPException(status_code=422, detail="'question' is a necessary field.")
+        if not search_request.model:
+            raise HTTPException(status_code=422, detail="'model' is a necessary field.")
     
-    cm: ConnectionManager = ConnectionManager()
-    schema_summary: List[Tuple[str, str]] = cm.query_schema_summary()
+        with stage("search", "schema"):
+            schema: SchemaSnapshot = await run_in_threadpool(get_schema_cache().get, cm)
+
+        question: str = search_request.question
+        with stage("search", "question_cache"):
+            cached_query: Optional[str] = question_cache.get(question, mc.model, schema.fingerprint)
+            if cached_query is None:
+                cached_query = question_cache.get_similar(question, mc.model, schema.fingerprint)
+        if cached_query is not None:
+            query = cached_query
+            logger.info("Query from cache: %s", query)
+        else:
+            with stage("search", "model"):
+                query = await run_until_disconnected(request, mc.ask_question(question, schema.summary, schema.prompt))
+            logger.info("Query by model: %s", query)
+            with stage("search", "clean_sql"):
+                query = cm.clean_sql_output(query)
+            logger.info("Cleaned query: %s", query)
+        cleaned_query: str = query
 
-    question: str = search_request.question
-    query: str = mc.ask_question(question, schema_summary)
-    print(f"Query by model: {query}", flush=True)
-    query = cm.clean_sql_output(query)
-    print(f"Cleaned query: {query}", flush=True)
+        with stage("search", "cost_check"):
+            cost_check, query, detail = await run_in_threadpool(cm.check_query_cost, query, cost_guard)
+        if response_format == "ndjson":
+            if cost_check != "ok":
+                return ndjson_response({"sql": query, "sql_validation": cost_check, "detail": detail})
+            stream_cm: ConnectionManager = ConnectionManager(SEARCH_QUERY_TIMEOUT)
+            with stage("search", "execute"):
+                sql_validation, response = await run_query_until_disconnected(request, cm, execute_ndjson, stream_cm, query,
+                                                                              {"sql": query}, stream_cm=stream_cm)
+            if sql_validation == "valid" and cached_query is None:
+                await run_in_threadpool(question_cache.put, question, mc.model, schema.fingerprint, cleaned_query)
+            return response
 
-    sql_validation: str = cm.sql_validation(query)
+        if cost_check == "ok":
+            # La validazione dello statement e l'esecuzione sul database avvengono insieme (vedi ConnectionManager.validate_and_execute)
+            with stage("search", "execute"):
+                sql_validation, results, next_page_token, truncated = await run_query_until_disconnected(request, cm, execute_paginated, cm, query)
+        else:
+            sql_validation, results = cost_check, None
 
-    # se la query è "valid" allora si esegue la query
+        # Solo le query valide generate dal modello vengono salvate in cache
+        if sql_validation == "valid" and cached_query is None:
+            await run_in_threadpool(question_cache.put, question, mc.model, schema.fingerprint, cleaned_query)
+
+    if response_format == "columnar":
+        with stage("search", "response"):
+            return columnar_response({"sql": query, "sql_validation": sql_validation, "next_page_token": next_page_token,
+                                      "truncated": truncated, "detail": detail}, results)
+
+    # se la query è "valid" allora si restituiscono i risultati
     if sql_validation == "valid":
-        results: Tuple[List[str], List[Tuple]] = cm.execute_query(query)
         columns: List[str] = results[0]
-        data: List[Tuple[str, str, str]] = results[1]
-        print("Columns from DB:", columns, flush=True)
-        print("Data from DB:", data, flush=True)
-
-        search_response: SearchResponse = SearchResponse(
-            sql=query,
-            sql_validation=sql_validation,
-            results= [
-                SearchResult(
-                    item_type="film",
-                    properties=[
-                        Property(property_name="name" if columns[i] == "titolo" else columns[i],
-                                 property_value=str(row[i]))
-                        for i in range(len(columns))
-                    ]    
+        data: List[Tuple] = results[1]
+        logger.debug("Columns from DB: %s", columns)
+        logger.debug("Data from DB: %s", data, extra={"sample_rate": DATA_LOG_SAMPLE_RATE})
+
+        with stage("search", "response"):
+            search_response: SearchResponse = SearchResponse(
+                sql=query,
+                sql_validation=sql_validation,
+                results=build_search_results(columns, data),
+                next_page_token=next_page_token,
+                truncated=truncated
                 )
-                for row in data
-                ]
-            )
         return search_response
     
     # se la query è "unsafe"
@@ -83,63 +588,176 @@ def search(search_request: SearchRequest) -> SearchResponse:
     elif sql_validation == "invalid":
         search_response: SearchResponse = SearchResponse(sql=query, sql_validation=sql_validation, results=None)
         return search_response
+    # se la query è "too_expensive"
+    elif sql_validation == "too_expensive":
+        search_response: SearchResponse = SearchResponse(sql=query, sql_validation=sql_validation, results=None, detail=detail)
+        return search_response
+    # se la query ha superato il tempo massimo di esecuzione o è stata interrotta
+    elif sql_validation in ("timeout", "cancelled"):
+        search_response: SearchResponse = SearchResponse(sql=query, sql_validation=sql_validation, results=None)
+        return search_response
     else:
         raise HTTPException(status_code=422, detail="Unknown error. Please check your SQL syntax.")
     
 # ---------------------------------------------------------- ENDPOINT /sql_search ---------------------------------------------------
 
 @app.post("/sql_search")
-def sql_search(search_request: SQLSearchRequest) -> SQLSearchResponse:
+async def sql_search(request: Request, search_request: SQLSearchRequest, response: Response,
+                     cm: ConnectionManager = Depends(get_connection_manager),
+                     response_format: Optional[str] = Query(None, alias="format")) -> SQLSearchResponse:
+    """
+    Questo metodo esegue run_conditional_sql_search nel threadpool con il tempo massimo di esecuzione SQL_SEARCH_QUERY_TIMEOUT.
+    Se il client si disconnette, la query in esecuzione sul database viene interrotta, anche quella della connessione
+    dedicata allo streaming con ?format=ndjson.
+    """
+    cm.set_statement_timeout(SQL_SEARCH_QUERY_TIMEOUT)
+    stream_cm: Optional[ConnectionManager] = ConnectionManager(SQL_SEARCH_QUERY_TIMEOUT) if response_format == "ndjson" else None
+    return await run_query_until_disconnected(request, cm, run_conditional_sql_search, cm, search_request, response_format,
+                                              request.headers.get("if-none-match"), response, stream_cm, stream_cm=stream_cm)
+
+def sql_search_etag(cm: ConnectionManager, search_request: SQLSearchRequest) -> Optional[str]:
+    """
+    Questa funzione restituisce l'ETag della risposta di /sql_search, costruito dalle versioni delle tabelle lette,
+    dalla versione dello schema, dalla query normalizzata e dal token della pagina.
+    Restituisce None se la risposta non dipende solo dal contenuto delle tabelle (statement che non sono SELECT,
+    funzioni come NOW() o RAND(), tabelle di sistema).
+    """
+    if search_request.page_token:
+        query: str = read_page_token(search_request.page_token).sql
+    elif search_request.sql_query:
+        query = cm.clean_sql_output(search_request.sql_query)
+    else:
+        return None
+    if cm.classify_statement(query) != "select" or not is_cacheable(query):
+        return None
+    schema: SchemaSnapshot = get_schema_cache().get(cm)
+    tables: Set[str] = referenced_tables(query, schema.tables)
+    if not tables:
+        return None
+    return data_versions.etag(tables, schema.fingerprint, normalize_sql(query), search_request.page_token)
+
+def run_conditional_sql_search(cm: ConnectionManager, search_request: SQLSearchRequest, response_format: Optional[str],
+                               if_none_match: Optional[str], response: Response,
+                               stream_cm: Optional[ConnectionManager] = None) -> SQLSearchResponse:
+    """
+    Questo metodo gestisce le richieste condizionali di /sql_search nel formato JSON predefinito.
+    L'ETag viene calcolato prima di eseguire la query: se corrisponde a If-None-Match la risposta è 304 e il database
+    non viene interrogato, altrimenti viene eseguito run_sql_search e l'ETag viene aggiunto alla risposta.
+    Le risposte interrotte ("timeout", "cancelled") non ricevono l'ETag, perché non dipendono solo dai dati.
+    """
+    if response_format is not None:
+        return run_sql_search(cm, search_request, response_format, stream_cm)
+
+    with stage("sql_search", "etag"):
+        etag: Optional[str] = sql_search_etag(cm, search_request)
+    if etag is not None and etag_matches(if_none_match, etag):
+        logger.info("SQL search not modified (ETag %s)", etag)
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+    search_response: SQLSearchResponse = run_sql_search(cm, search_request, response_format)
+    if etag is not None and search_response.sql_validation not in ("timeout", "cancelled"):
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+    return search_response
+
+def run_sql_search(cm: ConnectionManager, search_request: SQLSearchRequest, response_format: Optional[str],
+                   stream_cm: Optional[ConnectionManager] = None) -> SQLSearchResponse:
     """
     Questo metodo prende in input una stringa che rappresenta una query SQL e la passa alla classe ConnectionManager per eseguire la query sul database.
-    Se la query è valida, viene eseguita sul database e restituisce i risultati.
-    Se la query è "unsafe" o "invalid", lo segnala.
+    La query viene validata ed eseguita sul database una sola volta e, se è valida, restituisce i risultati.
+    I risultati delle SELECT sulle tabelle del catalogo vengono salvati in cache finché una scrittura non modifica le tabelle lette.
+    Se la query è "unsafe", "invalid" o "timeout", lo segnala.
+    I risultati sono restituiti una pagina alla volta: con page_token viene letta la pagina successiva della stessa query
+    (sql_query non è richiesto), nel formato richiesto.
+    Con ?format=ndjson i risultati vengono inviati in streaming, una riga per volta, dalla connessione dedicata stream_cm;
+    un risultato già in cache viene comunque usato, ma i risultati in streaming non vengono salvati in cache
+    perché non vengono tenuti in memoria.
+    Con ?format=columnar i risultati sono restituiti in formato colonnare (vedi columnar_response).
     """
+    if search_request.page_token:
+        # Pagina successiva di un risultato già restituito: la query è nel token e la pagina non passa dalla cache
+        token: PageToken = read_page_token(search_request.page_token)
+        sql_validation, results, next_page_token, truncated = fetch_page(cm, token)
+        logger.info("SQL Validation: %s", sql_validation)
+        if response_format == "columnar":
+            return columnar_response({"sql_validation": sql_validation, "next_page_token": next_page_token, "truncated": truncated}, results)
+        if response_format == "ndjson":
+            return ndjson_response({"sql_validation": sql_validation, "next_page_token": next_page_token, "truncated": truncated},
+                                   (results[0], iter([results[1]])) if results is not None else None)
+        if sql_validation != "valid":
+            return SQLSearchResponse(sql_validation=sql_validation, results=None)
+        return SQLSearchResponse(sql_validation=sql_validation, results=build_search_results(results[0], results[1]),
+                                 next_page_token=next_page_token, truncated=truncated)
+
     if not search_request.sql_query:
         raise HTTPException(status_code=422, detail="'sql_query' is a necessary field.")
     
     query: str = search_request.sql_query
     
     
-    cm: ConnectionManager = ConnectionManager()
-    query = cm.clean_sql_output(query)
-    print(f"Cleaned query: {query}", flush=True)
-   
-    sql_validation: str = cm.sql_validation(query)
-    print(f"SQL Validation: {sql_validation}", flush=True)
+    with stage("sql_search", "clean_sql"):
+        query = cm.clean_sql_output(query)
+    logger.info("Cleaned query: %s", query)
+
+    with stage("sql_search", "result_cache"):
+        cache_key: str = normalize_sql(query)
+        tables: Set[str] = set()
+        if result_cache.enabled and cm.classify_statement(query) == "select" and is_cacheable(query):
+            tables = referenced_tables(query, get_schema_cache().get(cm).tables)
+
+        cached_results: Optional[Tuple[List[str], List[Tuple]]] = result_cache.get(cache_key) if tables else None
+    if response_format == "ndjson":
+        if cached_results is not None:
+            return ndjson_response({"sql_validation": "valid"}, (cached_results[0], iter([cached_results[1]])))
+        return execute_ndjson(stream_cm or ConnectionManager(SQL_SEARCH_QUERY_TIMEOUT), query, {})[1]
 
-    # se la query è "valid" allora si esegue la query
+    next_page_token: Optional[str] = None
+    truncated: bool = False
+    if cached_results is not None:
+        sql_validation, results = "valid", cached_results
+    else:
+        generation: Dict[str, int] = result_cache.generation(tables)
+        with stage("sql_search", "execute"):
+            sql_validation, results, next_page_token, truncated = execute_paginated(cm, query)
+        # Solo i risultati completi (contenuti in una pagina) vengono salvati in cache
+        if sql_validation == "valid" and tables and next_page_token is None and not truncated:
+            result_cache.put(cache_key, tables, results[0], results[1], generation)
+    logger.info("SQL Validation: %s", sql_validation)
+
+    if response_format == "columnar":
+        with stage("sql_search", "response"):
+            return columnar_response({"sql_validation": sql_validation, "next_page_token": next_page_token, "truncated": truncated}, results)
+
+    # se la query è "valid" allora si restituiscono i risultati
     if sql_validation == "valid":
-        results: Tuple[List[str], List[Tuple]] = cm.execute_query(query)
         columns: List[str] = results[0]
-        data: List[Tuple[str, str, str]] = results[1]
-        print("Columns from DB:", columns, flush=True)
-        print("Data from DB:", data, flush=True)
-
-        search_response: SQLSearchResponse = SQLSearchResponse(
-            sql_validation=sql_validation,
-            results= [SearchResult(
-                    item_type="film",
-                    properties=[
-                        Property(property_name="name" if columns[i] == "titolo" else columns[i],
-                                 property_value=str(row[i]))
-                        for i in range(len(columns))
-                    ]    
+        data: List[Tuple] = results[1]
+        logger.debug("Columns from DB: %s", columns)
+        logger.debug("Data from DB: %s", data, extra={"sample_rate": DATA_LOG_SAMPLE_RATE})
+
+        with stage("sql_search", "response"):
+            search_response: SQLSearchResponse = SQLSearchResponse(
+                sql_validation=sql_validation,
+                results=build_search_results(columns, data),
+                next_page_token=next_page_token,
+                truncated=truncated
                 )
-                for row in data
-                ]
-            )
         return search_response
     
      # se la query è "unsafe"
     elif sql_validation == "unsafe":
         search_response: SQLSearchResponse = SQLSearchResponse(sql_validation=sql_validation, results=None)
-        print(f"Response unsafe: {search_response}", flush=True)
+        logger.debug("Response unsafe: %s", search_response)
         return search_response
     # se la query è "invalid"
     elif sql_validation == "invalid":
         search_response: SQLSearchResponse = SQLSearchResponse(sql_validation=sql_validation, results=None)
-        print(f"Response invalid: {search_response}", flush=True)
+        logger.debug("Response invalid: %s", search_response)
+        return search_response
+    # se la query ha superato il tempo massimo di esecuzione o è stata interrotta
+    elif sql_validation in ("timeout", "cancelled"):
+        search_response: SQLSearchResponse = SQLSearchResponse(sql_validation=sql_validation, results=None)
+        logger.debug("Response %s: %s", sql_validation, search_response)
         return search_response
     else:
         raise HTTPException(status_code=422, detail="Unknown error. Please check your SQL syntax.")
@@ -148,28 +766,49 @@ def sql_search(search_request: SQLSearchRequest) -> SQLSearchResponse:
 # ---------------------------------------------------------- ENDPOINT /schema_summary ---------------------------------------------------
 
 @app.get("/schema_summary") 
-def schema_summary() -> List[DatabaseSchemaResponse]:
+def schema_summary(request: Request, response: Response, cm: ConnectionManager = Depends(get_connection_manager)) -> List[DatabaseSchemaResponse]:
     """
-    Questo metodo richima il metodo appropriato della classe ConnectionManager per eseguire la query sul database.
-    In output restituisce lo schema del database, ovvero i nomi delle tabelle e le colonne di ogni tabella.
+    Questo metodo restituisce lo schema del database, ovvero i nomi delle tabelle e le colonne di ogni tabella.
+    Lo schema viene letto dalla cache; la classe ConnectionManager viene usata solo se la cache è vuota o scaduta.
+    La risposta ha un ETag costruito dall'impronta dello schema: se il client invia lo stesso ETag in If-None-Match
+    la risposta è 304 senza corpo.
     """
-    cm: ConnectionManager = ConnectionManager()
-
     try:
-        results: List[Tuple[str, str]] = cm.query_schema_summary()
+        snapshot: SchemaSnapshot = get_schema_cache().get(cm)
+        etag: str = data_versions.etag((), "schema", snapshot.fingerprint)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = "no-cache"
+        results: List[Tuple[str, str]] = snapshot.summary
         schema_summary: List[DatabaseSchemaResponse] = [
             DatabaseSchemaResponse(table_name=row[0], table_column=row[1]) for row in results
         ]
         return schema_summary
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching schema summary: {e}")
 
 
+@app.post("/schema_summary/invalidate")
+def invalidate_schema_summary() -> CacheInvalidationResponse:
+    """
+    Questo metodo svuota la cache dello schema, ad esempio dopo una modifica alle tabelle del database.
+    La richiesta successiva rilegge lo schema da information_schema. Vengono svuotate anche la cache dei risultati
+    e quella degli id di registi e piattaforme.
+    """
+    get_schema_cache().invalidate()
+    result_cache.clear()
+    get_dimension_cache().clear()
+    return CacheInvalidationResponse(status="ok")
+
+
 #---------------------------------------------------------- ENDPOINT /add ---------------------------------------------------
 
 
 @app.post("/add")
-def add(add_request: AddRequest) -> AddResponse:
+def add(add_request: AddRequest, cm: ConnectionManager = Depends(get_connection_manager)) -> AddResponse:
     """
     Questo metodo si aspetta una stringa in input con il formato: Titolo*,Regista*,Età_autore*,Anno*,Genere*,Piattaforma1,Piataforma2 (* = obbligatorio)
     Verifica se l'input è corretto con l'espressione regolare.
@@ -178,17 +817,14 @@ def add(add_request: AddRequest) -> AddResponse:
     Se l'input non è come se l'aspetta, lancia un'eccezione 422 con un messaggio di errore.
     """
     data_line: str = add_request.data_line
-    print(f"Dataline:", data_line, flush=True)
-
-    cm: ConnectionManager = ConnectionManager()
+    logger.info("Dataline: %s", data_line)
 
     # Verifica se l'input è corretto con l'espressione regolare
-    pattern: str = r'^([^,]+),([^,]+),(\d{1,3}),(\d{4}),([^,]+),([^,]*),([^,]*)$'
-    match: Match[str] = re.fullmatch(pattern, data_line)
+    match: Match[str] = re.fullmatch(DATA_LINE_PATTERN, data_line)
 
     if match:
         split_data: List[str] = data_line.split(",")
-        print("Split data:", split_data, flush=True)
+        logger.debug("Split data: %s", split_data)
 
         title: str = split_data[0]
         director: str = split_data[1]
@@ -197,19 +833,13 @@ def add(add_request: AddRequest) -> AddResponse:
         genre: str = split_data[4]
         platform1: str = split_data[5] if split_data[5] != "" else None
         platform2: str = split_data[6] if split_data[6] != "" else None
-        print(f"Title: {title}, Director: {director}, Age: {age}, Year: {year}, Genre: {genre}, Platform1: {platform1}, Platform2: {platform2}", flush=True)
-
-        
-        id_director: int = cm.get_or_create_director(director, age)
-        print(f"ID Director: {id_director}", flush=True)
-        id_platform1: int = cm.get_or_create_platform(platform1) if platform1 else None
-        print(f"ID Platform1: {id_platform1}", flush=True)
-        id_platform2: int = cm.get_or_create_platform(platform2) if platform2 else None
-        print(f"ID Platform2: {id_platform2}", flush=True)
-
-        id_movie: int = cm.get_or_create_movie(title, year, genre, id_director, id_platform1, id_platform2) 
-        print(f"ID Movie: {id_movie}")
-    
+        logger.debug("Title: %s, Director: %s, Age: %d, Year: %d, Genre: %s, Platform1: %s, Platform2: %s",
+                     title, director, age, year, genre, platform1, platform2)
+
+
+        # Regista, piattaforme e film vengono scritti con degli upsert in un'unica transazione
+        id_movie: int = cm.add_movie(title, director, age, year, genre, platform1, platform2)
+        logger.info("ID Movie: %d", id_movie)
 
         return AddResponse(status="ok")
 
@@ -219,3 +849,298 @@ def add(add_request: AddRequest) -> AddResponse:
             detail="Invalid input format. Expected format: 'Title,Director,Age,Year,Genre,Platform1,Platform2'"
         )
 
+
+#---------------------------------------------------------- ENDPOINT /add_batch ---------------------------------------------------
+
+def parse_data_line(data_line: str) -> Optional[MovieData]:
+    """
+    Questa funzione verifica una riga nel formato di /add con l'espressione regolare e restituisce i dati del film,
+    oppure None se la riga non è corretta.
+    """
+    if re.fullmatch(DATA_LINE_PATTERN, data_line) is None:
+        return None
+    split_data: List[str] = data_line.split(",")
+    return (split_data[0], split_data[1], int(split_data[2]), int(split_data[3]), split_data[4],
+            split_data[5] or None, split_data[6] or None)
+
+def read_batch_lines(content_type: str, body: bytes) -> List[str]:
+    """
+    Questa funzione legge le righe inviate a /add_batch e le riporta al formato di /add (campi separati da virgole).
+    Il corpo può essere JSON (un array di righe oppure {"data_lines": [...]}) o TSV con le colonne di data.tsv,
+    con o senza intestazione.
+    """
+    if "json" in content_type:
+        try:
+            payload: Any = json.loads(body)
+            if isinstance(payload, list):
+                payload = {"data_lines": payload}
+            return AddBatchRequest(**payload).data_lines
+        except (ValueError, TypeError) as e:
+            raise HTTPException(status_code=422, detail=f"Invalid JSON body: {e}")
+
+    lines: List[str] = [line for line in body.decode("utf-8").splitlines() if line.strip()]
+    if lines and lines[0].startswith(TSV_HEADER_PREFIX):
+        lines = lines[1:]
+    data_lines: List[str] = []
+    for line in lines:
+        fields: List[str] = [field.strip() for field in line.split("\t")]
+        fields += [""] * (7 - len(fields))
+        data_lines.append(",".join(fields))
+    return data_lines
+
+@app.post("/add_batch")
+async def add_batch(request: Request, cm: ConnectionManager = Depends(get_connection_manager)) -> AddBatchResponse:
+    """
+    Questo metodo aggiunge molti film in una sola richiesta. Accetta un corpo JSON (array di righe nel formato di /add)
+    oppure TSV (Content-Type text/tab-separated-values, colonne come in data.tsv).
+    Tutte le righe vengono verificate con la stessa espressione regolare di /add; le righe corrette vengono scritte
+    in una sola transazione con ConnectionManager.add_movies_batch.
+    Restituisce lo stato di ogni riga ("ok" con l'id del film oppure "invalid") e lo stato complessivo:
+    "ok" se tutte le righe sono state inserite, "partial" se alcune non erano corrette, "invalid" se nessuna era corretta.
+    Se la scrittura sul database fallisce nessuna riga viene inserita e viene lanciata un'eccezione 500.
+    """
+    data_lines: List[str] = read_batch_lines(request.headers.get("content-type", ""), await request.body())
+    if not data_lines:
+        raise HTTPException(status_code=422, detail="No data lines received.")
+    if len(data_lines) > ADD_BATCH_MAX_LINES:
+        raise HTTPException(status_code=413, detail=f"Too many data lines: the maximum is {ADD_BATCH_MAX_LINES}.")
+    logger.info("Batch of %d data lines", len(data_lines))
+
+    results: List[AddBatchLineResult] = []
+    movies: List[MovieData] = []
+    valid_results: List[AddBatchLineResult] = []
+    for line_number, data_line in enumerate(data_lines, start=1):
+        movie: Optional[MovieData] = parse_data_line(data_line)
+        if movie is None:
+            results.append(AddBatchLineResult(line=line_number, status="invalid",
+                                              detail="Expected format: 'Title,Director,Age,Year,Genre,Platform1,Platform2'"))
+            continue
+        line_result: AddBatchLineResult = AddBatchLineResult(line=line_number, status="ok")
+        results.append(line_result)
+        valid_results.append(line_result)
+        movies.append(movie)
+
+    if movies:
+        try:
+            movie_ids: List[int] = await run_in_threadpool(cm.add_movies_batch, movies)
+        except PoolTimeoutError:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Batch not added, no changes were made: {e}")
+        for line_result, id_movie in zip(valid_results, movie_ids):
+            line_result.id_movie = id_movie
+
+    status: str = "ok" if len(valid_results) == len(results) else ("partial" if valid_results else "invalid")
+    logger.info("Batch added: %d of %d lines", len(valid_results), len(results))
+    return AddBatchResponse(status=status, results=results)
+
+
+#---------------------------------------------------------- ENDPOINT /export ---------------------------------------------------
+
+def stream_export(cm: ConnectionManager, body: Iterator[bytes], chunks: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    """
+    Questo generatore invia il file esportato e, al termine, restituisce la connessione al pool.
+    Se lo streaming si interrompe (client disconnesso o errore del database), la query viene fermata con KILL QUERY.
+    """
+    finished: bool = False
+    try:
+        yield from body
+        finished = True
+    finally:
+        if not finished:
+            cm.cancel_query()
+        chunks.close()
+        cm.close()
+
+def execute_export(query: str, export_format: str) -> StreamingResponse:
+    """
+    Questa funzione esegue la SELECT in streaming su una connessione dedicata e restituisce la risposta con il file esportato.
+    Se la query non è valida lancia un'eccezione 422 con l'esito della validazione.
+    """
+    export_cm: ConnectionManager = ConnectionManager(EXPORT_QUERY_TIMEOUT)
+    try:
+        sql_validation, results = export_cm.stream_select(query, EXPORT_BATCH_SIZE)
+    except Exception:
+        export_cm.close()
+        raise
+    logger.info("SQL Validation: %s", sql_validation)
+    if results is None:
+        export_cm.close()
+        raise HTTPException(status_code=422, detail=f"Query not exported: sql_validation is '{sql_validation}'.")
+
+    descriptions, chunks = results
+    if export_format == "arrow":
+        body: Iterator[bytes] = arrow_chunks(descriptions, chunks)
+    else:
+        body = csv_chunks([description[0] for description in descriptions], chunks)
+    return StreamingResponse(
+        stream_export(export_cm, body, chunks),
+        media_type=MEDIA_TYPES[export_format],
+        headers={"Content-Disposition": f"attachment; filename=export.{FILE_EXTENSIONS[export_format]}"},
+    )
+
+@app.post("/export")
+async def export(export_request: ExportRequest) -> StreamingResponse:
+    """
+    Questo metodo esporta tutto il risultato di una SELECT, senza paginazione, nel formato richiesto:
+    "csv" oppure "arrow" (Arrow IPC in formato stream, con i tipi delle colonne; richiede pyarrow).
+    Le righe vengono lette dal cursore a blocchi di EXPORT_BATCH_SIZE e inviate appena convertite.
+    La query ha il tempo massimo di esecuzione EXPORT_QUERY_TIMEOUT.
+    """
+    if not export_request.sql_query:
+        raise HTTPException(status_code=422, detail="'sql_query' is a necessary field.")
+    if export_request.format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=422, detail=f"Unknown export format. Expected one of: {', '.join(EXPORT_FORMATS)}.")
+    if export_request.format == "arrow" and not arrow_available():
+        raise HTTPException(status_code=501, detail="Arrow export is not available: pyarrow is not installed.")
+
+    query: str = ConnectionManager.clean_sql_output(export_request.sql_query)
+    logger.info("Cleaned query: %s", query)
+    return await run_in_threadpool(execute_export, query, export_request.format)
+
+
+#---------------------------------------------------------- ENDPOINT /index_advisor ---------------------------------------------------
+
+def recommendation_response(recommendation: IndexRecommendation) -> IndexRecommendationResponse:
+    """
+    Questa funzione trasforma un indice suggerito dall'IndexAdvisor nel modello restituito dagli endpoint.
+    """
+    return IndexRecommendationResponse(
+        table_name=recommendation.table,
+        column_name=recommendation.column,
+        index_name=recommendation.index_name,
+        statement=recommendation.statement,
+        clauses=sorted(recommendation.clauses),
+        queries=recommendation.queries,
+        executions=recommendation.executions,
+    )
+
+
+@app.get("/index_advisor")
+def index_advisor_report(cm: ConnectionManager = Depends(get_connection_manager)) -> IndexAdvisorReport:
+    """
+    Questo metodo restituisce gli indici suggeriti in base alle query eseguite (vedi index_advisor.py), senza crearli.
+    """
+    try:
+        recommendations: List[IndexRecommendation] = index_advisor.recommend(cm, get_schema_cache().get(cm).summary)
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error analysing workload: {e}")
+    return IndexAdvisorReport(
+        recorded_queries=index_advisor.recorded_queries(),
+        workload_queries=len(index_advisor.workload()),
+        recommendations=[recommendation_response(recommendation) for recommendation in recommendations],
+    )
+
+
+@app.post("/index_advisor/apply")
+def index_advisor_apply(apply_request: Optional[IndexApplyRequest] = None,
+                        cm: ConnectionManager = Depends(get_connection_manager)) -> IndexApplyResponse:
+    """
+    Questo metodo crea gli indici suggeriti (tutti, oppure solo quelli indicati in index_names) ed esegue il carico di prova
+    prima e dopo la creazione, restituendo i tempi migliori di ogni query in millisecondi.
+    Se INDEX_ADVISOR_APPLY_ENABLED non è "true" restituisce un errore 403.
+    """
+    if not index_advisor.apply_enabled:
+        raise HTTPException(status_code=403, detail="Index creation is disabled. Set INDEX_ADVISOR_APPLY_ENABLED=true to enable it.")
+
+    try:
+        recommendations: List[IndexRecommendation] = index_advisor.recommend(cm, get_schema_cache().get(cm).summary)
+        if apply_request is not None and apply_request.index_names is not None:
+            recommendations = [recommendation for recommendation in recommendations if recommendation.index_name in apply_request.index_names]
+        if not recommendations:
+            return IndexApplyResponse(status="no_recommendations", applied=[], timings=[], total_before_ms=0, total_after_ms=0)
+
+        before: Dict[str, float] = index_advisor.benchmark(cm)
+        for recommendation in recommendations:
+            cm.create_index(recommendation.statement)
+        after: Dict[str, float] = index_advisor.benchmark(cm)
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error applying indexes: {e}")
+
+    timings: List[QueryTiming] = [
+        QueryTiming(sql_query=sql_query, before_ms=before.get(sql_query), after_ms=after.get(sql_query))
+        for sql_query in dict.fromkeys([*before, *after])
+    ]
+    # I totali considerano solo le query misurate sia prima sia dopo
+    measured: List[str] = [sql_query for sql_query in before if sql_query in after]
+    return IndexApplyResponse(
+        status="ok",
+        applied=[recommendation_response(recommendation) for recommendation in recommendations],
+        timings=timings,
+        total_before_ms=sum(before[sql_query] for sql_query in measured),
+        total_after_ms=sum(after[sql_query] for sql_query in measured),
+    )
+
+
+#---------------------------------------------------------- ENDPOINT /pool_stats ---------------------------------------------------
+
+@app.get("/pool_stats")
+def pool_stats() -> Dict[str, float]:
+    """
+    Questo metodo restituisce le metriche del pool di connessioni: connessioni aperte, libere e in uso,
+    numero di attese e tempo totale e massimo di attesa per ottenere una connessione.
+    """
+    return get_pool().stats()
+
+
+#---------------------------------------------------------- ENDPOINT /metrics ---------------------------------------------------
+
+@app.get("/metrics")
+def metrics() -> Response:
+    """
+    Questo metodo restituisce le metriche del backend nel formato testuale di Prometheus.
+    """
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+#---------------------------------------------------------- ENDPOINT /debug/traces ---------------------------------------------------
+
+def trace_response(root: Span) -> TraceResponse:
+    """
+    Questa funzione trasforma una traccia nella risposta di /debug/traces: gli span sono in ordine di inizio,
+    con l'inizio relativo all'inizio della richiesta.
+    """
+    spans: List[Span] = sorted(root.trace.snapshot(), key=lambda trace_span: trace_span.start_ns)
+    return TraceResponse(
+        trace_id=root.trace.trace_id,
+        name=root.name,
+        status=root.status,
+        start_time=datetime.datetime.fromtimestamp(root.start_ns / 1e9, tz=datetime.timezone.utc).isoformat(),
+        duration_ms=round(root.duration_ms, 3),
+        spans=[TraceSpanResponse(
+            name=trace_span.name,
+            span_id=trace_span.span_id,
+            parent_span_id=trace_span.parent_id,
+            start_offset_ms=round((trace_span.start_ns - root.start_ns) / 1e6, 3),
+            duration_ms=round(trace_span.duration_ms, 3),
+            status=trace_span.status,
+            attributes=trace_span.attributes,
+        ) for trace_span in spans],
+    )
+
+@app.get("/debug/traces")
+def debug_traces(min_duration_ms: Optional[float] = Query(None, ge=0), limit: int = Query(20, ge=1, le=200)) -> List[TraceResponse]:
+    """
+    Questo metodo restituisce le tracce più recenti che sono durate almeno min_duration_ms millisecondi
+    (predefinito: TRACE_SLOW_THRESHOLD_MS), dalla più recente, con la durata di ogni span.
+    """
+    return [trace_response(trace.root) for trace in trace_store.recent(min_duration_ms, limit)]
+
+
+#---------------------------------------------------------- ENDPOINT /cache_stats ---------------------------------------------------
+
+@app.get("/cache_stats")
+def cache_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Questo metodo restituisce le metriche delle cache del backend (dimensione, hit e miss).
+    """
+    return {
+        "schema": get_schema_cache().stats(),
+        "question": question_cache.stats(),
+        "result": result_cache.stats(),
+        "dimension": get_dimension_cache().stats(),
+    }
@@ -1,52 +1,213 @@
 import mariadb
 import os
-from typing import List, Tuple
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import re
 import sqlparse
+import time
+from db_pool import get_pool, PoolTimeoutError
+from cost_guard import CostGuard
+from pagination import Paginator, limit_query
+from schema_cache import get_schema_cache
+from dimension_cache import DirectorEntry, get_dimension_cache
+from app_logging import get_logger
+from tracing import span
 
 """
 Questo file contiene la classe ConnectionManager, che gestisce la connessione ed esegue le query al database all'interno di MariaDB.
+Le connessioni vengono prese in prestito dal pool condiviso (vedi db_pool.py) e restituite con close().
+Ogni ConnectionManager può avere un tempo massimo di esecuzione delle query (set_statement_timeout), applicato da MariaDB
+con la variabile di sessione max_statement_time; una query in corso può essere interrotta da un altro thread con cancel_query().
+Le query interrotte restituiscono lo stato "timeout" o "cancelled" invece di "invalid".
+Gli id di registi e piattaforme usati dagli inserimenti vengono letti e salvati nella cache del processo (vedi dimension_cache.py).
+L'attesa di una connessione dal pool e le query eseguite vengono registrate come span della richiesta in corso (vedi tracing.py).
 """
 
+logger = get_logger("connection_manager")
+
+# Codici di errore di MariaDB che indicano una tabella o una colonna inesistente: lo schema in cache potrebbe essere cambiato
+SCHEMA_CHANGE_ERRORS = (1054, 1146)
+# Query interrotta perché ha superato max_statement_time
+STATEMENT_TIMEOUT_ERROR = 1969
+# Query interrotta da KILL QUERY (ad esempio perché il client HTTP si è disconnesso)
+QUERY_INTERRUPTED_ERROR = 1317
+
+# Funzioni chiamate dopo ogni scrittura confermata (commit), con l'insieme delle tabelle modificate
+_write_listeners: List[Callable[[Set[str]], None]] = []
+
+def register_write_listener(listener: Callable[[Set[str]], None]) -> None:
+    """
+    Questa funzione registra una funzione da chiamare dopo ogni scrittura sul database fatta tramite ConnectionManager,
+    ad esempio per invalidare le cache che dipendono dalle tabelle modificate.
+    """
+    _write_listeners.append(listener)
+
+# Funzioni chiamate dopo ogni SELECT eseguita con successo, con il testo della query
+_query_listeners: List[Callable[[str], None]] = []
+
+def register_query_listener(listener: Callable[[str], None]) -> None:
+    """
+    Questa funzione registra una funzione da chiamare dopo ogni SELECT eseguita tramite ConnectionManager,
+    ad esempio per analizzare il carico di lavoro (vedi index_advisor.py).
+    """
+    _query_listeners.append(listener)
+
+def notify_query_listeners(sql_query: str) -> None:
+    for listener in _query_listeners:
+        listener(sql_query)
+
+# Dati di un film da inserire: titolo, regista, età del regista, anno, genere, piattaforma 1, piattaforma 2
+MovieData = Tuple[str, str, int, int, str, Optional[str], Optional[str]]
+
+# Numero massimo di valori in una clausola IN usata per risolvere gli id di registi, piattaforme e film
+RESOLVE_CHUNK_SIZE = 1000
+
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, statement_timeout: Optional[float] = None):
         self.connection = None
         self.cursor = None
+        self.statement_timeout: Optional[float] = statement_timeout
+        self._timeout_applied: bool = False
+        # Registi e piattaforme usati dalla transazione corrente, salvati nella cache delle dimensioni solo dopo il commit
+        self._pending_directors: Dict[str, DirectorEntry] = {}
+        self._pending_platforms: Dict[str, int] = {}
 
     def connect(self) -> None:
         """
-        Questo metodo stabilisce una connessione al database 'movie_catalog' all'interno di MariaDB utilizzando le credenziali fornite.
+        Questo metodo prende in prestito una connessione al database 'movie_catalog' dal pool condiviso del processo.
+        Se il ConnectionManager ha già una connessione, la riutilizza: la connessione resta in prestito fino alla chiamata di close(),
+        quindi per tutta la durata della richiesta HTTP.
         """
+        if self.connection:
+            return
         try:
-            self.connection = mariadb.connect(
-                user=os.getenv("DB_USER", "root"),
-                password=os.getenv("DB_PASSWORD", "MySQL"),
-                host=os.getenv("DB_HOST", "localhost"),
-                port=int(os.getenv("DB_PORT", 3306)),
-                database=os.getenv("DB_NAME", "movie_catalog")
-            )
+            with span("db.acquire"):
+                self.connection = get_pool().acquire()
             self.cursor = self.connection.cursor()
-            print("Database connection established.", flush=True)
-        except mariadb.Error as e:
-            print(f"Error connecting to MariaDB Platform: {e}")
+            self._apply_statement_timeout()
+        except (mariadb.Error, PoolTimeoutError) as e:
+            logger.error("Error connecting to MariaDB Platform: %s", e)
             raise
 
+    def set_statement_timeout(self, seconds: Optional[float]) -> None:
+        """
+        Questo metodo imposta il tempo massimo di esecuzione di ogni query di questo ConnectionManager (None o 0 = nessun limite).
+        Il limite viene applicato da MariaDB stesso, che interrompe la query allo scadere del tempo.
+        """
+        self.statement_timeout = seconds
+        if self.connection:
+            self._apply_statement_timeout()
+
+    def _apply_statement_timeout(self) -> None:
+        """
+        Questo metodo imposta max_statement_time sulla sessione della connessione presa in prestito.
+        """
+        if self.statement_timeout:
+            self.cursor.execute(f"SET SESSION max_statement_time = {float(self.statement_timeout)}")
+            self._timeout_applied = True
+        elif self._timeout_applied:
+            self.cursor.execute("SET SESSION max_statement_time = DEFAULT")
+            self._timeout_applied = False
+
+    def cancel_query(self) -> None:
+        """
+        Questo metodo interrompe la query in esecuzione sulla connessione di questo ConnectionManager.
+        Va chiamato da un altro thread: il comando KILL QUERY viene inviato da un'altra connessione del pool,
+        mentre il thread che esegue la query riceve l'errore 1317 e restituisce lo stato "cancelled".
+        """
+        connection = self.connection
+        if connection is None:
+            return
+        try:
+            connection_id: int = connection.connection_id
+            killer = get_pool().acquire()
+        except (mariadb.Error, PoolTimeoutError) as e:
+            logger.warning("Query not cancelled: %s", e)
+            return
+        try:
+            killer_cursor = killer.cursor()
+            killer_cursor.execute(f"KILL QUERY {int(connection_id)}")
+            killer_cursor.close()
+            logger.info("Query cancelled on connection %s.", connection_id)
+            get_pool().release(killer)
+        except mariadb.Error as e:
+            logger.warning("Query not cancelled: %s", e)
+            get_pool().release(killer, discard=True)
+
+    def query_error_status(self, error: mariadb.Error) -> str:
+        """
+        Questo metodo traduce l'errore di una SELECT nello stato restituito dagli endpoint:
+        "timeout" se la query ha superato il tempo massimo, "cancelled" se è stata interrotta, altrimenti "invalid".
+        Se l'errore indica una tabella o una colonna inesistente, lo schema in cache viene segnato come da ricaricare.
+        """
+        if error.errno == STATEMENT_TIMEOUT_ERROR:
+            return "timeout"
+        if error.errno == QUERY_INTERRUPTED_ERROR:
+            return "cancelled"
+        if error.errno in SCHEMA_CHANGE_ERRORS:
+            get_schema_cache().mark_stale()
+        return "invalid"
+
     def close(self) -> None:
         """
-        Questo metodo chiude la connessione al database e il cursore.
+        Questo metodo chiude il cursore e restituisce la connessione al pool.
         """
         if self.cursor:
-            self.cursor.close()
+            try:
+                self.cursor.close()
+            except mariadb.Error:
+                pass
+            self.cursor = None
         if self.connection:
-            self.connection.close()
-            print("Database connection closed.", flush=True)
+            discard: bool = False
+            if self._timeout_applied:
+                # La connessione torna al pool senza il limite di tempo di questa richiesta
+                try:
+                    cursor = self.connection.cursor()
+                    cursor.execute("SET SESSION max_statement_time = DEFAULT")
+                    cursor.close()
+                except mariadb.Error:
+                    discard = True
+                self._timeout_applied = False
+            get_pool().release(self.connection, discard=discard)
+            self.connection = None
+        # Una transazione non confermata viene annullata dal pool
+        self._pending_directors = {}
+        self._pending_platforms = {}
+
+    def commit_write(self, tables: Set[str]) -> None:
+        """
+        Questo metodo conferma la transazione corrente e notifica le tabelle modificate ai listener registrati.
+        """
+        self.connection.commit()
+        get_dimension_cache().put(self._pending_directors, self._pending_platforms)
+        self._pending_directors = {}
+        self._pending_platforms = {}
+        for listener in _write_listeners:
+            listener(tables)
+
+    def rollback_write(self) -> None:
+        """
+        Questo metodo annulla la transazione corrente e rimuove dalla cache delle dimensioni i registi e le piattaforme usati,
+        perché l'errore potrebbe essere causato da un id in cache non più valido.
+        """
+        self.connection.rollback()
+        get_dimension_cache().discard(self._pending_directors, self._pending_platforms)
+        self._pending_directors = {}
+        self._pending_platforms = {}
+
+    def __enter__(self) -> "ConnectionManager":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
 
 # ---------------------------------------------------------- QUERY ENDPOINT /search e /sql_search ---------------------------------------------------
 
-    def clean_sql_output(self, response: str) -> str:
+    @staticmethod
+    def clean_sql_output(response: str) -> str:
         """
         Questo metodo pulisce l'output SQL rimuovendo spazi iniziali e finali, delimitatori Markdown e dividendo in statement SQL.
-        Restituisce il primo statement SQL pulito.
+        Restituisce il primo statement SQL pulito. Non usa la connessione, quindi può essere chiamato sulla classe.
         """
         response = response.strip()
 
@@ -59,57 +220,167 @@ class ConnectionManager:
         return statements[0].strip() if statements else ""
     
     
-    def sql_validation(self, sql_query: str) -> str:
+    def classify_statement(self, sql_query: str) -> str:
         """
-        Questo metodo esegue una query per validare la sintassi SQL.
-        Restituisce: "valid" se la sintassi è corretta, 
+        Questo metodo classifica lo statement SQL senza eseguirlo.
+        Restituisce: "select" se è una query di lettura,
                     "unsafe" se contiene comandi di modifica (da evitare),
-                    "invalid" se la sintassi è errata.
+                    "invalid" altrimenti.
         """
-        self.connect()
-        try:
-            if self.connection and self.cursor:
-                if re.match(r'^\s*select\b', sql_query, re.IGNORECASE):
-                    try:
-                        self.cursor.execute(sql_query)
-                        return "valid"
-                    except mariadb.Error as e:
-                        print(f"Error executing query: {e}", flush=True)
-                        return "invalid"
-                elif re.match(r'^\s*(insert|update|delete|drop|create|alter)\b', sql_query, re.IGNORECASE):
-                    return "unsafe"
-                else:
-                    return "invalid"
-            else:
-                print("Connection not established.")
-                raise Exception("Connection not established.")
-        finally:
-            self.close()
+        if re.match(r'^\s*select\b', sql_query, re.IGNORECASE):
+            return "select"
+        elif re.match(r'^\s*(insert|update|delete|drop|create|alter)\b', sql_query, re.IGNORECASE):
+            return "unsafe"
+        else:
+            return "invalid"
+
+    def validate_and_execute(self, sql_query: str, limit: Optional[int] = None) -> Tuple[str, Optional[Tuple[List[str], List[Tuple]]]]:
+        """
+        Questo metodo classifica lo statement e, se è una SELECT, lo esegue una sola volta.
+        Se limit è indicato, la query viene limitata a limit righe dal database (vedi pagination.limit_query),
+        mantenendo il suo ordinamento.
+        Restituisce una tupla (sql_validation, risultati):
+        - ("valid", (colonne, righe)) se la query è stata eseguita correttamente;
+        - ("unsafe", None) se contiene comandi di modifica, che non vengono eseguiti;
+        - ("invalid", None) se non è una SELECT oppure se MariaDB la rifiuta;
+        - ("timeout", None) o ("cancelled", None) se la query è stata interrotta (vedi query_error_status).
+        """
+        statement_type: str = self.classify_statement(sql_query)
+        if statement_type != "select":
+            return (statement_type, None)
+        sql_validation, results = self.execute_select(limit_query(sql_query, limit) if limit is not None else sql_query)
+        if sql_validation == "valid":
+            notify_query_listeners(sql_query)
+        return (sql_validation, results)
+
+    def execute_page(self, sql_query: str, paginator: Paginator, key: str, after: Any = None) -> Tuple[str, Optional[Tuple[List[str], List[Tuple]]]]:
+        """
+        Questo metodo legge una pagina del risultato di una SELECT con la paginazione keyset (vedi pagination.py):
+        le righe con la chiave maggiore di after (o dall'inizio se after è None), ordinate per chiave,
+        fino a una pagina più una riga. Restituisce una tupla (sql_validation, risultati) come validate_and_execute.
+        """
+        if self.classify_statement(sql_query) != "select":
+            return ("invalid", None)
+        page_query: str = paginator.page_query(sql_query, key, after is not None)
+        sql_validation, results = self.execute_select(page_query, (after,) if after is not None else ())
+        if sql_validation == "valid":
+            notify_query_listeners(sql_query)
+        return (sql_validation, results)
 
-            
-    def execute_query(self, sql_query: str) -> Tuple[List[str], List[Tuple]]:
+    def execute_select(self, sql_query: str, params: Tuple = ()) -> Tuple[str, Optional[Tuple[List[str], List[Tuple]]]]:
         """
-        Questo metodo esegue una query SQL e restituisce i risultati e i nomi delle colonne.
+        Questo metodo esegue una SELECT già classificata e restituisce ("valid", (colonne, righe)) oppure (stato dell'errore, None).
         """
         self.connect()
         if self.connection and self.cursor:
             try:
-                self.cursor.execute(sql_query)
-                columns: List[str] = [description[0] for description in self.cursor.description]
-                print("Intestazione della query:", columns, flush=True)
-                results: List[Tuple] = self.cursor.fetchall()
+                with span("db.query", **{"db.statement": sql_query}) as query_span:
+                    self.cursor.execute(sql_query, params)
+                    columns: List[str] = [description[0] for description in self.cursor.description]
+                    results: List[Tuple] = self.cursor.fetchall()
+                    if query_span is not None:
+                        query_span.set_attributes(**{"db.rows": len(results)})
                 self.connection.commit()
-                return (columns, results)
+                return ("valid", (columns, results))
             except mariadb.Error as e:
                 self.connection.rollback()
-                print(f"Error executing query: {e}")
-                raise
-            finally:
-                self.close()
+                logger.warning("Error executing query: %s", e)
+                return (self.query_error_status(e), None)
+        else:
+            logger.error("Connection not established.")
+            raise Exception("Connection not established.")
+
+    def validate_and_stream(self, sql_query: str, chunk_size: int) -> Tuple[str, Optional[Tuple[List[str], Iterator[List[Tuple]]]]]:
+        """
+        Questo metodo è la versione in streaming di validate_and_execute: la SELECT viene eseguita con un cursore non bufferizzato
+        e le righe vengono lette a blocchi di chunk_size con fetchmany, man mano che l'iteratore restituito viene consumato.
+        Così la memoria usata non dipende dalla dimensione del risultato.
+        Restituisce una tupla (sql_validation, risultati) dove i risultati sono (colonne, iteratore dei blocchi di righe).
+        Finché l'iteratore non è esaurito (o chiuso) la connessione è occupata dal risultato e non può eseguire altre query.
+        """
+        sql_validation, results = self.stream_select(sql_query, chunk_size)
+        if results is None:
+            return (sql_validation, None)
+        descriptions, chunks = results
+        return (sql_validation, ([description[0] for description in descriptions], chunks))
+
+    def stream_select(self, sql_query: str, chunk_size: int) -> Tuple[str, Optional[Tuple[List[Tuple], Iterator[List[Tuple]]]]]:
+        """
+        Questo metodo esegue la SELECT in streaming come validate_and_stream, ma restituisce la descrizione completa delle colonne
+        del cursore (nome, tipo, dimensione, precisione, ...) invece dei soli nomi, ad esempio per esportare i risultati con i loro tipi.
+        """
+        statement_type: str = self.classify_statement(sql_query)
+        if statement_type != "select":
+            return (statement_type, None)
+
+        self.connect()
+        if self.connection and self.cursor:
+            cursor = self.connection.cursor(buffered=False)
+            try:
+                # Lo span misura solo l'esecuzione: le righe vengono lette dopo, durante l'invio della risposta
+                with span("db.query", **{"db.statement": sql_query, "db.streaming": True}):
+                    cursor.execute(sql_query)
+                descriptions: List[Tuple] = list(cursor.description)
+            except mariadb.Error as e:
+                cursor.close()
+                self.connection.rollback()
+                logger.warning("Error executing query: %s", e)
+                return (self.query_error_status(e), None)
+            notify_query_listeners(sql_query)
+
+            def fetch_chunks() -> Iterator[List[Tuple]]:
+                try:
+                    while True:
+                        rows: List[Tuple] = cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        yield rows
+                    self.connection.commit()
+                finally:
+                    cursor.close()
+
+            return ("valid", (descriptions, fetch_chunks()))
+        else:
+            logger.error("Connection not established.")
+            raise Exception("Connection not established.")
+
+    def explain_query(self, sql_query: str) -> List[Dict[str, Any]]:
+        """
+        Questo metodo esegue EXPLAIN sulla query senza eseguirla e restituisce il piano di esecuzione,
+        una riga per ogni tabella letta, come dizionari colonna -> valore.
+        """
+        self.connect()
+        if self.connection and self.cursor:
+            with span("db.explain", **{"db.statement": sql_query}):
+                self.cursor.execute(f"EXPLAIN {sql_query}")
+                columns: List[str] = [description[0] for description in self.cursor.description]
+                return [dict(zip(columns, row)) for row in self.cursor.fetchall()]
         else:
-            print("Connection not established. Cannot execute query.")
+            logger.error("Connection not established. Cannot execute query.")
             raise Exception("Connection not established.")
 
+    def check_query_cost(self, sql_query: str, cost_guard: CostGuard) -> Tuple[str, str, Optional[str]]:
+        """
+        Questo metodo stima il costo di una SELECT con EXPLAIN prima di eseguirla.
+        Restituisce una tupla (esito, query, motivo) dove l'esito è:
+        - "ok" se la query può essere eseguita (la query restituita può contenere un LIMIT aggiunto automaticamente);
+        - "too_expensive" se la stima supera le soglie configurate o se la query contiene un prodotto cartesiano,
+          con il motivo del rifiuto;
+        - "invalid" se MariaDB non riesce a costruire il piano di esecuzione.
+        Gli statement che non sono SELECT vengono lasciati alla validazione.
+        """
+        if not cost_guard.enabled or self.classify_statement(sql_query) != "select":
+            return ("ok", sql_query, None)
+
+        try:
+            plan: List[Dict[str, Any]] = self.explain_query(sql_query)
+        except mariadb.Error as e:
+            self.connection.rollback()
+            logger.warning("Error explaining query: %s", e)
+            return (self.query_error_status(e), sql_query, None)
+
+        return cost_guard.check(sql_query, plan)
+
 
 # ---------------------------------------------------------- QUERY ENDPOINT /schema_summary ---------------------------------------------------
 
@@ -121,121 +392,263 @@ class ConnectionManager:
         self.connect()
         if self.connection and self.cursor:
             try:
-                query = "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema = 'movie_catalog'"
+                # Le tabelle di servizio di load_db (load_db_files, load_db_rows) non fanno parte del catalogo
+                query = ("SELECT table_name, column_name FROM information_schema.columns "
+                         "WHERE table_schema = 'movie_catalog' AND table_name NOT LIKE 'load\\_db\\_%'")
                 self.cursor.execute(query)
                 results = self.cursor.fetchall()
                 self.connection.commit()
                 return results
             except mariadb.Error as e:
                 self.connection.rollback()
-                print(f"Error executing query: {e}")
+                logger.error("Error executing query: %s", e)
                 raise
-            finally:
-                self.close()
         else:
-            print("Connection not established. Cannot execute query.")
+            logger.error("Connection not established. Cannot execute query.")
             raise Exception("Connection not established.")
         
-# ---------------------------------------------------------- QUERY ENDPOINT /add ---------------------------------------------------
-        
-    def get_or_create_director(self, name: str, age: int) -> int:
+# ---------------------------------------------------------- QUERY ENDPOINT /index_advisor ---------------------------------------------------
+
+    def query_indexed_columns(self) -> Set[Tuple[str, str]]:
         """
-        Questo metodo esegue una query per ottenere un regista in base al nome fornito.
-        Se il regista esiste, restituisce l'ID del regista.
-        Se il regista non esiste, lo crea e restituisce l'ID del nuovo regista.
+        Questo metodo restituisce le colonne (tabella, colonna) che sono la prima colonna di un indice del database:
+        chiavi primarie, indici UNIQUE, indici creati da InnoDB per le chiavi esterne e indici secondari.
         """
         self.connect()
         if self.connection and self.cursor:
             try:
-                self.cursor.execute("SELECT id, nome, eta FROM directors WHERE nome = ?", [name])
-                director = self.cursor.fetchone()
-                if director:
-                    # Se l'età è cambiata, la aggiorna
-                    if director[2] < age:
-                        self.cursor.execute("UPDATE directors SET eta = ? WHERE id = ?", [age, director[0]])
-                        self.connection.commit()
-                    return director[0]
-                else:
-                    self.cursor.execute("INSERT INTO directors (nome, eta) VALUES (?, ?)", [name, age])
-                    self.connection.commit()
-                    return self.cursor.lastrowid
+                self.cursor.execute("SELECT table_name, column_name FROM information_schema.statistics "
+                                    "WHERE table_schema = 'movie_catalog' AND seq_in_index = 1")
+                results: List[Tuple] = self.cursor.fetchall()
+                self.connection.commit()
+                return {(table_name.lower(), column_name.lower()) for table_name, column_name in results}
             except mariadb.Error as e:
                 self.connection.rollback()
-                print(f"Error executing query: {e}")
+                logger.error("Error executing query: %s", e)
                 raise
-            finally:
-                self.close()
         else:
-            print("Connection not established. Cannot execute query.")
+            logger.error("Connection not established. Cannot execute query.")
             raise Exception("Connection not established.")
-        
-    def get_or_create_platform(self, name: str) -> int:
+
+    def create_index(self, statement: str) -> None:
         """
-        Questo metodo esegue una query per ottenere una piattaforma in base al nome fornito.
-        Se la piattaforma esiste, restituisce l'ID della piattaforma.
-        Se la piattaforma non esiste, la crea e restituisce l'ID della nuova piattaforma.
+        Questo metodo crea un indice con lo statement CREATE INDEX fornito (vedi IndexRecommendation.statement).
+        Gli statement DDL vengono confermati implicitamente da MariaDB.
         """
         self.connect()
         if self.connection and self.cursor:
             try:
-                self.cursor.execute("SELECT id FROM platforms WHERE nome = ?", [name])
-                platform = self.cursor.fetchone()
-                if platform:
-                    return platform[0]
-                else:
-                    self.cursor.execute("INSERT INTO platforms (nome) VALUES (?)", [name])
-                    self.connection.commit()
-                    return self.cursor.lastrowid
+                logger.info("Creating index: %s", statement)
+                self.cursor.execute(statement)
             except mariadb.Error as e:
                 self.connection.rollback()
-                print(f"Error executing query: {e}")
+                logger.error("Error executing query: %s", e)
                 raise
-            finally:
-                self.close()
         else:
-            print("Connection not established. Cannot execute query.")
+            logger.error("Connection not established. Cannot execute query.")
+            raise Exception("Connection not established.")
+
+    def time_query(self, sql_query: str, runs: int) -> Optional[float]:
+        """
+        Questo metodo esegue la SELECT runs volte, leggendo tutte le righe, e restituisce il tempo migliore in secondi.
+        Restituisce None se la query fallisce.
+        """
+        self.connect()
+        if self.connection and self.cursor:
+            best: Optional[float] = None
+            try:
+                for _ in range(max(runs, 1)):
+                    start: float = time.perf_counter()
+                    self.cursor.execute(sql_query)
+                    self.cursor.fetchall()
+                    elapsed: float = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                self.connection.commit()
+                return best
+            except mariadb.Error as e:
+                self.connection.rollback()
+                logger.warning("Error executing query: %s", e)
+                return None
+        else:
+            logger.error("Connection not established. Cannot execute query.")
             raise Exception("Connection not established.")
+
+# ---------------------------------------------------------- QUERY ENDPOINT /add ---------------------------------------------------
         
-    def get_or_create_movie(self, title: str, year: int, genre: str, id_director: int, id_platform1: int = None, id_platform2: int = None) -> int:
+    def add_movie(self, title: str, director: str, age: int, year: int, genre: str,
+                  platform1: Optional[str] = None, platform2: Optional[str] = None) -> int:
+        """
+        Questo metodo inserisce o aggiorna un film con il suo regista e le sue piattaforme in una sola transazione:
+        ogni tabella viene scritta con un unico INSERT ... ON DUPLICATE KEY UPDATE, senza SELECT preliminari,
+        e la transazione viene confermata con un solo commit alla fine.
+        Restituisce l'id del film.
         """
-        Questo metodo esegue una query per ottenere un film in base al titolo fornito.
-        Se il film esiste, restituisce l'ID del film.
-        Se il film non esiste, lo crea e restituisce l'ID del nuovo film."""
         self.connect()
         if self.connection and self.cursor:
             try:
-                self.cursor.execute("SELECT id, titolo, anno, genere, id_director, id_platform1, id_platform2 FROM movies WHERE titolo = ?", [title])
-                movie = self.cursor.fetchone()
-                # Se il film esiste, controlla se l'anno, il genere, il regista o le piattaforme sono cambiati e restituisci l'ID
-                if movie:
-                    # Verifica se l'anno è cambiato
-                    if movie[2] != year:
-                        self.cursor.execute("UPDATE movies SET anno = ? WHERE id = ?", [year, movie[0]])
-                    # Verifica se il genere è cambiato
-                    if movie[3] != genre:
-                        self.cursor.execute("UPDATE movies SET genere = ? WHERE id = ?", [genre, movie[0]])
-                    # Verifica se il regista è cambiato
-                    if movie[4] != id_director:
-                        self.cursor.execute("UPDATE movies SET id_director = ? WHERE id = ?", [id_director, movie[0]])
-                    # Verifica se le piattaforma 1 è cambiata
-                    if movie[5] != id_platform1:
-                        self.cursor.execute("UPDATE movies SET id_platform1 = ? WHERE id = ?", [id_platform1, movie[0]])
-                    # Verifica se le piattaforma 2 è cambiata
-                    if movie[6] != id_platform2:
-                        self.cursor.execute("UPDATE movies SET id_platform2 = ? WHERE id = ?", [id_platform2, movie[0]])
-                    self.connection.commit()
-                    return movie[0]
-                else:
-                    self.cursor.execute("INSERT INTO movies (titolo, anno, genere, id_director, id_platform1, id_platform2) VALUES (?, ?, ?, ?, ?, ?)",
-                                       [title, year, genre, id_director, id_platform1, id_platform2])
-                    self.connection.commit()
-                    return self.cursor.lastrowid
+                id_director: int = self._upsert_director(director, age)
+                id_platform1: Optional[int] = self._upsert_platform(platform1) if platform1 else None
+                id_platform2: Optional[int] = self._upsert_platform(platform2) if platform2 else None
+                id_movie: int = self._upsert_movie(title, year, genre, id_director, id_platform1, id_platform2)
+                self.commit_write({"directors", "platforms", "movies"})
+                return id_movie
+            except mariadb.Error as e:
+                self.rollback_write()
+                logger.error("Error executing query: %s", e)
+                raise
+        else:
+            logger.error("Connection not established. Cannot execute query.")
+            raise Exception("Connection not established.")
+
+    def load_dimension_cache(self) -> None:
+        """
+        Questo metodo carica nella cache delle dimensioni gli id di registi e piattaforme (fino alla capacità della cache),
+        così i primi inserimenti non devono scrivere o rileggere le dimensioni già presenti.
+        """
+        cache = get_dimension_cache()
+        if cache.capacity <= 0:
+            return
+        self.connect()
+        if self.connection and self.cursor:
+            try:
+                self.cursor.execute(f"SELECT id, nome, eta FROM directors LIMIT {cache.capacity}")
+                directors: Dict[str, DirectorEntry] = {name: (row_id, age) for row_id, name, age in self.cursor.fetchall()}
+                self.cursor.execute(f"SELECT id, nome FROM platforms LIMIT {cache.capacity}")
+                platforms: Dict[str, int] = {name: row_id for row_id, name in self.cursor.fetchall()}
+                self.connection.commit()
+                cache.put(directors, platforms)
+                logger.info("Dimension cache loaded: %d directors, %d platforms.", len(directors), len(platforms))
             except mariadb.Error as e:
                 self.connection.rollback()
-                print(f"Error executing query: {e}")
+                logger.error("Error executing query: %s", e)
                 raise
-            finally:
-                self.close()
         else:
-            print("Connection not established. Cannot execute query.")
+            logger.error("Connection not established. Cannot execute query.")
             raise Exception("Connection not established.")
+
+    # Negli upsert, "id = LAST_INSERT_ID(id)" fa sì che lastrowid contenga l'id della riga anche quando esisteva già,
+    # così non serve una SELECT per leggerlo. L'unicità di nome e titolo rende l'operazione atomica anche con richieste concorrenti.
+
+    # Registi e piattaforme già in cache non vengono scritti: l'upsert non cambierebbe nulla.
+
+    def _upsert_director(self, name: str, age: int) -> int:
+        id_director: Optional[int] = get_dimension_cache().get_director(name, age)
+        if id_director is None:
+            self.cursor.execute(
+                "INSERT INTO directors (nome, eta) VALUES (?, ?) "
+                "ON DUPLICATE KEY UPDATE eta = GREATEST(eta, VALUES(eta)), id = LAST_INSERT_ID(id)",
+                [name, age])
+            id_director = self.cursor.lastrowid
+        self._pending_directors[name] = (id_director, age)
+        return id_director
+
+    def _upsert_platform(self, name: str) -> int:
+        id_platform: Optional[int] = get_dimension_cache().get_platform(name)
+        if id_platform is None:
+            self.cursor.execute("INSERT INTO platforms (nome) VALUES (?) ON DUPLICATE KEY UPDATE id = LAST_INSERT_ID(id)", [name])
+            id_platform = self.cursor.lastrowid
+        self._pending_platforms[name] = id_platform
+        return id_platform
+
+    def _upsert_movie(self, title: str, year: int, genre: str, id_director: int,
+                      id_platform1: Optional[int] = None, id_platform2: Optional[int] = None) -> int:
+        self.cursor.execute(
+            "INSERT INTO movies (titolo, anno, genere, id_director, id_platform1, id_platform2) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON DUPLICATE KEY UPDATE anno = VALUES(anno), genere = VALUES(genere), id_director = VALUES(id_director), "
+            "id_platform1 = VALUES(id_platform1), id_platform2 = VALUES(id_platform2), id = LAST_INSERT_ID(id)",
+            [title, year, genre, id_director, id_platform1, id_platform2])
+        return self.cursor.lastrowid
+
+    def add_movies_batch(self, movies: List[MovieData]) -> List[int]:
+        """
+        Questo metodo inserisce o aggiorna molti film in una sola transazione, con query su insiemi invece che riga per riga:
+        1. tutti i registi con un unico executemany (INSERT ... ON DUPLICATE KEY UPDATE, l'età viene aggiornata solo se maggiore);
+        2. tutte le piattaforme con un unico executemany;
+        3. gli id di registi e piattaforme letti con poche SELECT ... WHERE nome IN (...);
+        i registi e le piattaforme già nella cache delle dimensioni saltano i passi 1, 2 e 3;
+        4. tutti i film con un unico executemany (INSERT ... ON DUPLICATE KEY UPDATE sul titolo).
+        Restituisce gli id dei film, nello stesso ordine dei dati in input.
+        Se una query fallisce viene annullata l'intera transazione e l'eccezione viene rilanciata.
+        """
+        self.connect()
+        if self.connection and self.cursor:
+            try:
+                director_ages: Dict[str, int] = {}
+                platforms: Set[str] = set()
+                for _, director, age, _, _, platform1, platform2 in movies:
+                    director_ages[director] = max(age, director_ages.get(director, age))
+                    platforms.update(platform for platform in (platform1, platform2) if platform)
+
+                # Registi e piattaforme già in cache non vengono né scritti né riletti
+                director_ids: Dict[str, int] = {}
+                platform_ids: Dict[str, int] = {}
+                for director, age in director_ages.items():
+                    cached_id: Optional[int] = get_dimension_cache().get_director(director, age)
+                    if cached_id is not None:
+                        director_ids[director] = cached_id
+                for platform in platforms:
+                    cached_id = get_dimension_cache().get_platform(platform)
+                    if cached_id is not None:
+                        platform_ids[platform] = cached_id
+                new_directors: List[Tuple[str, int]] = [(director, age) for director, age in director_ages.items() if director not in director_ids]
+                new_platforms: List[str] = [platform for platform in platforms if platform not in platform_ids]
+
+                if new_directors:
+                    self.cursor.executemany(
+                        "INSERT INTO directors (nome, eta) VALUES (?, ?) ON DUPLICATE KEY UPDATE eta = GREATEST(eta, VALUES(eta))",
+                        new_directors)
+                if new_platforms:
+                    self.cursor.executemany("INSERT INTO platforms (nome) VALUES (?) ON DUPLICATE KEY UPDATE nome = nome",
+                                            [(platform,) for platform in new_platforms])
+
+                director_ids.update(self._resolve_ids("directors", "nome", (director for director, _ in new_directors)))
+                platform_ids.update(self._resolve_ids("platforms", "nome", new_platforms))
+                self._pending_directors.update({director: (director_ids[director], age) for director, age in director_ages.items()})
+                self._pending_platforms.update(platform_ids)
+
+                # Se lo stesso titolo compare più volte, vale l'ultima riga
+                movie_rows: Dict[str, Tuple] = {
+                    title: (title, year, genre, director_ids[director],
+                            platform_ids[platform1] if platform1 else None, platform_ids[platform2] if platform2 else None)
+                    for title, director, _, year, genre, platform1, platform2 in movies
+                }
+                if movie_rows:
+                    self.cursor.executemany(
+                        "INSERT INTO movies (titolo, anno, genere, id_director, id_platform1, id_platform2) VALUES (?, ?, ?, ?, ?, ?) "
+                        "ON DUPLICATE KEY UPDATE anno = VALUES(anno), genere = VALUES(genere), id_director = VALUES(id_director), "
+                        "id_platform1 = VALUES(id_platform1), id_platform2 = VALUES(id_platform2)",
+                        list(movie_rows.values()))
+                movie_ids: Dict[str, int] = self._resolve_ids("movies", "titolo", movie_rows)
+
+                self.commit_write({"directors", "platforms", "movies"})
+                return [movie_ids[movie[0]] for movie in movies]
+            except mariadb.Error as e:
+                self.rollback_write()
+                logger.error("Error executing query: %s", e)
+                raise
+        else:
+            logger.error("Connection not established. Cannot execute query.")
+            raise Exception("Connection not established.")
+
+    def _resolve_ids(self, table: str, column: str, names: Iterable[str]) -> Dict[str, int]:
+        """
+        Questo metodo restituisce l'id di ogni nome (o titolo) della tabella indicata, leggendoli a blocchi con WHERE column IN (...).
+        Il confronto di MariaDB ignora maiuscole e minuscole (e, a seconda della collation, gli accenti): i nomi non trovati
+        confrontando le stringhe in minuscolo vengono cercati uno alla volta.
+        """
+        names = list(names)
+        found: Dict[str, int] = {}
+        for start in range(0, len(names), RESOLVE_CHUNK_SIZE):
+            chunk: List[str] = names[start:start + RESOLVE_CHUNK_SIZE]
+            placeholders: str = ", ".join("?" for _ in chunk)
+            self.cursor.execute(f"SELECT id, {column} FROM {table} WHERE {column} IN ({placeholders})", chunk)
+            found.update({name.lower(): row_id for row_id, name in self.cursor.fetchall()})
+
+        ids: Dict[str, int] = {}
+        for name in names:
+            if name.lower() in found:
+                ids[name] = found[name.lower()]
+            else:
+                self.cursor.execute(f"SELECT id FROM {table} WHERE {column} = ?", [name])
+                ids[name] = self.cursor.fetchone()[0]
+        return ids
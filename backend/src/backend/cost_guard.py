@@ -0,0 +1,99 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from app_logging import get_logger
+from pagination import TRAILING_LIMIT_PATTERN, limit_query, strip_literals
+
+"""
+Questo file contiene la classe CostGuard, che stima il costo di una query SELECT a partire dal suo piano di esecuzione (EXPLAIN)
+prima di eseguirla sul database. Serve soprattutto per le query generate dal modello di IA, che possono contenere join cartesiani
+accidentali tra movies, directors e platforms.
+Le soglie sono configurabili tramite variabili d'ambiente:
+- COST_GUARD_ENABLED: se "false", la stima del costo viene saltata.
+- COST_GUARD_MAX_ROWS: numero stimato di righe oltre il quale la query viene rifiutata con lo stato "too_expensive".
+- COST_GUARD_LIMIT_ROWS: numero stimato di righe oltre il quale, se la query non ha già un LIMIT, ne viene aggiunto uno
+  (con pagination.limit_query, su una nuova riga, così non finisce dentro un commento finale).
+- COST_GUARD_AUTO_LIMIT: valore del LIMIT aggiunto automaticamente.
+- COST_GUARD_REJECT_CARTESIAN: se "true" (predefinito), le query con un join senza condizioni (prodotto cartesiano)
+  vengono rifiutate con lo stato "too_expensive" anche se la stima delle righe è sotto le soglie.
+Quando una query viene rifiutata, il motivo viene restituito nel campo detail della risposta.
+"""
+
+logger = get_logger("cost_guard")
+
+class CostGuard:
+    def __init__(self, enabled: bool, max_rows: int, limit_rows: int, auto_limit: int, reject_cartesian: bool = True):
+        self.enabled: bool = enabled
+        self.max_rows: int = max_rows
+        self.limit_rows: int = limit_rows
+        self.auto_limit: int = auto_limit
+        self.reject_cartesian: bool = reject_cartesian
+
+    @classmethod
+    def from_env(cls) -> "CostGuard":
+        """
+        Questo metodo crea un CostGuard leggendo le soglie dalle variabili d'ambiente.
+        """
+        return cls(
+            enabled=os.getenv("COST_GUARD_ENABLED", "true").lower() == "true",
+            max_rows=int(os.getenv("COST_GUARD_MAX_ROWS", 1000000)),
+            limit_rows=int(os.getenv("COST_GUARD_LIMIT_ROWS", 10000)),
+            auto_limit=int(os.getenv("COST_GUARD_AUTO_LIMIT", 1000)),
+            reject_cartesian=os.getenv("COST_GUARD_REJECT_CARTESIAN", "true").lower() == "true",
+        )
+
+    def estimate_rows(self, plan: List[Dict[str, Any]]) -> Tuple[int, bool]:
+        """
+        Questo metodo stima il numero di righe esaminate a partire dalle righe dell'EXPLAIN.
+        All'interno della stessa SELECT (stesso id) le tabelle vengono unite in nested loop, quindi le stime si moltiplicano
+        (fan-out del join); le diverse SELECT (subquery, UNION) si sommano.
+        Restituisce la stima e un flag che indica se il piano contiene un join senza condizioni (prodotto cartesiano).
+        """
+        fanout_by_select: Dict[Any, int] = {}
+        tables_by_select: Dict[Any, int] = {}
+        unconstrained_by_select: Dict[Any, int] = {}
+
+        for step in plan:
+            select_id: Any = step.get("id")
+            rows: int = int(step.get("rows") or 1)
+            fanout_by_select[select_id] = fanout_by_select.get(select_id, 1) * max(rows, 1)
+            tables_by_select[select_id] = tables_by_select.get(select_id, 0) + 1
+
+            # Una tabella letta per intero senza riferimenti alle altre tabelle del join né condizioni ("Using where"):
+            # un join con condizione eseguito con il join buffer ha comunque "Using where" e non viene contato
+            if step.get("type") == "ALL" and not step.get("ref") and "Using where" not in (step.get("Extra") or ""):
+                unconstrained_by_select[select_id] = unconstrained_by_select.get(select_id, 0) + 1
+
+        estimated_rows: int = sum(fanout_by_select.values())
+        is_cartesian: bool = any(
+            tables_by_select[select_id] > 1 and unconstrained_by_select.get(select_id, 0) > 1
+            for select_id in tables_by_select
+        )
+        return (estimated_rows, is_cartesian)
+
+    def check(self, sql_query: str, plan: List[Dict[str, Any]]) -> Tuple[str, str, Optional[str]]:
+        """
+        Questo metodo decide se una query può essere eseguita in base al suo piano di esecuzione.
+        Restituisce una tupla (esito, query, motivo):
+        - ("ok", query, None) se la stima è sotto le soglie, con la query eventualmente limitata da un LIMIT aggiunto automaticamente;
+        - ("too_expensive", query, motivo) se la stima supera COST_GUARD_MAX_ROWS oppure se la query contiene
+          un prodotto cartesiano (con COST_GUARD_REJECT_CARTESIAN attivo).
+        """
+        if not self.enabled:
+            return ("ok", sql_query, None)
+
+        estimated_rows, is_cartesian = self.estimate_rows(plan)
+        logger.debug("Estimated rows: %d, cartesian join: %s", estimated_rows, is_cartesian)
+
+        if is_cartesian and self.reject_cartesian:
+            return ("too_expensive", sql_query, "The query joins tables without a join condition (cartesian product).")
+
+        if estimated_rows > self.max_rows:
+            return ("too_expensive", sql_query,
+                    f"The query would examine about {estimated_rows} rows, more than the limit of {self.max_rows}.")
+
+        if estimated_rows > self.limit_rows and TRAILING_LIMIT_PATTERN.search(strip_literals(sql_query)) is None:
+            limited_query: str = limit_query(sql_query, self.auto_limit)
+            logger.info("Query automatically limited: %s", limited_query)
+            return ("ok", limited_query, None)
+
+        return ("ok", sql_query, None)
@@ -0,0 +1,238 @@
+import mariadb
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+from app_logging import get_logger
+
+"""
+Questo file contiene la classe ConnectionPool, un pool di connessioni a MariaDB condiviso da tutto il processo del backend.
+Le connessioni vengono aperte una sola volta e riutilizzate tra le richieste, evitando l'handshake TCP e l'autenticazione
+ad ogni chiamata. Il pool è configurabile tramite variabili d'ambiente:
+- DB_POOL_SIZE: numero massimo di connessioni aperte contemporaneamente.
+- DB_POOL_TIMEOUT: secondi di attesa massima per ottenere una connessione quando il pool è esaurito;
+  oltre questo tempo il backend risponde con lo status 503 e l'intestazione Retry-After (DB_POOL_RETRY_AFTER secondi).
+- DB_POOL_IDLE_TIMEOUT: secondi dopo i quali una connessione inutilizzata viene chiusa.
+- DB_POOL_PRE_PING: se "true", verifica che la connessione sia ancora viva prima di consegnarla.
+"""
+
+logger = get_logger("db_pool")
+
+class PoolTimeoutError(Exception):
+    """
+    Eccezione sollevata quando non è possibile ottenere una connessione dal pool entro il tempo massimo di attesa.
+    """
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, size: int, timeout: float, idle_timeout: float, pre_ping: bool, connect_kwargs: Dict[str, Any]):
+        self.size: int = size
+        self.timeout: float = timeout
+        self.idle_timeout: float = idle_timeout
+        self.pre_ping: bool = pre_ping
+        self.connect_kwargs: Dict[str, Any] = connect_kwargs
+
+        # Connessioni libere, con l'istante in cui sono state restituite al pool
+        self._idle: Deque[Tuple[mariadb.Connection, float]] = deque()
+        self._open: int = 0
+        self._condition: threading.Condition = threading.Condition()
+
+        # Metriche del pool
+        self._created: int = 0
+        self._closed: int = 0
+        self._checkouts: int = 0
+        self._waits: int = 0
+        self._timeouts: int = 0
+        self._ping_failures: int = 0
+        self._wait_time_total: float = 0.0
+        self._wait_time_max: float = 0.0
+
+    def acquire(self) -> mariadb.Connection:
+        """
+        Questo metodo restituisce una connessione dal pool.
+        Se non ci sono connessioni libere e il pool non ha raggiunto la dimensione massima, ne apre una nuova.
+        Altrimenti attende che un'altra richiesta restituisca una connessione, fino a DB_POOL_TIMEOUT secondi.
+        """
+        start: float = time.monotonic()
+        waited: bool = False
+
+        with self._condition:
+            while True:
+                self._evict_idle()
+                if self._idle:
+                    connection, _ = self._idle.pop()
+                    break
+                if self._open < self.size:
+                    # Riserva il posto prima di aprire la connessione fuori dal lock
+                    self._open += 1
+                    connection = None
+                    break
+
+                remaining: float = self.timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeoutError(f"No database connection available after {self.timeout} seconds.")
+                waited = True
+                self._condition.wait(remaining)
+
+            self._checkouts += 1
+            if waited:
+                wait_time: float = time.monotonic() - start
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        if connection is None:
+            return self._open_connection()
+
+        if self.pre_ping and not self._ping(connection):
+            # La connessione morta viene sostituita mantenendo il suo posto nel pool, così nessun'altra richiesta può occuparlo
+            self._close_quietly(connection)
+            with self._condition:
+                self._closed += 1
+            return self._open_connection()
+
+        return connection
+
+    def release(self, connection: mariadb.Connection, discard: bool = False) -> None:
+        """
+        Questo metodo restituisce una connessione al pool.
+        Eventuali transazioni lasciate aperte vengono annullate, in modo che la richiesta successiva trovi la connessione pulita.
+        Se discard è True, o se il rollback fallisce, la connessione viene chiusa invece di essere riutilizzata.
+        """
+        if not discard:
+            try:
+                connection.rollback()
+            except mariadb.Error:
+                discard = True
+
+        if discard:
+            self._discard(connection)
+            return
+
+        with self._condition:
+            self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Questo metodo restituisce le metriche correnti del pool.
+        """
+        with self._condition:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "created": self._created,
+                "closed": self._closed,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "timeouts": self._timeouts,
+                "ping_failures": self._ping_failures,
+                "wait_time_total": self._wait_time_total,
+                "wait_time_max": self._wait_time_max,
+            }
+
+    def close_all(self) -> None:
+        """
+        Questo metodo chiude tutte le connessioni libere del pool.
+        """
+        with self._condition:
+            idle: Deque[Tuple[mariadb.Connection, float]] = self._idle
+            self._idle = deque()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def _open_connection(self) -> mariadb.Connection:
+        """
+        Questo metodo apre una nuova connessione. Se l'apertura fallisce, libera il posto riservato nel pool.
+        """
+        try:
+            connection: mariadb.Connection = mariadb.connect(**self.connect_kwargs)
+        except mariadb.Error:
+            with self._condition:
+                self._open -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._created += 1
+        logger.info("Database connection established.")
+        return connection
+
+    def _discard(self, connection: mariadb.Connection) -> None:
+        """
+        Questo metodo chiude definitivamente una connessione e libera il suo posto nel pool.
+        """
+        self._close_quietly(connection)
+        with self._condition:
+            self._open -= 1
+            self._closed += 1
+            self._condition.notify()
+
+    def _close_quietly(self, connection: mariadb.Connection) -> None:
+        """
+        Questo metodo chiude una connessione ignorando gli errori (ad esempio se il server l'ha già chiusa).
+        """
+        try:
+            connection.close()
+        except mariadb.Error:
+            pass
+        logger.info("Database connection closed.")
+
+    def _ping(self, connection: mariadb.Connection) -> bool:
+        """
+        Questo metodo verifica che la connessione sia ancora utilizzabile.
+        """
+        try:
+            connection.ping()
+            return True
+        except mariadb.Error:
+            with self._condition:
+                self._ping_failures += 1
+            return False
+
+    def _evict_idle(self) -> None:
+        """
+        Questo metodo chiude le connessioni rimaste inutilizzate per più di DB_POOL_IDLE_TIMEOUT secondi.
+        Va chiamato tenendo il lock del pool; le connessioni più vecchie si trovano in testa alla coda.
+        """
+        if self.idle_timeout <= 0:
+            return
+        now: float = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            connection, _ = self._idle.popleft()
+            self._close_quietly(connection)
+            self._open -= 1
+            self._closed += 1
+
+
+# ---------------------------------------------------------- POOL CONDIVISO DAL PROCESSO ---------------------------------------------------
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock: threading.Lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """
+    Questa funzione restituisce il pool di connessioni del processo, creandolo alla prima chiamata con le credenziali del database.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    size=int(os.getenv("DB_POOL_SIZE", 10)),
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+                    idle_timeout=float(os.getenv("DB_POOL_IDLE_TIMEOUT", 300)),
+                    pre_ping=os.getenv("DB_POOL_PRE_PING", "true").lower() == "true",
+                    connect_kwargs={
+                        "user": os.getenv("DB_USER", "root"),
+                        "password": os.getenv("DB_PASSWORD", "MySQL"),
+                        "host": os.getenv("DB_HOST", "localhost"),
+                        "port": int(os.getenv("DB_PORT", 3306)),
+                        "database": os.getenv("DB_NAME", "movie_catalog"),
+                    },
+                )
+    return _pool
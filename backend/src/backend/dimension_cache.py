@@ -0,0 +1,121 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+"""
+Questo file contiene la classe DimensionCache, una cache in memoria degli id di registi e piattaforme, condivisa da tutto il processo del backend.
+Le tabelle directors e platforms sono piccole e usate da ogni inserimento: con gli id in cache, /add e /add_batch
+non devono rileggerle (o riscriverle) per ogni regista o piattaforma già nota.
+La chiave è il nome in minuscolo, perché MariaDB confronta i nomi senza distinguere maiuscole e minuscole;
+per i registi viene salvata anche l'età, così l'upsert viene saltato solo se l'età in input non è maggiore di quella salvata.
+Gli id letti o scritti durante una transazione vengono aggiunti alla cache solo dopo il commit (vedi ConnectionManager.commit_write);
+se la transazione viene annullata, i nomi usati vengono rimossi dalla cache, perché l'errore potrebbe dipendere da un id non più valido.
+Le righe di directors e platforms non vengono mai cancellate dal backend né da load_db, quindi gli id in cache restano validi.
+Variabili d'ambiente:
+- DIMENSION_CACHE_SIZE: numero massimo di registi e di piattaforme in cache (0 = cache disattivata).
+"""
+
+DirectorEntry = Tuple[int, int]
+
+class DimensionCache:
+    def __init__(self, capacity: int):
+        self.capacity: int = capacity
+        # Nome in minuscolo -> (id, età) e nome in minuscolo -> id; l'ordine dei dizionari è l'ordine di utilizzo (LRU)
+        self._directors: "OrderedDict[str, DirectorEntry]" = OrderedDict()
+        self._platforms: "OrderedDict[str, int]" = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._hits: int = 0
+        self._misses: int = 0
+
+    def get_director(self, name: str, age: int) -> Optional[int]:
+        """
+        Questo metodo restituisce l'id del regista se è in cache con un'età maggiore o uguale a quella fornita, altrimenti None.
+        """
+        with self._lock:
+            entry: Optional[DirectorEntry] = self._directors.get(name.lower())
+            if entry is None or entry[1] < age:
+                self._misses += 1
+                return None
+            self._directors.move_to_end(name.lower())
+            self._hits += 1
+            return entry[0]
+
+    def get_platform(self, name: str) -> Optional[int]:
+        """
+        Questo metodo restituisce l'id della piattaforma se è in cache, altrimenti None.
+        """
+        with self._lock:
+            row_id: Optional[int] = self._platforms.get(name.lower())
+            if row_id is None:
+                self._misses += 1
+                return None
+            self._platforms.move_to_end(name.lower())
+            self._hits += 1
+            return row_id
+
+    def put(self, directors: Dict[str, DirectorEntry], platforms: Dict[str, int]) -> None:
+        """
+        Questo metodo salva in cache gli id di registi e piattaforme confermati da un commit.
+        Per un regista già in cache viene mantenuta l'età maggiore, come fa l'upsert sul database.
+        """
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            for name, (row_id, age) in directors.items():
+                previous: Optional[DirectorEntry] = self._directors.get(name.lower())
+                self._directors[name.lower()] = (row_id, max(age, previous[1]) if previous else age)
+                self._directors.move_to_end(name.lower())
+            for name, row_id in platforms.items():
+                self._platforms[name.lower()] = row_id
+                self._platforms.move_to_end(name.lower())
+            while len(self._directors) > self.capacity:
+                self._directors.popitem(last=False)
+            while len(self._platforms) > self.capacity:
+                self._platforms.popitem(last=False)
+
+    def discard(self, directors: Iterable[str], platforms: Iterable[str]) -> None:
+        """
+        Questo metodo rimuove dalla cache i registi e le piattaforme indicati, ad esempio quelli usati da una transazione annullata.
+        """
+        with self._lock:
+            for name in directors:
+                self._directors.pop(name.lower(), None)
+            for name in platforms:
+                self._platforms.pop(name.lower(), None)
+
+    def clear(self) -> None:
+        """
+        Questo metodo svuota la cache.
+        """
+        with self._lock:
+            self._directors.clear()
+            self._platforms.clear()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Questo metodo restituisce le metriche della cache: registi e piattaforme in cache, hit e miss.
+        """
+        return {
+            "directors": len(self._directors),
+            "platforms": len(self._platforms),
+            "hits": self._hits,
+            "misses": self._misses,
+        }
+
+
+# ---------------------------------------------------------- CACHE CONDIVISA DAL PROCESSO ---------------------------------------------------
+
+_dimension_cache: Optional[DimensionCache] = None
+_dimension_cache_lock: threading.Lock = threading.Lock()
+
+def get_dimension_cache() -> DimensionCache:
+    """
+    Questa funzione restituisce la cache di registi e piattaforme del processo, creandola alla prima chiamata.
+    """
+    global _dimension_cache
+    if _dimension_cache is None:
+        with _dimension_cache_lock:
+            if _dimension_cache is None:
+                _dimension_cache = DimensionCache(capacity=int(os.getenv("DIMENSION_CACHE_SIZE", 10000)))
+    return _dimension_cache
@@ -0,0 +1,119 @@
+import csv
+import io
+from typing import Any, Callable, Iterator, List, Tuple
+from mariadb.constants import FIELD_TYPE
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+"""
+Questo file contiene le funzioni che trasformano i risultati di una SELECT, letti a blocchi dal cursore (vedi ConnectionManager.stream_select),
+nei formati dell'endpoint /export:
+- CSV: intestazione con i nomi delle colonne e una riga per ogni risultato;
+- Arrow IPC (formato stream): lo schema con i tipi delle colonne, ricavati dai tipi di MariaDB, e un record batch per ogni blocco di righe.
+Ogni blocco viene convertito e inviato appena letto, quindi la memoria usata non dipende dalla dimensione del risultato.
+Il formato Arrow richiede il pacchetto pyarrow; se non è installato è disponibile solo il CSV.
+"""
+
+EXPORT_FORMATS: Tuple[str, ...] = ("csv", "arrow")
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+FILE_EXTENSIONS = {
+    "csv": "csv",
+    "arrow": "arrows",
+}
+
+# Fine dello stream Arrow IPC: marcatore di continuazione seguito da un messaggio di lunghezza zero
+ARROW_END_OF_STREAM: bytes = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+INTEGER_TYPES = (FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG, FIELD_TYPE.INT24, FIELD_TYPE.LONGLONG, FIELD_TYPE.YEAR)
+FLOAT_TYPES = (FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE, FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL)
+DATETIME_TYPES = (FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP)
+
+
+def arrow_available() -> bool:
+    return pa is not None
+
+
+def csv_chunks(columns: List[str], chunks: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    """
+    Questa funzione produce il CSV un blocco di righe alla volta. I valori NULL diventano campi vuoti.
+    """
+    buffer: io.StringIO = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for rows in chunks:
+        writer.writerows(["" if value is None else value for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def arrow_type(type_code: int) -> "pa.DataType":
+    """
+    Questa funzione restituisce il tipo Arrow corrispondente al tipo di una colonna di MariaDB.
+    I tipi senza un equivalente diretto (testo, ENUM, JSON, TIME, ...) vengono esportati come stringhe.
+    """
+    if type_code in INTEGER_TYPES:
+        return pa.int64()
+    if type_code in FLOAT_TYPES:
+        return pa.float64()
+    if type_code == FIELD_TYPE.DATE:
+        return pa.date32()
+    if type_code in DATETIME_TYPES:
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def string_value(value: Any) -> Any:
+    """
+    Questa funzione converte in stringa i valori delle colonne esportate come stringhe.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+def float_value(value: Any) -> Any:
+    """
+    Questa funzione converte in float i valori delle colonne numeriche non intere (i DECIMAL arrivano come decimal.Decimal).
+    """
+    return None if value is None else float(value)
+
+
+def value_converter(data_type: "pa.DataType") -> Callable[[Any], Any]:
+    """
+    Questa funzione restituisce la conversione da applicare ai valori di una colonna prima di creare l'array Arrow.
+    """
+    if data_type == pa.string():
+        return string_value
+    if data_type == pa.float64():
+        return float_value
+    return lambda value: value
+
+
+def arrow_chunks(descriptions: List[Tuple], chunks: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    """
+    Questa funzione produce lo stream Arrow IPC: prima lo schema, poi un record batch per ogni blocco di righe,
+    infine il marcatore di fine stream. descriptions è la descrizione delle colonne del cursore.
+    """
+    schema: "pa.Schema" = pa.schema([pa.field(description[0], arrow_type(description[1])) for description in descriptions])
+    converters: List[Callable[[Any], Any]] = [value_converter(field.type) for field in schema]
+    yield schema.serialize().to_pybytes()
+    for rows in chunks:
+        arrays: List["pa.Array"] = [
+            pa.array([converter(row[i]) for row in rows], type=field.type)
+            for i, (field, converter) in enumerate(zip(schema, converters))
+        ]
+        yield pa.RecordBatch.from_arrays(arrays, schema=schema).serialize().to_pybytes()
+    yield ARROW_END_OF_STREAM
@@ -0,0 +1,220 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set, Tuple
+from result_cache import QUOTED_PATTERN, normalize_sql
+from app_logging import get_logger
+
+"""
+Questo file contiene la classe IndexAdvisor, che suggerisce gli indici secondari da aggiungere alle tabelle del catalogo
+a partire dalle query realmente eseguite.
+Ogni SELECT eseguita con successo da ConnectionManager viene registrata (query normalizzata e numero di esecuzioni).
+Il rapporto (endpoint /index_advisor) analizza le query registrate:
+1. le colonne usate nelle clausole WHERE, ON (join) e ORDER BY vengono attribuite alle tabelle della query, risolvendo gli alias;
+2. con EXPLAIN vengono individuate le tabelle lette per intero (type = ALL) e gli ordinamenti senza indice (Using filesort);
+3. una colonna diventa una raccomandazione se è usata su una tabella letta per intero (o ordinata senza indice)
+   e non è già la prima colonna di un indice esistente (chiavi primarie, UNIQUE e indici creati da InnoDB per le chiavi esterne).
+Le raccomandazioni possono essere applicate (endpoint /index_advisor/apply): il carico di prova viene eseguito prima e dopo
+la creazione degli indici, per confrontare i tempi. Il carico di prova sono le query registrate più frequenti oppure,
+se non è stata registrata nessuna query, DEFAULT_WORKLOAD.
+Variabili d'ambiente:
+- INDEX_ADVISOR_LOG_SIZE: numero massimo di query diverse registrate (0 = registrazione disattivata).
+- INDEX_ADVISOR_WORKLOAD_SIZE: numero di query registrate (le più frequenti) analizzate e usate come carico di prova.
+- INDEX_ADVISOR_BENCHMARK_RUNS: esecuzioni di ogni query del carico di prova; viene considerato il tempo migliore.
+- INDEX_ADVISOR_APPLY_ENABLED: se "true", l'endpoint /index_advisor/apply può creare gli indici.
+"""
+
+logger = get_logger("index_advisor")
+
+# Query tipiche generate dal modello, usate come carico di prova quando non ci sono query registrate
+DEFAULT_WORKLOAD: Tuple[str, ...] = (
+    "SELECT titolo, anno FROM movies WHERE anno = 2010",
+    "SELECT titolo, genere FROM movies WHERE genere = 'Drammatico' ORDER BY anno",
+    "SELECT m.titolo, d.nome FROM movies m JOIN directors d ON m.id_director = d.id WHERE m.anno > 2000",
+    "SELECT m.titolo, p.nome FROM movies m JOIN platforms p ON m.id_platform1 = p.id OR m.id_platform2 = p.id",
+    "SELECT d.nome, COUNT(*) FROM directors d JOIN movies m ON m.id_director = d.id GROUP BY d.nome ORDER BY d.eta",
+)
+
+# Clausole analizzate: il testo che segue la parola chiave, fino alla clausola successiva
+CLAUSE_PATTERNS: Dict[str, re.Pattern] = {
+    "where": re.compile(r"\bwhere\b(.*?)(?=\bgroup\s+by\b|\border\s+by\b|\bhaving\b|\blimit\b|\bunion\b|$)", re.IGNORECASE | re.DOTALL),
+    "join": re.compile(r"\bon\b(.*?)(?=\b(?:inner|left|right|cross|natural|straight_join)\b|\bjoin\b|\bwhere\b|\bgroup\s+by\b|\border\s+by\b|\bhaving\b|\blimit\b|\bunion\b|$)",
+                       re.IGNORECASE | re.DOTALL),
+    "order": re.compile(r"\border\s+by\b(.*?)(?=\blimit\b|\bunion\b|$)", re.IGNORECASE | re.DOTALL),
+}
+
+# Tabella (con alias opzionale) dopo FROM, JOIN o una virgola nella lista delle tabelle.
+# Il lookahead non consuma il testo, così l'alias letto dopo una virgola della SELECT non nasconde il FROM successivo.
+TABLE_REFERENCE_PATTERN: re.Pattern = re.compile(r"(?=(?:\bfrom|\bjoin|,)\s+`?(\w+)`?(?:\s+(?:as\s+)?`?(\w+)`?)?)", re.IGNORECASE)
+COLUMN_REFERENCE_PATTERN: re.Pattern = re.compile(r"(?:`?(\w+)`?\s*\.\s*)?`?(\w+)`?")
+
+# Parole che possono seguire il nome di una tabella e non sono un alias
+SQL_KEYWORDS: Set[str] = {
+    "where", "join", "inner", "left", "right", "cross", "natural", "on", "using", "group", "order", "having", "limit",
+    "union", "straight_join", "as", "set", "select", "from", "and", "or", "not",
+}
+
+ColumnRef = Tuple[str, str]
+
+
+def table_aliases(sql_query: str, known_tables: Set[str]) -> Dict[str, str]:
+    """
+    Questa funzione restituisce gli alias (e i nomi) delle tabelle note citate nella query, associati al nome della tabella.
+    """
+    aliases: Dict[str, str] = {}
+    for table, alias in TABLE_REFERENCE_PATTERN.findall(sql_query):
+        if table.lower() not in known_tables:
+            continue
+        aliases[table.lower()] = table.lower()
+        if alias and alias.lower() not in SQL_KEYWORDS:
+            aliases[alias.lower()] = table.lower()
+    return aliases
+
+
+def clause_columns(sql_query: str, schema: Dict[str, Set[str]]) -> Dict[str, Set[ColumnRef]]:
+    """
+    Questa funzione restituisce, per ogni clausola (where, join, order), le colonne (tabella, colonna) che vi compaiono.
+    Le colonne con il nome della tabella o dell'alias vengono attribuite a quella tabella; quelle senza vengono attribuite
+    all'unica tabella della query che ha una colonna con quel nome (se sono più di una, la colonna viene ignorata).
+    I letterali stringa vengono rimossi prima dell'analisi.
+    """
+    unquoted: str = QUOTED_PATTERN.sub(lambda match: match.group(0) if match.group(0).startswith("`") else "''", sql_query)
+    aliases: Dict[str, str] = table_aliases(unquoted, set(schema))
+    query_tables: Set[str] = set(aliases.values())
+
+    columns: Dict[str, Set[ColumnRef]] = {}
+    for clause, pattern in CLAUSE_PATTERNS.items():
+        found: Set[ColumnRef] = set()
+        for text in pattern.findall(unquoted):
+            for qualifier, name in COLUMN_REFERENCE_PATTERN.findall(text):
+                name = name.lower()
+                if qualifier:
+                    table: Optional[str] = aliases.get(qualifier.lower())
+                    if table is not None and name in schema[table]:
+                        found.add((table, name))
+                else:
+                    candidates: List[str] = [table for table in query_tables if name in schema[table]]
+                    if len(candidates) == 1:
+                        found.add((candidates[0], name))
+        columns[clause] = found
+    return columns
+
+
+class IndexRecommendation:
+    """
+    Questa classe rappresenta un indice suggerito: tabella, colonna, clausole in cui la colonna è usata
+    e numero di esecuzioni delle query che ne trarrebbero vantaggio.
+    """
+    def __init__(self, table: str, column: str):
+        self.table: str = table
+        self.column: str = column
+        self.clauses: Set[str] = set()
+        self.executions: int = 0
+        self.queries: int = 0
+
+    @property
+    def index_name(self) -> str:
+        return f"idx_{self.table}_{self.column}"
+
+    @property
+    def statement(self) -> str:
+        return f"CREATE INDEX IF NOT EXISTS `{self.index_name}` ON `{self.table}` (`{self.column}`)"
+
+
+class IndexAdvisor:
+    def __init__(self, log_size: int, workload_size: int, benchmark_runs: int, apply_enabled: bool):
+        self.log_size: int = log_size
+        self.workload_size: int = workload_size
+        self.benchmark_runs: int = benchmark_runs
+        self.apply_enabled: bool = apply_enabled
+        # Query normalizzata -> numero di esecuzioni; l'ordine del dizionario è l'ordine di utilizzo (LRU)
+        self._queries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "IndexAdvisor":
+        """
+        Questo metodo crea un IndexAdvisor leggendo la configurazione dalle variabili d'ambiente.
+        """
+        return cls(
+            log_size=int(os.getenv("INDEX_ADVISOR_LOG_SIZE", 1000)),
+            workload_size=int(os.getenv("INDEX_ADVISOR_WORKLOAD_SIZE", 50)),
+            benchmark_runs=int(os.getenv("INDEX_ADVISOR_BENCHMARK_RUNS", 5)),
+            apply_enabled=os.getenv("INDEX_ADVISOR_APPLY_ENABLED", "false").lower() == "true",
+        )
+
+    def record(self, sql_query: str) -> None:
+        """
+        Questo metodo registra una SELECT eseguita. Viene chiamato da ConnectionManager (vedi register_query_listener).
+        """
+        if self.log_size <= 0:
+            return
+        key: str = normalize_sql(sql_query)
+        with self._lock:
+            self._queries[key] = self._queries.get(key, 0) + 1
+            self._queries.move_to_end(key)
+            while len(self._queries) > self.log_size:
+                self._queries.popitem(last=False)
+
+    def recorded_queries(self) -> int:
+        return len(self._queries)
+
+    def workload(self) -> List[Tuple[str, int]]:
+        """
+        Questo metodo restituisce il carico da analizzare: le query registrate più frequenti con il numero di esecuzioni,
+        oppure DEFAULT_WORKLOAD se non è stata registrata nessuna query.
+        """
+        with self._lock:
+            queries: List[Tuple[str, int]] = sorted(self._queries.items(), key=lambda item: item[1], reverse=True)
+        if not queries:
+            return [(sql_query, 1) for sql_query in DEFAULT_WORKLOAD]
+        return queries[:self.workload_size]
+
+    def recommend(self, cm, schema_summary: List[Tuple[str, str]]) -> List[IndexRecommendation]:
+        """
+        Questo metodo analizza il carico con il ConnectionManager fornito e restituisce gli indici suggeriti,
+        ordinati per numero di esecuzioni delle query interessate.
+        Le query che non si riescono più a spiegare con EXPLAIN (ad esempio per un cambio di schema) vengono ignorate.
+        """
+        schema: Dict[str, Set[str]] = {}
+        for table_name, column_name in schema_summary:
+            schema.setdefault(table_name.lower(), set()).add(column_name.lower())
+        indexed: Set[ColumnRef] = cm.query_indexed_columns()
+
+        recommendations: Dict[ColumnRef, IndexRecommendation] = {}
+        for sql_query, executions in self.workload():
+            try:
+                plan = cm.explain_query(sql_query)
+            except Exception as e:
+                logger.warning("Index advisor: query not explained (%s): %s", e, sql_query)
+                continue
+            aliases: Dict[str, str] = table_aliases(sql_query, set(schema))
+            full_scans: Set[str] = {aliases.get(str(step.get("table")).lower(), "") for step in plan if step.get("type") == "ALL"}
+            filesorts: Set[str] = {aliases.get(str(step.get("table")).lower(), "") for step in plan if "filesort" in str(step.get("Extra") or "")}
+
+            # Colonne di questa query che trarrebbero vantaggio da un indice, con le clausole in cui compaiono
+            useful: Dict[ColumnRef, Set[str]] = {}
+            for clause, columns in clause_columns(sql_query, schema).items():
+                for table, column in columns:
+                    if (table, column) not in indexed and table in (filesorts if clause == "order" else full_scans):
+                        useful.setdefault((table, column), set()).add(clause)
+
+            for (table, column), clauses in useful.items():
+                recommendation: IndexRecommendation = recommendations.setdefault((table, column), IndexRecommendation(table, column))
+                recommendation.clauses.update(clauses)
+                recommendation.queries += 1
+                recommendation.executions += executions
+        return sorted(recommendations.values(), key=lambda recommendation: recommendation.executions, reverse=True)
+
+    def benchmark(self, cm) -> Dict[str, float]:
+        """
+        Questo metodo esegue il carico di prova e restituisce, per ogni query, il tempo migliore in millisecondi.
+        Le query che falliscono (ad esempio per il tempo massimo di esecuzione) non compaiono nel risultato.
+        """
+        timings: Dict[str, float] = {}
+        for sql_query, _ in self.workload():
+            seconds: Optional[float] = cm.time_query(sql_query, self.benchmark_runs)
+            if seconds is not None:
+                timings[sql_query] = seconds * 1000
+        return timings
@@ -0,0 +1,216 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from app_logging import get_logger
+
+"""
+Questo file contiene le metriche del backend, esposte dall'endpoint /metrics nel formato testuale di Prometheus.
+Sono disponibili tre tipi di metriche:
+- Counter: un valore che può solo aumentare (ad esempio i token elaborati da Ollama);
+- Histogram: la distribuzione delle durate, con i conteggi cumulativi per intervallo (bucket), la somma e il numero di osservazioni;
+- statistiche: i dizionari restituiti dai metodi stats() di pool e cache, letti solo quando viene richiesto /metrics.
+Registrare un'osservazione costa una ricerca binaria nei bucket e qualche incremento sotto un lock, quindi le metriche
+possono essere aggiornate a ogni richiesta senza rallentare le risposte.
+Le metriche principali sono:
+- text2sql_http_request_duration_seconds: durata delle richieste per metodo, endpoint e codice di stato;
+- text2sql_stage_duration_seconds: durata delle fasi di /search e /sql_search (schema, cache, modello, pulizia,
+  stima del costo, esecuzione sul database, costruzione della risposta);
+- text2sql_ollama_*: richieste a Ollama, token e durate riportate da Ollama nelle risposte.
+"""
+
+logger = get_logger("metrics")
+
+# Limiti superiori dei bucket degli istogrammi, in secondi
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+LabelValues = Tuple[str, ...]
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    """
+    Questa funzione restituisce le etichette di un campione nel formato {nome="valore",...}, con i caratteri speciali protetti.
+    """
+    pairs: List[str] = [f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: Tuple[str, ...] = labelnames
+        self._values: Dict[LabelValues, float] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """
+        Questo metodo incrementa il contatore con le etichette indicate (nello stesso ordine di labelnames).
+        """
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values: List[Tuple[LabelValues, float]] = list(self._values.items())
+        lines: List[str] = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        lines.extend(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}" for labels, value in values)
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: Tuple[str, ...] = labelnames
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # Etichette -> (conteggi per bucket, non cumulativi, con l'ultimo per +Inf; somma delle osservazioni)
+        self._values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        """
+        Questo metodo registra un'osservazione (ad esempio una durata in secondi) con le etichette indicate.
+        """
+        index: int = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry: Optional[Tuple[List[int], List[float]]] = self._values.get(labels)
+            if entry is None:
+                entry = ([0] * (len(self.buckets) + 1), [0.0])
+                self._values[labels] = entry
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """
+        Questo metodo misura la durata del blocco with e la registra con le etichette indicate, anche se il blocco lancia un'eccezione.
+        """
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values: List[Tuple[LabelValues, List[int], float]] = [(labels, list(counts), total[0]) for labels, (counts, total) in self._values.items()]
+        lines: List[str] = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, counts, total in values:
+            cumulative: int = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                bucket_label: str = 'le="' + format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, bucket_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List = []
+        # (prefisso, descrizione, funzione stats(), nomi ed etichette del campione)
+        self._stats: List[Tuple[str, str, Callable[[], Dict[str, float]], Tuple[str, ...], LabelValues]] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        counter: Counter = Counter(name, documentation, labelnames)
+        self._metrics.append(counter)
+        return counter
+
+    def histogram(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        histogram: Histogram = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(histogram)
+        return histogram
+
+    def register_stats(self, prefix: str, documentation: str, stats: Callable[[], Dict[str, float]], labels: Optional[Dict[str, str]] = None) -> None:
+        """
+        Questo metodo registra una funzione stats() (ad esempio del pool o di una cache): ogni chiave del dizionario restituito
+        diventa un gauge {prefix}_{chiave}, con le etichette indicate. La funzione viene chiamata solo durante render().
+        """
+        labels = labels or {}
+        self._stats.append((prefix, documentation, stats, tuple(labels), tuple(labels.values())))
+
+    def render(self) -> str:
+        """
+        Questo metodo restituisce tutte le metriche nel formato testuale di Prometheus.
+        """
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        # I gauge con lo stesso nome (ad esempio gli hit di cache diverse) vanno raggruppati sotto un'unica intestazione
+        gauges: Dict[str, Tuple[str, List[str]]] = {}
+        for prefix, documentation, stats, names, values in self._stats:
+            try:
+                current: Dict[str, float] = stats()
+            except Exception as e:
+                logger.warning("Metrics not collected for %s: %s", prefix, e)
+                continue
+            for key, value in current.items():
+                name: str = f"{prefix}_{key}"
+                gauges.setdefault(name, (f"{documentation}: {key}", []))[1].append(f"{name}{format_labels(names, values)} {format_value(value)}")
+        for name, (documentation, samples) in gauges.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------- METRICHE DEL BACKEND ---------------------------------------------------
+
+registry: MetricsRegistry = MetricsRegistry()
+
+REQUEST_DURATION: Histogram = registry.histogram(
+    "text2sql_http_request_duration_seconds", "Durata delle richieste HTTP per metodo, endpoint e codice di stato.",
+    ("method", "endpoint", "status"))
+STAGE_DURATION: Histogram = registry.histogram(
+    "text2sql_stage_duration_seconds", "Durata delle fasi di elaborazione di una richiesta.", ("endpoint", "stage"))
+
+OLLAMA_REQUESTS: Counter = registry.counter(
+    "text2sql_ollama_requests_total", "Richieste inviate a Ollama per modello ed esito.", ("model", "outcome"))
+OLLAMA_TOKENS: Counter = registry.counter(
+    "text2sql_ollama_tokens_total", "Token elaborati da Ollama: prompt (prompt_eval_count) e generati (eval_count).", ("model", "kind"))
+OLLAMA_DURATION: Histogram = registry.histogram(
+    "text2sql_ollama_duration_seconds", "Durate riportate da Ollama: totale, caricamento del modello, valutazione del prompt e generazione.",
+    ("model", "phase"))
+
+# Campi delle risposte di Ollama (in nanosecondi) e fase corrispondente in OLLAMA_DURATION
+OLLAMA_DURATION_FIELDS: Tuple[Tuple[str, str], ...] = (
+    ("total_duration", "total"),
+    ("load_duration", "load"),
+    ("prompt_eval_duration", "prompt_eval"),
+    ("eval_duration", "eval"),
+)
+
+
+def record_ollama_response(response, outcome: str = "done") -> None:
+    """
+    Questa funzione registra le statistiche di una risposta di Ollama (ModelResponse o l'ultimo ModelStreamChunk).
+    I campi assenti (ad esempio se lo streaming è stato interrotto prima della fine) vengono ignorati.
+    """
+    model: str = response.model
+    OLLAMA_REQUESTS.inc(model, outcome)
+    if getattr(response, "prompt_eval_count", None) is not None:
+        OLLAMA_TOKENS.inc(model, "prompt", amount=response.prompt_eval_count)
+    if getattr(response, "eval_count", None) is not None:
+        OLLAMA_TOKENS.inc(model, "eval", amount=response.eval_count)
+    for field, phase in OLLAMA_DURATION_FIELDS:
+        nanoseconds: Optional[int] = getattr(response, field, None)
+        if nanoseconds is not None:
+            OLLAMA_DURATION.observe(nanoseconds / 1e9, model, phase)
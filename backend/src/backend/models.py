@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 """
 Questo file contiene i modelli di dati utilizzati nell'applicazione FastAPI.
@@ -17,24 +17,33 @@ class SearchResult(BaseModel):
     properties: List[Property]
 
 class SearchRequest(BaseModel):
-    question: str
-    model: str
+    # question e model servono solo per la prima pagina: le pagine successive sono identificate da page_token
+    question: Optional[str] = None
+    model: Optional[str] = None
+    page_token: Optional[str] = None
 
 class SearchResponse(BaseModel):
     sql: str
     sql_validation: str
     results: Optional[List[SearchResult]]
+    next_page_token: Optional[str] = None
+    truncated: bool = False
+    detail: Optional[str] = None
   
 
 # ---------------------------------------------------------- MODELLI ENDPOINT /sql_search ---------------------------------------------------
 
 class SQLSearchRequest(BaseModel):
-    sql_query: str
+    # sql_query serve solo per la prima pagina: le pagine successive sono identificate da page_token
+    sql_query: Optional[str] = None
     model: Optional[str] = None
+    page_token: Optional[str] = None
 
 class SQLSearchResponse(BaseModel):
     sql_validation: str
     results: Optional[List[SearchResult]]
+    next_page_token: Optional[str] = None
+    truncated: bool = False
 
 # ---------------------------------------------------------- MODELLI ENDPOINT /schema_summary ---------------------------------------------------
 
@@ -42,6 +51,9 @@ class DatabaseSchemaResponse(BaseModel):
     table_name: str
     table_column: str
 
+class CacheInvalidationResponse(BaseModel):
+    status: str
+
 # ---------------------------------------------------------- MODELLI ENDPOINT /add ---------------------------------------------------
 
 class AddRequest(BaseModel):
@@ -50,6 +62,75 @@ class AddRequest(BaseModel):
 class AddResponse(BaseModel):
     status: str
 
+class AddBatchRequest(BaseModel):
+    data_lines: List[str]
+
+class AddBatchLineResult(BaseModel):
+    line: int
+    status: str
+    id_movie: Optional[int] = None
+    detail: Optional[str] = None
+
+class AddBatchResponse(BaseModel):
+    status: str
+    results: List[AddBatchLineResult]
+
+# ---------------------------------------------------------- MODELLI ENDPOINT /export ---------------------------------------------------
+
+class ExportRequest(BaseModel):
+    sql_query: str
+    format: str = "csv"
+
+# ---------------------------------------------------------- MODELLI ENDPOINT /index_advisor ---------------------------------------------------
+
+class IndexRecommendationResponse(BaseModel):
+    table_name: str
+    column_name: str
+    index_name: str
+    statement: str
+    clauses: List[str]
+    queries: int
+    executions: int
+
+class IndexAdvisorReport(BaseModel):
+    recorded_queries: int
+    workload_queries: int
+    recommendations: List[IndexRecommendationResponse]
+
+class IndexApplyRequest(BaseModel):
+    index_names: Optional[List[str]] = None
+
+class QueryTiming(BaseModel):
+    sql_query: str
+    before_ms: Optional[float]
+    after_ms: Optional[float]
+
+class IndexApplyResponse(BaseModel):
+    status: str
+    applied: List[IndexRecommendationResponse]
+    timings: List[QueryTiming]
+    total_before_ms: float
+    total_after_ms: float
+
+# ---------------------------------------------------------- MODELLI ENDPOINT /debug/traces ---------------------------------------------------
+
+class TraceSpanResponse(BaseModel):
+    name: str
+    span_id: str
+    parent_span_id: Optional[str]
+    start_offset_ms: float
+    duration_ms: float
+    status: str
+    attributes: Dict[str, Any]
+
+class TraceResponse(BaseModel):
+    trace_id: str
+    name: str
+    status: str
+    start_time: str
+    duration_ms: float
+    spans: List[TraceSpanResponse]
+
 # ---------------------------------------------------------- MODELLI PER OLLAMA ---------------------------------------------------
 
 class Question(BaseModel):
@@ -75,4 +156,17 @@ class ModelResponse(BaseModel):
     prompt_eval_count: int
     prompt_eval_duration: int
     eval_count: int
-    eval_duration: int
\ No newline at end of file
+    eval_duration: int
+
+class ModelStreamChunk(BaseModel):
+    model: str
+    created_at: str
+    message: Optional[Question] = None
+    done: bool
+    done_reason: Optional[str] = None
+    total_duration: Optional[int] = None
+    load_duration: Optional[int] = None
+    prompt_eval_count: Optional[int] = None
+    prompt_eval_duration: Optional[int] = None
+    eval_count: Optional[int] = None
+    eval_duration: Optional[int] = None
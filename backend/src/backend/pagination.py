@@ -0,0 +1,179 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+"""
+Questo file contiene la classe Paginator, che limita il numero di righe restituite da /search e /sql_search
+e permette di scorrere i risultati grandi una pagina alla volta con la paginazione keyset.
+Invece di OFFSET (che costringe MariaDB a rileggere e scartare tutte le righe delle pagine precedenti), la pagina successiva
+viene letta avvolgendo la query originale e ripartendo dall'ultimo valore della colonna chiave già restituito:
+    SELECT * FROM (query) AS _page WHERE `id` > ? ORDER BY `id` LIMIT n
+La posizione viene restituita al client come token opaco (next_page_token), firmato con HMAC perché contiene la query da eseguire.
+La paginazione keyset è corretta solo se la chiave identifica una riga del risultato e se l'ordinamento per chiave
+è quello della query: viene quindi usata solo per le SELECT su una sola tabella con chiave primaria nota (PRIMARY_KEYS)
+che restituiscono la chiave, senza join, DISTINCT, GROUP BY, UNION, subquery o LIMIT, e senza ORDER BY oppure
+ordinate per chiave in modo crescente (vedi keyset_key).
+Per le altre query viene eseguita una sola volta la query originale, con il suo ordinamento, limitata dal database
+a una pagina più una riga (vedi limit_query): se la riga in più c'è, il risultato viene segnalato come troncato.
+Variabili d'ambiente:
+- RESULT_PAGE_SIZE: numero massimo di righe restituite in una risposta.
+- PAGE_TOKEN_SECRET: chiave usata per firmare i token; se non è impostata ne viene generata una all'avvio
+  (i token non sono più validi dopo un riavvio del backend).
+"""
+
+# Colonna usata come chiave della paginazione: è la chiave primaria di movies, directors e platforms
+KEY_COLUMN: str = "id"
+# Chiave primaria delle tabelle che possono essere paginate con keyset (vedi mariadb_init/init.sql)
+PRIMARY_KEYS: Dict[str, str] = {"movies": KEY_COLUMN, "directors": KEY_COLUMN, "platforms": KEY_COLUMN}
+
+# Stringhe e commenti, sostituiti da segnaposto prima di analizzare la struttura della query
+LITERAL_PATTERN: re.Pattern = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|/\*.*?\*/|(?:--\s|#)[^\n]*", re.DOTALL)
+# Costrutti che rendono la chiave non univoca nel risultato o cambiano quali righe vengono restituite
+NOT_KEYSET_PATTERN: re.Pattern = re.compile(
+    r"\b(?:join|straight_join|union|intersect|except|distinct|distinctrow|group\s+by|having|limit|offset|into|over|for\s+update|lock\s+in)\b|\(\s*select\b",
+    re.IGNORECASE)
+SELECT_PATTERN: re.Pattern = re.compile(r"^select\s+(?P<columns>.+?)\s+from\s+(?P<source>.+)$", re.IGNORECASE | re.DOTALL)
+TABLE_PATTERN: re.Pattern = re.compile(r"^`?(?P<table>\w+)`?(?:\s+(?:as\s+)?`?(?P<alias>\w+)`?)?$", re.IGNORECASE)
+# LIMIT finale della query: LIMIT n, LIMIT n OFFSET m oppure LIMIT m, n
+TRAILING_LIMIT_PATTERN: re.Pattern = re.compile(
+    r"\blimit\s+(?P<first>\d+)(?:\s*,\s*(?P<count>\d+)|\s+offset\s+(?P<offset>\d+))?\s*$", re.IGNORECASE)
+
+
+def strip_literals(sql_query: str) -> str:
+    """
+    Questa funzione sostituisce le stringhe con '' e i commenti con uno spazio, e rimuove il punto e virgola finale.
+    """
+    stripped: str = LITERAL_PATTERN.sub(lambda match: "''" if match.group(0)[0] in "'\"" else " ", sql_query)
+    return stripped.strip().rstrip(";").strip()
+
+
+def keyset_key(sql_query: str) -> Optional[str]:
+    """
+    Questa funzione restituisce la colonna chiave con cui la query può essere paginata con keyset, oppure None.
+    La query deve essere una SELECT su una sola tabella di PRIMARY_KEYS, senza i costrutti di NOT_KEYSET_PATTERN,
+    che restituisce la chiave primaria (anche con *) senza altre colonne con lo stesso nome, e senza ORDER BY
+    o con ORDER BY sulla sola chiave in ordine crescente: così la chiave è univoca e l'ordine delle pagine è quello della query.
+    """
+    text: str = strip_literals(sql_query)
+    if NOT_KEYSET_PATTERN.search(text):
+        return None
+    select: Optional[re.Match] = SELECT_PATTERN.match(text)
+    if select is None:
+        return None
+
+    source: str = select.group("source")
+    order_by: Optional[str] = None
+    order_match: Optional[re.Match] = re.search(r"\border\s+by\b", source, re.IGNORECASE)
+    if order_match is not None:
+        source, order_by = source[:order_match.start()], source[order_match.end():].strip()
+    source = re.split(r"\bwhere\b", source, maxsplit=1, flags=re.IGNORECASE)[0].strip()
+    table_match: Optional[re.Match] = TABLE_PATTERN.match(source)
+    if table_match is None or table_match.group("table").lower() not in PRIMARY_KEYS:
+        return None
+    table: str = table_match.group("table").lower()
+    key: str = PRIMARY_KEYS[table]
+    qualifiers: List[str] = [table] + ([table_match.group("alias").lower()] if table_match.group("alias") else [])
+
+    def is_key(expression: str) -> bool:
+        parts: List[str] = [part.strip("`").lower() for part in expression.strip().split(".")]
+        return parts[-1] == key and (len(parts) == 1 or (len(parts) == 2 and parts[0] in qualifiers))
+
+    key_selected: bool = False
+    for column in select.group("columns").split(","):
+        column = column.strip()
+        if column == "*" or column.lower().replace("`", "") in (f"{qualifier}.*" for qualifier in qualifiers) or is_key(column):
+            key_selected = True
+        elif re.search(rf"\s`?{key}`?$", column, re.IGNORECASE):
+            # Un'altra espressione con alias uguale alla chiave (ad esempio "titolo AS id")
+            return None
+    if not key_selected:
+        return None
+
+    if order_by is not None:
+        order_match = re.match(r"^(?P<column>[\w`.]+)(?:\s+asc)?$", order_by, re.IGNORECASE)
+        if order_match is None or not is_key(order_match.group("column")):
+            return None
+    return key
+
+
+def limit_query(sql_query: str, limit: int) -> str:
+    """
+    Questa funzione limita la query a limit righe senza cambiarne l'ordinamento: se la query termina già con un LIMIT,
+    il numero di righe diventa il minimo tra i due (mantenendo l'eventuale OFFSET), altrimenti viene aggiunto LIMIT limit.
+    """
+    query: str = sql_query.strip().rstrip(";").strip()
+    # Il LIMIT viene aggiunto su una nuova riga, così non finisce dentro un commento "--" o "#" alla fine della query
+    if TRAILING_LIMIT_PATTERN.search(strip_literals(query)) is None:
+        return f"{query}\nLIMIT {limit}"
+    match: Optional[re.Match] = TRAILING_LIMIT_PATTERN.search(query)
+    if match is None:
+        # Il LIMIT finale è seguito da un commento: la query viene avvolta
+        return f"SELECT * FROM ({query}\n) AS _limited LIMIT {limit}"
+    if match.group("count") is not None:
+        offset, count = int(match.group("first")), int(match.group("count"))
+    else:
+        offset, count = int(match.group("offset") or 0), int(match.group("first"))
+    return f"{query[:match.start()]}LIMIT {min(count, limit)} OFFSET {offset}"
+
+
+class PageToken:
+    """
+    Questa classe rappresenta la posizione raggiunta in un risultato: la query, la colonna chiave e l'ultimo valore restituito.
+    """
+    def __init__(self, sql: str, key: str, after: Any):
+        self.sql: str = sql
+        self.key: str = key
+        self.after: Any = after
+
+
+class Paginator:
+    def __init__(self, page_size: int, secret: bytes):
+        self.page_size: int = page_size
+        self.secret: bytes = secret
+
+    @classmethod
+    def from_env(cls) -> "Paginator":
+        """
+        Questo metodo crea un Paginator leggendo la configurazione dalle variabili d'ambiente.
+        """
+        secret: Optional[str] = os.getenv("PAGE_TOKEN_SECRET")
+        return cls(
+            page_size=int(os.getenv("RESULT_PAGE_SIZE", 500)),
+            secret=secret.encode("utf-8") if secret else os.urandom(32),
+        )
+
+    def page_query(self, sql_query: str, key: str, has_after: bool) -> str:
+        """
+        Questo metodo costruisce la query che legge una pagina (più una riga, per sapere se esiste una pagina successiva).
+        Se has_after è True, la query ha un parametro: l'ultimo valore della chiave della pagina precedente.
+        """
+        inner_query: str = sql_query.strip().rstrip(";").strip()
+        condition: str = f" WHERE `{key}` > ?" if has_after else ""
+        return f"SELECT * FROM ({inner_query}\n) AS _page{condition} ORDER BY `{key}` LIMIT {self.page_size + 1}"
+
+    def encode_token(self, token: PageToken) -> str:
+        """
+        Questo metodo trasforma la posizione nel risultato in un token opaco firmato.
+        """
+        payload: bytes = json.dumps({"sql": token.sql, "key": token.key, "after": token.after}, default=str).encode("utf-8")
+        signature: bytes = hmac.new(self.secret, payload, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(signature + payload).decode("ascii")
+
+    def decode_token(self, encoded: str) -> PageToken:
+        """
+        Questo metodo legge un token creato da encode_token.
+        Lancia ValueError se il token non è valido o se la firma non corrisponde.
+        """
+        try:
+            raw: bytes = base64.urlsafe_b64decode(encoded.encode("ascii"))
+        except (ValueError, UnicodeEncodeError) as e:
+            raise ValueError("Invalid page token.") from e
+        signature, payload = raw[:32], raw[32:]
+        if not hmac.compare_digest(signature, hmac.new(self.secret, payload, hashlib.sha256).digest()):
+            raise ValueError("Invalid page token.")
+        data = json.loads(payload)
+        return PageToken(sql=data["sql"], key=data["key"], after=data["after"])
@@ -0,0 +1,244 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from question_index import QuestionIndex, normalize_question, question_shape, sql_aggregate_shape, substitute_numbers
+from app_logging import get_logger
+
+"""
+Questo file contiene la classe QuestionCache, una cache LRU con scadenza (TTL) che associa le domande in linguaggio naturale
+alla query SQL già generata dal modello di IA. Una domanda trovata in cache evita completamente la chiamata a Ollama.
+La chiave è composta dalla domanda normalizzata, dal nome del modello e dall'impronta dello schema del database,
+così un cambio di modello o di schema non restituisce query obsolete.
+Le domande in cache sono anche indicizzate da un QuestionIndex (vedi question_index.py), che permette di riutilizzare
+la query di una domanda quasi uguale, sostituendo i numeri letterali della nuova domanda.
+Variabili d'ambiente:
+- QUESTION_CACHE_SIZE: numero massimo di domande in cache.
+- QUESTION_CACHE_TTL: secondi di validità di una query in cache.
+- QUESTION_CACHE_PATH: file JSON in cui salvare la cache, caricato all'avvio (vuoto = nessun salvataggio).
+- QUESTION_CACHE_SAVE_INTERVAL: secondi di attesa dopo una modifica prima di salvare la cache su file; le modifiche
+  arrivate nel frattempo vengono scritte con un solo salvataggio. Alla chiusura del backend la cache viene sempre salvata.
+- QUESTION_SIMILARITY_THRESHOLD: similarità minima (da 0 a 1) per riutilizzare la query di una domanda simile (0 = disattivato).
+"""
+
+logger = get_logger("question_cache")
+
+CacheKey = Tuple[str, str, str]
+
+class QuestionCache:
+    def __init__(self, capacity: int, ttl: float, path: Optional[str] = None, similarity_threshold: float = 0,
+                 save_interval: float = 30):
+        self.capacity: int = capacity
+        self.ttl: float = ttl
+        self.path: Optional[str] = path
+        self.save_interval: float = save_interval
+        self.index: Optional[QuestionIndex] = QuestionIndex(similarity_threshold) if similarity_threshold > 0 else None
+        # Chiave -> (query SQL, istante di inserimento); l'ordine del dizionario è l'ordine di utilizzo (LRU)
+        self._entries: "OrderedDict[CacheKey, Tuple[str, float]]" = OrderedDict()
+        self._lock: threading.Lock = threading.Lock()
+        self._save_lock: threading.Lock = threading.Lock()
+        # Salvataggio su file programmato dopo l'ultima modifica (None = nessuna modifica da salvare)
+        self._save_timer: Optional[threading.Timer] = None
+        self._saves: int = 0
+        self._hits: int = 0
+        self._misses: int = 0
+        self._similar_hits: int = 0
+
+    @classmethod
+    def from_env(cls) -> "QuestionCache":
+        """
+        Questo metodo crea la cache leggendo la configurazione dalle variabili d'ambiente e carica le domande salvate su file.
+        """
+        cache: QuestionCache = cls(
+            capacity=int(os.getenv("QUESTION_CACHE_SIZE", 1000)),
+            ttl=float(os.getenv("QUESTION_CACHE_TTL", 86400)),
+            path=os.getenv("QUESTION_CACHE_PATH") or None,
+            similarity_threshold=float(os.getenv("QUESTION_SIMILARITY_THRESHOLD", 0.85)),
+            save_interval=float(os.getenv("QUESTION_CACHE_SAVE_INTERVAL", 30)),
+        )
+        cache.load()
+        return cache
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        """
+        Questo metodo normalizza la domanda: minuscole, spazi multipli ridotti a uno e punteggiatura finale rimossa.
+        """
+        question = re.sub(r"\s+", " ", question.strip().lower())
+        return question.rstrip(" .?!")
+
+    def get(self, question: str, model: str, fingerprint: str) -> Optional[str]:
+        """
+        Questo metodo restituisce la query SQL in cache per la domanda, oppure None se non è presente o è scaduta.
+        """
+        key: CacheKey = (self.normalize_question(question), model, fingerprint)
+        with self._lock:
+            entry: Optional[Tuple[str, float]] = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                if entry is not None:
+                    self._delete(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[0]
+
+    def get_similar(self, question: str, model: str, fingerprint: str) -> Optional[str]:
+        """
+        Questo metodo cerca in cache una domanda simile (stesso modello e stesso schema) e ne adatta la query SQL,
+        sostituendo i numeri della domanda trovata con quelli della nuova domanda.
+        Restituisce None se non c'è una domanda abbastanza simile, se la query trovata non contiene le aggregazioni
+        richieste dalla nuova domanda o se la sostituzione dei numeri non è sicura.
+        """
+        if self.index is None:
+            return None
+        match = self.index.find(self.normalize_question(question), (model, fingerprint))
+        if match is None:
+            return None
+
+        key, score, old_numbers, new_numbers = match
+        with self._lock:
+            entry: Optional[Tuple[str, float]] = self._entries.get(key)
+            if entry is None or time.time() - entry[1] > self.ttl:
+                return None
+            self._entries.move_to_end(key)
+
+        if not question_shape(normalize_question(question)[0]) <= sql_aggregate_shape(entry[0]):
+            logger.info("Similar question '%s' discarded: different aggregation", key[0])
+            return None
+        sql_query: Optional[str] = substitute_numbers(entry[0], old_numbers, new_numbers)
+        if sql_query is not None:
+            with self._lock:
+                self._similar_hits += 1
+            logger.info("Similar question found: '%s' (similarity %.2f)", key[0], score)
+        return sql_query
+
+    def put(self, question: str, model: str, fingerprint: str, sql_query: str) -> None:
+        """
+        Questo metodo salva in cache la query SQL generata per la domanda, eliminando le domande usate meno di recente
+        se la cache è piena. Se è configurato QUESTION_CACHE_PATH, viene programmato il salvataggio su file
+        (vedi schedule_save), senza scrivere il file durante la richiesta.
+        """
+        key: CacheKey = (self.normalize_question(question), model, fingerprint)
+        with self._lock:
+            self._entries[key] = (sql_query, time.time())
+            self._entries.move_to_end(key)
+            if self.index is not None:
+                self.index.add(key, key[0], (model, fingerprint))
+            self._evict()
+        self.schedule_save()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Questo metodo restituisce le metriche della cache delle domande.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "similar_hits": self._similar_hits,
+                "saves": self._saves,
+            }
+
+    def load(self) -> None:
+        """
+        Questo metodo carica la cache dal file QUESTION_CACHE_PATH, ignorando le voci scadute.
+        """
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                stored: List[Dict[str, Any]] = json.load(cache_file)
+        except (OSError, ValueError) as e:
+            logger.warning("Question cache not loaded from %s: %s", self.path, e)
+            return
+
+        now: float = time.time()
+        with self._lock:
+            for item in stored:
+                if now - item["stored_at"] > self.ttl:
+                    continue
+                key: CacheKey = (item["question"], item["model"], item["fingerprint"])
+                self._entries[key] = (item["sql"], item["stored_at"])
+                if self.index is not None:
+                    self.index.add(key, key[0], (key[1], key[2]))
+            self._evict()
+        logger.info("Question cache loaded from %s: %d entries.", self.path, len(self._entries))
+
+    def schedule_save(self) -> None:
+        """
+        Questo metodo programma il salvataggio della cache dopo QUESTION_CACHE_SAVE_INTERVAL secondi, se non ce n'è già uno
+        in attesa: tutte le domande aggiunte nel frattempo vengono scritte con un solo salvataggio.
+        Con un intervallo pari a 0 la cache viene salvata subito.
+        """
+        if not self.path:
+            return
+        if self.save_interval <= 0:
+            self.save()
+            return
+        with self._lock:
+            if self._save_timer is not None:
+                return
+            self._save_timer = threading.Timer(self.save_interval, self._scheduled_save)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self) -> None:
+        """
+        Questo metodo annulla il salvataggio programmato e, se c'erano modifiche da salvare, salva subito la cache.
+        Va chiamato alla chiusura del backend.
+        """
+        with self._lock:
+            timer: Optional[threading.Timer] = self._save_timer
+            self._save_timer = None
+        if timer is not None:
+            timer.cancel()
+            self.save()
+
+    def _scheduled_save(self) -> None:
+        with self._lock:
+            self._save_timer = None
+        self.save()
+
+    def save(self) -> None:
+        """
+        Questo metodo salva la cache sul file QUESTION_CACHE_PATH.
+        Il file viene scritto in un file temporaneo e poi rinominato, così un crash non lascia un file a metà.
+        """
+        if not self.path:
+            return
+        with self._lock:
+            stored: List[Dict[str, Any]] = [
+                {"question": key[0], "model": key[1], "fingerprint": key[2], "sql": sql_query, "stored_at": stored_at}
+                for key, (sql_query, stored_at) in self._entries.items()
+            ]
+        temporary_path: str = f"{self.path}.tmp"
+        with self._save_lock:
+            try:
+                with open(temporary_path, "w", encoding="utf-8") as cache_file:
+                    json.dump(stored, cache_file, ensure_ascii=False)
+                os.replace(temporary_path, self.path)
+                self._saves += 1
+            except OSError as e:
+                logger.warning("Question cache not saved to %s: %s", self.path, e)
+
+    def _evict(self) -> None:
+        """
+        Questo metodo elimina le domande usate meno di recente finché la cache non rientra nella capacità massima.
+        Va chiamato tenendo il lock della cache.
+        """
+        while len(self._entries) > self.capacity:
+            self._delete(next(iter(self._entries)))
+
+    def _delete(self, key: CacheKey) -> None:
+        """
+        Questo metodo elimina una domanda dalla cache e dall'indice delle domande simili.
+        Va chiamato tenendo il lock della cache.
+        """
+        del self._entries[key]
+        if self.index is not None:
+            self.index.remove(key)
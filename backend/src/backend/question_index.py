@@ -0,0 +1,206 @@
+import math
+import re
+import threading
+import unicodedata
+from typing import Dict, FrozenSet, Hashable, List, Optional, Set, Tuple
+
+"""
+Questo file contiene la classe QuestionIndex, un indice in memoria per trovare domande simili a una domanda già risposta.
+Le domande vengono normalizzate (accenti, maiuscole, parole vuote italiane) e i numeri vengono sostituiti da uno slot "#",
+così "Quali film del 2020?" e "quali sono i film usciti nel 2010" risultano simili e differiscono solo per il valore dello slot.
+La similarità è il coefficiente di Dice tra gli insiemi di trigrammi di caratteri delle parole rimaste.
+Per restare veloce con decine di migliaia di domande, l'indice invertito è diviso per numero di trigrammi: vengono consultate
+solo le domande di lunghezza compatibile con la soglia e, per ciascuna lunghezza, solo i trigrammi più rari della domanda
+(prefix filtering): una domanda che non ne contiene nessuno non può superare la soglia.
+Le parole che indicano cosa restituire (quanti, quali, elenca, tutti...) non sono parole vuote: "quanti film del 2020"
+e "quali film del 2020" richiedono query diverse. Per lo stesso motivo due domande sono confrontate solo se chiedono
+la stessa aggregazione (question_shape), e la query trovata viene riutilizzata solo se contiene le aggregazioni richieste
+(sql_aggregate_shape).
+"""
+
+# Parole vuote italiane e verbi tipici delle richieste, che non cambiano il significato della domanda
+ITALIAN_STOPWORDS: Set[str] = {
+    "a", "ad", "al", "alla", "alle", "agli", "ai", "all", "allo", "che", "chi", "con", "col", "cui", "da", "dal", "dalla",
+    "dalle", "dai", "dagli", "dall", "dallo", "del", "della", "delle", "dei", "degli", "dell", "dello", "di", "e", "ed",
+    "gli", "i", "il", "in", "la", "le", "lo", "l", "ne", "nel", "nella", "nelle", "nei", "negli", "nell", "nello", "o",
+    "per", "su", "sul", "sulla", "sulle", "sui", "sugli", "tra", "fra", "un", "una", "uno", "sono", "stato", "stati",
+    "stata", "state", "e'", "mi", "me", "ci", "dammi", "dimmi", "trova", "trovami", "cerca", "vorrei", "sapere", "puoi",
+    "usciti", "uscito", "uscita", "uscite", "anno",
+}
+
+# Parole delle domande che richiedono un'aggregazione, con la funzione SQL corrispondente
+AGGREGATE_WORDS: Dict[str, str] = {
+    "quanti": "count", "quante": "count", "numero": "count", "conta": "count", "contare": "count",
+    "media": "avg", "medio": "avg", "mediamente": "avg",
+    "totale": "sum", "somma": "sum",
+    "massimo": "max", "massima": "max",
+    "minimo": "min", "minima": "min",
+}
+
+SQL_AGGREGATE_PATTERN: re.Pattern = re.compile(r"\b(count|avg|sum|max|min)\s*\(", re.IGNORECASE)
+SQL_STRING_PATTERN: re.Pattern = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"")
+
+NUMBER_PATTERN: re.Pattern = re.compile(r"\d+")
+SLOT: str = "#"
+
+
+def normalize_question(question: str) -> Tuple[List[str], List[str]]:
+    """
+    Questa funzione normalizza una domanda.
+    Restituisce le parole significative (senza accenti, in minuscolo, senza parole vuote, con i numeri sostituiti dallo slot)
+    e la lista dei numeri trovati, nell'ordine in cui compaiono.
+    """
+    text: str = unicodedata.normalize("NFKD", question)
+    text = "".join(char for char in text if not unicodedata.combining(char)).lower()
+    numbers: List[str] = NUMBER_PATTERN.findall(text)
+    text = NUMBER_PATTERN.sub(f" {SLOT} ", text)
+    tokens: List[str] = [
+        token for token in re.findall(r"[a-z]+|#", text) if token not in ITALIAN_STOPWORDS
+    ]
+    return (tokens, numbers)
+
+
+def question_shape(tokens: List[str]) -> FrozenSet[str]:
+    """
+    Questa funzione restituisce le aggregazioni richieste da una domanda normalizzata (ad esempio {"count"} per "quanti").
+    """
+    return frozenset(AGGREGATE_WORDS[token] for token in tokens if token in AGGREGATE_WORDS)
+
+
+def sql_aggregate_shape(sql_query: str) -> FrozenSet[str]:
+    """
+    Questa funzione restituisce le funzioni di aggregazione usate da una query SQL, ignorando il contenuto delle stringhe.
+    """
+    return frozenset(match.lower() for match in SQL_AGGREGATE_PATTERN.findall(SQL_STRING_PATTERN.sub("''", sql_query)))
+
+
+def question_trigrams(tokens: List[str]) -> Set[str]:
+    """
+    Questa funzione calcola l'insieme dei trigrammi di caratteri delle parole, ognuna delimitata da spazi.
+    L'insieme non dipende dall'ordine delle parole.
+    """
+    trigrams: Set[str] = set()
+    for token in set(tokens):
+        padded: str = f" {token} "
+        for i in range(len(padded) - 2):
+            trigrams.add(padded[i:i + 3])
+    return trigrams
+
+
+class IndexedQuestion:
+    """
+    Questa classe rappresenta una domanda presente nell'indice.
+    """
+    def __init__(self, partition: Hashable, trigrams: Set[str], numbers: List[str], shape: FrozenSet[str]):
+        self.partition: Hashable = partition
+        self.trigrams: Set[str] = trigrams
+        self.numbers: List[str] = numbers
+        self.shape: FrozenSet[str] = shape
+
+
+class QuestionIndex:
+    def __init__(self, threshold: float):
+        self.threshold: float = threshold
+        self._questions: Dict[Hashable, IndexedQuestion] = {}
+        # (trigramma, numero di trigrammi della domanda) -> chiavi delle domande che lo contengono
+        self._postings: Dict[Tuple[str, int], Set[Hashable]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._questions)
+
+    def add(self, key: Hashable, question: str, partition: Hashable) -> None:
+        """
+        Questo metodo aggiunge una domanda all'indice con la chiave fornita.
+        La partizione (ad esempio modello e schema) limita la ricerca alle domande compatibili.
+        """
+        tokens, numbers = normalize_question(question)
+        trigrams: Set[str] = question_trigrams(tokens)
+        with self._lock:
+            self._remove(key)
+            self._questions[key] = IndexedQuestion(partition, trigrams, numbers, question_shape(tokens))
+            for trigram in trigrams:
+                self._postings.setdefault((trigram, len(trigrams)), set()).add(key)
+
+    def remove(self, key: Hashable) -> None:
+        """
+        Questo metodo rimuove una domanda dall'indice.
+        """
+        with self._lock:
+            self._remove(key)
+
+    def find(self, question: str, partition: Hashable) -> Optional[Tuple[Hashable, float, List[str], List[str]]]:
+        """
+        Questo metodo cerca la domanda più simile nella stessa partizione che richiede le stesse aggregazioni.
+        Restituisce (chiave, similarità, numeri della domanda trovata, numeri della domanda cercata),
+        oppure None se nessuna domanda supera la soglia o ha lo stesso numero di slot numerici.
+        """
+        tokens, numbers = normalize_question(question)
+        trigrams: Set[str] = question_trigrams(tokens)
+        shape: FrozenSet[str] = question_shape(tokens)
+        if not trigrams:
+            return None
+
+        size: int = len(trigrams)
+        # Con il coefficiente di Dice, una domanda con m trigrammi può superare la soglia solo se m è in questo intervallo
+        min_size: int = math.ceil(self.threshold * size / (2 - self.threshold))
+        max_size: int = math.floor((2 - self.threshold) * size / self.threshold)
+
+        with self._lock:
+            best: Optional[Tuple[Hashable, float, List[str], List[str]]] = None
+            for other_size in range(min_size, max_size + 1):
+                # Due domande simili almeno quanto la soglia condividono almeno min_shared trigrammi:
+                # basta quindi cercare i candidati tra gli (n - min_shared + 1) trigrammi più rari
+                min_shared: int = math.ceil(self.threshold * (size + other_size) / 2)
+                if min_shared > min(size, other_size):
+                    continue
+                rarest: List[str] = sorted(trigrams, key=lambda trigram: len(self._postings.get((trigram, other_size), ())))
+                candidates: Set[Hashable] = set()
+                for trigram in rarest[:size - min_shared + 1]:
+                    candidates.update(self._postings.get((trigram, other_size), ()))
+
+                for key in candidates:
+                    indexed: IndexedQuestion = self._questions[key]
+                    if indexed.partition != partition or len(indexed.numbers) != len(numbers) or indexed.shape != shape:
+                        continue
+                    shared: int = len(trigrams & indexed.trigrams)
+                    score: float = 2 * shared / (size + other_size)
+                    if score >= self.threshold and (best is None or score > best[1]):
+                        best = (key, score, indexed.numbers, numbers)
+            return best
+
+    def _remove(self, key: Hashable) -> None:
+        indexed: Optional[IndexedQuestion] = self._questions.pop(key, None)
+        if indexed is None:
+            return
+        for trigram in indexed.trigrams:
+            posting_key: Tuple[str, int] = (trigram, len(indexed.trigrams))
+            posting: Optional[Set[Hashable]] = self._postings.get(posting_key)
+            if posting is not None:
+                posting.discard(key)
+                if not posting:
+                    del self._postings[posting_key]
+
+
+def substitute_numbers(sql_query: str, old_numbers: List[str], new_numbers: List[str]) -> Optional[str]:
+    """
+    Questa funzione adatta la query di una domanda simile sostituendo i numeri della domanda originale con quelli nuovi.
+    Restituisce None se un numero da cambiare non compare come valore letterale nella query, perché in quel caso
+    la sostituzione non sarebbe sicura.
+    """
+    replacements: Dict[str, str] = {}
+    for old_number, new_number in zip(old_numbers, new_numbers):
+        if old_number == new_number:
+            continue
+        if replacements.get(old_number, new_number) != new_number:
+            return None
+        replacements[old_number] = new_number
+
+    for old_number in replacements:
+        if not re.search(rf"(?<![\w.]){old_number}(?![\w.])", sql_query):
+            return None
+
+    if not replacements:
+        return sql_query
+    pattern: re.Pattern = re.compile(r"(?<![\w.])(" + "|".join(map(re.escape, replacements)) + r")(?![\w.])")
+    return pattern.sub(lambda match: replacements[match.group(1)], sql_query)
@@ -0,0 +1,213 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+"""
+Questo file contiene la classe ResultCache, una cache dei risultati delle query di /sql_search.
+La chiave è la query SQL normalizzata; per ogni risultato la cache ricorda quali tabelle sono state lette, così una scrittura
+su movies, directors o platforms (notificata da ConnectionManager) invalida esattamente i risultati che dipendono da quella tabella.
+La memoria occupata è limitata: ogni risultato viene misurato e, superato il budget, vengono eliminati i risultati
+usati meno di recente.
+Variabili d'ambiente:
+- RESULT_CACHE_MAX_BYTES: memoria massima occupata dai risultati in cache (0 = cache disattivata).
+- RESULT_CACHE_MAX_ENTRY_BYTES: dimensione massima di un singolo risultato; i risultati più grandi non vengono salvati.
+- RESULT_CACHE_TTL: secondi di validità di un risultato, per limitare l'effetto di scritture fatte fuori dal backend (es. load_db).
+"""
+
+# Query i cui risultati cambiano anche senza scritture sulle tabelle, oppure che leggono tabelle di sistema
+NON_CACHEABLE_PATTERN: re.Pattern = re.compile(
+    r"\b(now|sysdate|curdate|curtime|current_date|current_time|current_timestamp|localtime|localtimestamp|"
+    r"unix_timestamp|utc_date|utc_time|utc_timestamp|rand|uuid|uuid_short|connection_id|last_insert_id|"
+    r"information_schema|performance_schema|mysql|sys)\b",
+    re.IGNORECASE,
+)
+
+# Letterali stringa e identificatori quotati, che non vanno modificati durante la normalizzazione
+QUOTED_PATTERN: re.Pattern = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`)")
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    Questa funzione normalizza una query SQL per usarla come chiave della cache:
+    spazi multipli ridotti a uno e punto e virgola finale rimosso.
+    Maiuscole e minuscole non vengono toccate, perché in MariaDB i nomi delle tabelle possono distinguerle;
+    i letterali stringa restano invariati.
+    """
+    parts: List[str] = QUOTED_PATTERN.split(sql_query.strip().rstrip(";").strip())
+    normalized: List[str] = [
+        part if i % 2 == 1 else re.sub(r"\s+", " ", part)
+        for i, part in enumerate(parts)
+    ]
+    return "".join(normalized)
+
+
+def referenced_tables(sql_query: str, known_tables: Iterable[str]) -> Set[str]:
+    """
+    Questa funzione restituisce le tabelle note (quelle dello schema del database) citate nella query.
+    """
+    known: Set[str] = {table.lower() for table in known_tables}
+    unquoted: str = QUOTED_PATTERN.sub(lambda match: match.group(0) if match.group(0).startswith("`") else "''", sql_query)
+    identifiers: Set[str] = {identifier.lower() for identifier in re.findall(r"`?(\w+)`?", unquoted)}
+    return identifiers & known
+
+
+def is_cacheable(sql_query: str) -> bool:
+    """
+    Questa funzione verifica che il risultato della query dipenda solo dal contenuto delle tabelle.
+    """
+    return NON_CACHEABLE_PATTERN.search(QUOTED_PATTERN.sub("''", sql_query)) is None
+
+
+def estimate_size(columns: List[str], rows: List[Tuple]) -> int:
+    """
+    Questa funzione stima la memoria occupata da un risultato: la lista delle righe, le tuple e i singoli valori.
+    """
+    size: int = sys.getsizeof(rows) + sum(sys.getsizeof(column) for column in columns)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+    return size
+
+
+class CachedResult:
+    """
+    Questa classe rappresenta un risultato in cache: colonne, righe, tabelle lette, dimensione stimata e istante di inserimento.
+    """
+    def __init__(self, columns: List[str], rows: List[Tuple], tables: Set[str], size: int):
+        self.columns: List[str] = columns
+        self.rows: List[Tuple] = rows
+        self.tables: Set[str] = tables
+        self.size: int = size
+        self.stored_at: float = time.monotonic()
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int, max_entry_bytes: int, ttl: float):
+        self.max_bytes: int = max_bytes
+        self.max_entry_bytes: int = max_entry_bytes
+        self.ttl: float = ttl
+        self._entries: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._keys_by_table: Dict[str, Set[str]] = {}
+        # Contatore delle scritture per tabella: un risultato letto prima di una scrittura non viene salvato
+        self._generations: Dict[str, int] = {}
+        self._bytes: int = 0
+        self._lock: threading.Lock = threading.Lock()
+        self._hits: int = 0
+        self._misses: int = 0
+        self._evictions: int = 0
+        self._invalidations: int = 0
+
+    @classmethod
+    def from_env(cls) -> "ResultCache":
+        """
+        Questo metodo crea la cache leggendo la configurazione dalle variabili d'ambiente.
+        """
+        return cls(
+            max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+            max_entry_bytes=int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", 8 * 1024 * 1024)),
+            ttl=float(os.getenv("RESULT_CACHE_TTL", 300)),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def generation(self, tables: Set[str]) -> Dict[str, int]:
+        """
+        Questo metodo restituisce il numero di scritture registrate finora per ciascuna tabella.
+        Va letto prima di eseguire la query e passato a put().
+        """
+        with self._lock:
+            return {table: self._generations.get(table, 0) for table in tables}
+
+    def get(self, key: str) -> Optional[Tuple[List[str], List[Tuple]]]:
+        """
+        Questo metodo restituisce le colonne e le righe in cache per la query normalizzata, oppure None.
+        """
+        with self._lock:
+            entry: Optional[CachedResult] = self._entries.get(key)
+            if entry is None or time.monotonic() - entry.stored_at > self.ttl:
+                if entry is not None:
+                    self._delete(key)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return (entry.columns, entry.rows)
+
+    def put(self, key: str, tables: Set[str], columns: List[str], rows: List[Tuple], generation: Dict[str, int]) -> None:
+        """
+        Questo metodo salva in cache il risultato di una query che ha letto le tabelle indicate.
+        Il risultato non viene salvato se è troppo grande o se una delle tabelle è stata modificata mentre la query era in esecuzione.
+        """
+        if not self.enabled or not tables:
+            return
+        size: int = estimate_size(columns, rows)
+        if size > self.max_entry_bytes:
+            return
+
+        with self._lock:
+            if any(self._generations.get(table, 0) != count for table, count in generation.items()):
+                return
+            if key in self._entries:
+                self._delete(key)
+            self._entries[key] = CachedResult(columns, rows, tables, size)
+            self._bytes += size
+            for table in tables:
+                self._keys_by_table.setdefault(table, set()).add(key)
+            while self._bytes > self.max_bytes:
+                self._delete(next(iter(self._entries)))
+                self._evictions += 1
+
+    def invalidate_tables(self, tables: Set[str]) -> None:
+        """
+        Questo metodo elimina tutti i risultati che hanno letto almeno una delle tabelle modificate.
+        """
+        with self._lock:
+            for table in tables:
+                table = table.lower()
+                self._generations[table] = self._generations.get(table, 0) + 1
+                for key in list(self._keys_by_table.get(table, ())):
+                    self._delete(key)
+                    self._invalidations += 1
+
+    def clear(self) -> None:
+        """
+        Questo metodo svuota la cache.
+        """
+        with self._lock:
+            for key in list(self._entries):
+                self._delete(key)
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Questo metodo restituisce le metriche della cache dei risultati.
+        """
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+            }
+
+    def _delete(self, key: str) -> None:
+        """
+        Questo metodo elimina un risultato dalla cache. Va chiamato tenendo il lock della cache.
+        """
+        entry: CachedResult = self._entries.pop(key)
+        self._bytes -= entry.size
+        for table in entry.tables:
+            keys: Optional[Set[str]] = self._keys_by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_table[table]
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from model_controller import ModelController
+from app_logging import get_logger
+
+"""
+Questo file contiene la classe SchemaCache, una cache in memoria dello schema del database condivisa da tutto il processo del backend.
+Lo schema cambia raramente, quindi viene letto da information_schema solo alla prima richiesta, alla scadenza del TTL
+o dopo un'invalidazione esplicita (endpoint /schema_summary/invalidate oppure errori che indicano una modifica dello schema).
+Variabili d'ambiente:
+- SCHEMA_CACHE_TTL: secondi di validità dello schema in cache.
+- SCHEMA_CACHE_MIN_REFRESH: secondi minimi tra due ricaricamenti causati da errori, per evitare che query errate
+  costringano a rileggere lo schema ad ogni richiesta.
+"""
+
+logger = get_logger("schema_cache")
+
+class SchemaSnapshot:
+    """
+    Questa classe rappresenta lo schema letto dal database in un certo momento:
+    il riepilogo (tabella, colonna), il testo dello schema già formattato per il prompt del modello e la sua impronta.
+    """
+    def __init__(self, summary: List[Tuple[str, str]], loaded_at: float):
+        self.summary: List[Tuple[str, str]] = [(row[0], row[1]) for row in summary]
+        self.prompt: str = ModelController.format_schema_summary(self.summary)
+        self.fingerprint: str = hashlib.sha256(repr(sorted(self.summary)).encode("utf-8")).hexdigest()[:16]
+        self.tables: List[str] = sorted({table_name for table_name, _ in self.summary})
+        self.loaded_at: float = loaded_at
+
+
+class SchemaCache:
+    def __init__(self, ttl: float, min_refresh: float):
+        self.ttl: float = ttl
+        self.min_refresh: float = min_refresh
+        self._snapshot: Optional[SchemaSnapshot] = None
+        self._stale: bool = False
+        self._lock: threading.Lock = threading.Lock()
+        self._hits: int = 0
+        self._loads: int = 0
+
+    def get(self, cm) -> SchemaSnapshot:
+        """
+        Questo metodo restituisce lo schema in cache, ricaricandolo con il ConnectionManager fornito se è scaduto o invalidato.
+        Se un'altra richiesta sta già ricaricando lo schema, restituisce subito quello precedente invece di attendere.
+        """
+        snapshot: Optional[SchemaSnapshot] = self._snapshot
+        if snapshot is not None and not self._needs_reload(snapshot):
+            self._hits += 1
+            return snapshot
+
+        if snapshot is not None and not self._lock.acquire(blocking=False):
+            self._hits += 1
+            return snapshot
+        if snapshot is None:
+            self._lock.acquire()
+
+        try:
+            # Un'altra richiesta potrebbe aver ricaricato lo schema mentre si attendeva il lock
+            if self._snapshot is not None and not self._needs_reload(self._snapshot):
+                self._hits += 1
+                return self._snapshot
+
+            summary: List[Tuple[str, str]] = cm.query_schema_summary()
+            self._snapshot = SchemaSnapshot(summary, time.monotonic())
+            self._stale = False
+            self._loads += 1
+            logger.info("Schema summary loaded (fingerprint %s).", self._snapshot.fingerprint)
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def invalidate(self) -> None:
+        """
+        Questo metodo scarta lo schema in cache: la richiesta successiva lo rilegge dal database.
+        """
+        self._snapshot = None
+        self._stale = False
+
+    def mark_stale(self) -> None:
+        """
+        Questo metodo segnala che lo schema potrebbe essere cambiato (ad esempio dopo un errore di tabella o colonna inesistente).
+        Lo schema viene riletto alla richiesta successiva, ma non prima di SCHEMA_CACHE_MIN_REFRESH secondi dall'ultimo caricamento.
+        """
+        self._stale = True
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Questo metodo restituisce le metriche della cache dello schema.
+        """
+        snapshot: Optional[SchemaSnapshot] = self._snapshot
+        return {
+            "hits": self._hits,
+            "loads": self._loads,
+            "age": time.monotonic() - snapshot.loaded_at if snapshot else -1,
+        }
+
+    def _needs_reload(self, snapshot: SchemaSnapshot) -> bool:
+        age: float = time.monotonic() - snapshot.loaded_at
+        if age > self.ttl:
+            return True
+        return self._stale and age > self.min_refresh
+
+
+# ---------------------------------------------------------- CACHE CONDIVISA DAL PROCESSO ---------------------------------------------------
+
+_schema_cache: Optional[SchemaCache] = None
+_schema_cache_lock: threading.Lock = threading.Lock()
+
+def get_schema_cache() -> SchemaCache:
+    """
+    Questa funzione restituisce la cache dello schema del processo, creandola alla prima chiamata.
+    """
+    global _schema_cache
+    if _schema_cache is None:
+        with _schema_cache_lock:
+            if _schema_cache is None:
+                _schema_cache = SchemaCache(
+                    ttl=float(os.getenv("SCHEMA_CACHE_TTL", 3600)),
+                    min_refresh=float(os.getenv("SCHEMA_CACHE_MIN_REFRESH", 30)),
+                )
+    return _schema_cache
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Set
+
+"""
+Questo file contiene la classe DataVersions, che tiene un numero di versione per ogni tabella del database
+e lo usa per costruire gli ETag delle risposte di /schema_summary e /sql_search.
+La versione di una tabella aumenta a ogni scrittura confermata da ConnectionManager.commit_write, cioè solo con /add e /add_batch
+(/sql_search rifiuta gli statement diversi da SELECT), notificata con register_write_listener.
+Lo schema ha come versione la sua impronta (fingerprint).
+Un ETag è l'hash delle versioni delle tabelle lette, della versione dello schema e di ciò che identifica la risposta
+(query, pagina, formato): se il client lo rimanda in If-None-Match e nessuna di queste parti è cambiata, il backend
+risponde 304 senza eseguire la query.
+Gli ETag contengono anche:
+- un identificativo del processo (boot id), perché le versioni ripartono da zero a ogni avvio del backend;
+- un periodo di DATA_VERSION_TTL secondi, perché le scritture fatte fuori dal backend (ad esempio load_db o un client
+  collegato direttamente a MariaDB) non aumentano le versioni: vengono rilevate solo al cambio di periodo, quando gli ETag
+  cambiano e il client riceve di nuovo i dati completi. Fino ad allora il client può ricevere 304 su dati non aggiornati.
+Variabili d'ambiente:
+- DATA_VERSION_TTL: durata in secondi di un periodo (0 = gli ETag cambiano solo con le scritture e i riavvii).
+"""
+
+
+class DataVersions:
+    def __init__(self, ttl: float):
+        self.ttl: float = ttl
+        self.boot_id: str = secrets.token_hex(8)
+        self._versions: Dict[str, int] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "DataVersions":
+        """
+        Questo metodo crea il registro delle versioni leggendo la configurazione dalle variabili d'ambiente.
+        """
+        return cls(ttl=float(os.getenv("DATA_VERSION_TTL", 300)))
+
+    def bump(self, tables: Set[str]) -> None:
+        """
+        Questo metodo aumenta la versione delle tabelle modificate. Va registrato come listener delle scritture.
+        """
+        with self._lock:
+            for table in tables:
+                table = table.lower()
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def versions(self, tables: Iterable[str]) -> Dict[str, int]:
+        with self._lock:
+            return {table.lower(): self._versions.get(table.lower(), 0) for table in tables}
+
+    def etag(self, tables: Iterable[str], *parts: Any) -> str:
+        """
+        Questo metodo restituisce l'ETag di una risposta che dipende dalle tabelle indicate e dalle altre parti
+        (ad esempio la versione dello schema, la query e il formato). Le versioni vanno lette prima di eseguire la query:
+        se una scrittura avviene durante l'esecuzione, l'ETag restituito non corrisponderà più a quello delle richieste successive.
+        """
+        period: int = int(time.time() // self.ttl) if self.ttl > 0 else 0
+        payload: str = json.dumps([self.boot_id, period, sorted(self.versions(tables).items()), list(parts)], default=str)
+        return '"' + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32] + '"'
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Questo metodo restituisce il numero di scritture registrate per ogni tabella.
+        """
+        with self._lock:
+            return dict(self._versions)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Questa funzione verifica se l'intestazione If-None-Match contiene l'ETag indicato (anche in forma debole W/"...") oppure "*".
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
@@ -0,0 +1,13 @@
+import os
+import sys
+
+"""
+I moduli del backend vengono copiati nella stessa cartella dell'immagine Docker (/app) e si importano per nome:
+per i test unitari le cartelle del backend, di text_to_sql e di common vengono aggiunte al percorso di ricerca dei moduli.
+I test si eseguono con: python -m pytest backend/tests
+"""
+
+ROOT: str = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(ROOT, "common", "src"))
+sys.path.insert(0, os.path.join(ROOT, "text_to_sql", "src"))
+sys.path.insert(0, os.path.join(ROOT, "backend", "src", "backend"))
@@ -0,0 +1,76 @@
+from typing import Any, Dict, List
+
+from cost_guard import CostGuard
+
+
+def step(select_id: int, table: str, rows: int, type: str = "ALL", ref: Any = None, extra: str = "") -> Dict[str, Any]:
+    """
+    Restituisce una riga dell'EXPLAIN di MariaDB con i soli campi letti da CostGuard.
+    """
+    return {"id": select_id, "table": table, "type": type, "rows": rows, "ref": ref, "Extra": extra}
+
+
+def guard(**overrides: Any) -> CostGuard:
+    settings: Dict[str, Any] = {"enabled": True, "max_rows": 100000, "limit_rows": 1000, "auto_limit": 50}
+    settings.update(overrides)
+    return CostGuard(**settings)
+
+
+def test_rows_multiply_within_select_and_add_across_selects():
+    plan: List[Dict[str, Any]] = [
+        step(1, "movies", 200, extra="Using where"),
+        step(1, "directors", 1, type="eq_ref", ref="db.movies.id_director"),
+        step(2, "platforms", 10),
+    ]
+    assert guard().estimate_rows(plan) == (200 * 1 + 10, False)
+
+
+def test_join_without_condition_is_cartesian():
+    plan: List[Dict[str, Any]] = [step(1, "movies", 200), step(1, "directors", 50)]
+    assert guard().estimate_rows(plan) == (200 * 50, True)
+
+
+def test_join_buffer_with_condition_is_not_cartesian():
+    # Un join con condizione eseguito con il join buffer ha type ALL ma "Using where" nell'Extra
+    plan: List[Dict[str, Any]] = [step(1, "movies", 200), step(1, "directors", 50, extra="Using where; Using join buffer (flat, BNL join)")]
+    assert guard().estimate_rows(plan) == (200 * 50, False)
+
+
+def test_single_full_scan_is_not_cartesian():
+    assert guard().estimate_rows([step(1, "movies", 200)]) == (200, False)
+    assert guard().estimate_rows([step(1, "movies", 200), step(2, "directors", 50)]) == (250, False)
+
+
+def test_check_rejects_cartesian_join_with_reason():
+    plan: List[Dict[str, Any]] = [step(1, "movies", 2), step(1, "directors", 2)]
+    status, sql_query, detail = guard().check("SELECT * FROM movies, directors", plan)
+    assert status == "too_expensive" and sql_query == "SELECT * FROM movies, directors"
+    assert detail is not None and "cartesian" in detail
+    assert guard(reject_cartesian=False).check("SELECT * FROM movies, directors", plan) == ("ok", "SELECT * FROM movies, directors", None)
+
+
+def test_check_rejects_queries_over_max_rows():
+    status, _, detail = guard().check("SELECT * FROM movies", [step(1, "movies", 100001)])
+    assert status == "too_expensive"
+    assert detail is not None and "100001" in detail and "100000" in detail
+
+
+def test_check_adds_limit_only_when_missing():
+    plan: List[Dict[str, Any]] = [step(1, "movies", 5000)]
+    assert guard().check("SELECT * FROM movies;", plan) == ("ok", "SELECT * FROM movies\nLIMIT 50", None)
+    assert guard().check("SELECT * FROM movies LIMIT 10", plan) == ("ok", "SELECT * FROM movies LIMIT 10", None)
+    assert guard().check("SELECT * FROM movies", [step(1, "movies", 1000)]) == ("ok", "SELECT * FROM movies", None)
+
+
+def test_disabled_guard_accepts_everything():
+    plan: List[Dict[str, Any]] = [step(1, "movies", 10 ** 9), step(1, "directors", 10 ** 9)]
+    assert guard(enabled=False).check("SELECT * FROM movies, directors", plan) == ("ok", "SELECT * FROM movies, directors", None)
+
+
+def test_auto_limit_is_not_added_inside_a_trailing_comment():
+    plan: List[Dict[str, Any]] = [step(1, "movies", 5000)]
+    for comment in ("-- tutti i film", "# tutti i film"):
+        status, sql_query, _ = guard().check(f"SELECT * FROM movies {comment}", plan)
+        assert status == "ok" and sql_query == f"SELECT * FROM movies {comment}\nLIMIT 50"
+    # Un LIMIT già presente, anche se seguito da un commento, non viene cambiato
+    assert guard().check("SELECT * FROM movies LIMIT 10 -- primi 10", plan) == ("ok", "SELECT * FROM movies LIMIT 10 -- primi 10", None)
@@ -0,0 +1,108 @@
+import sqlite3
+from typing import Any, List, Optional, Tuple
+
+import pytest
+
+from pagination import PageToken, Paginator, keyset_key, limit_query
+
+
+@pytest.mark.parametrize("sql_query, expected", [
+    ("SELECT * FROM movies", "id"),
+    ("SELECT id, titolo FROM movies WHERE anno = 2020;", "id"),
+    ("SELECT m.id, m.titolo FROM `movies` AS m WHERE m.titolo = 'a, b' ORDER BY m.id ASC", "id"),
+    ("select movies.* from movies order by id", "id"),
+    # Senza la chiave tra le colonne
+    ("SELECT titolo FROM movies", None),
+    # Join: la stessa chiave può comparire in più righe
+    ("SELECT movies.id, platforms.nome FROM movies JOIN platforms ON platforms.id IN (movies.id_platform1, movies.id_platform2)", None),
+    ("SELECT movies.id FROM movies, directors WHERE movies.id_director = directors.id", None),
+    ("SELECT DISTINCT id FROM movies", None),
+    ("SELECT id, COUNT(*) FROM movies GROUP BY id", None),
+    ("SELECT id FROM movies UNION SELECT id FROM directors", None),
+    ("SELECT id FROM movies WHERE id_director IN (SELECT id FROM directors)", None),
+    ("SELECT id FROM movies LIMIT 10", None),
+    # Ordinamento diverso da quello per chiave
+    ("SELECT id, titolo FROM movies ORDER BY titolo", None),
+    ("SELECT id FROM movies ORDER BY id DESC", None),
+    # Un'altra colonna con il nome della chiave
+    ("SELECT id, titolo AS id FROM movies", None),
+    ("SELECT id FROM film", None),
+    # Le parole chiave dentro stringhe e commenti non contano
+    ("SELECT id FROM movies WHERE titolo = 'join the group by' -- limit", "id"),
+])
+def test_keyset_key(sql_query: str, expected: Optional[str]):
+    assert keyset_key(sql_query) == expected
+
+
+@pytest.mark.parametrize("sql_query, expected", [
+    ("SELECT * FROM movies;", "SELECT * FROM movies\nLIMIT 11"),
+    ("SELECT * FROM movies -- tutti", "SELECT * FROM movies -- tutti\nLIMIT 11"),
+    ("SELECT * FROM movies ORDER BY titolo LIMIT 5", "SELECT * FROM movies ORDER BY titolo LIMIT 5 OFFSET 0"),
+    ("SELECT * FROM movies LIMIT 100 OFFSET 20", "SELECT * FROM movies LIMIT 11 OFFSET 20"),
+    ("SELECT * FROM movies LIMIT 20, 100", "SELECT * FROM movies LIMIT 11 OFFSET 20"),
+    ("SELECT * FROM movies WHERE titolo = 'limit 3'", "SELECT * FROM movies WHERE titolo = 'limit 3'\nLIMIT 11"),
+    ("SELECT * FROM movies LIMIT 100 -- fine", "SELECT * FROM (SELECT * FROM movies LIMIT 100 -- fine\n) AS _limited LIMIT 11"),
+])
+def test_limit_query(sql_query: str, expected: str):
+    assert limit_query(sql_query, 11) == expected
+
+
+def read_pages(connection: sqlite3.Connection, paginator: Paginator, sql_query: str) -> List[List[Tuple]]:
+    """
+    Legge tutte le pagine della query come il backend: una pagina più una riga, ripartendo dall'ultima chiave restituita.
+    """
+    key: Optional[str] = keyset_key(sql_query)
+    assert key is not None
+    pages: List[List[Tuple]] = []
+    after: Any = None
+    while True:
+        cursor: sqlite3.Cursor = connection.execute(paginator.page_query(sql_query, key, after is not None),
+                                                    (after,) if after is not None else ())
+        columns: List[str] = [description[0] for description in cursor.description]
+        rows: List[Tuple] = cursor.fetchall()
+        pages.append(rows[:paginator.page_size])
+        if len(rows) <= paginator.page_size:
+            return pages
+        token: PageToken = paginator.decode_token(paginator.encode_token(PageToken(sql_query, key, rows[paginator.page_size - 1][columns.index(key)])))
+        after = token.after
+
+
+@pytest.fixture
+def connection() -> sqlite3.Connection:
+    connection: sqlite3.Connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE movies (id INTEGER PRIMARY KEY, titolo TEXT, anno INTEGER)")
+    connection.execute("CREATE TABLE platforms (id INTEGER PRIMARY KEY, nome TEXT)")
+    connection.executemany("INSERT INTO movies VALUES (?, ?, ?)", [(i, f"film {i}", 2000 + i % 3) for i in range(1, 11)])
+    connection.executemany("INSERT INTO platforms VALUES (?, ?)", [(1, "a"), (2, "b"), (3, "c")])
+    return connection
+
+
+@pytest.mark.parametrize("page_size", [1, 3, 5, 10, 20])
+def test_keyset_pages_return_every_row_once(connection: sqlite3.Connection, page_size: int):
+    paginator: Paginator = Paginator(page_size, b"secret")
+    pages: List[List[Tuple]] = read_pages(connection, paginator, "SELECT id, titolo FROM movies WHERE anno <> 2001")
+    rows: List[Tuple] = [row for page in pages for row in page]
+    expected: List[Tuple] = connection.execute("SELECT id, titolo FROM movies WHERE anno <> 2001 ORDER BY id").fetchall()
+    assert rows == expected
+    assert all(len(page) == page_size for page in pages[:-1])
+
+
+def test_duplicate_keys_are_not_paged_with_keyset(connection: sqlite3.Connection):
+    # Con il join ogni film compare una volta per piattaforma: "id > ultimo id" salterebbe le righe con lo stesso id
+    sql_query: str = "SELECT movies.id, platforms.nome FROM movies JOIN platforms ORDER BY movies.id"
+    ids: List[int] = [row[0] for row in connection.execute(sql_query)]
+    assert len(ids) > len(set(ids))
+    assert keyset_key(sql_query) is None
+    rows: List[Tuple] = connection.execute(limit_query(sql_query, 5)).fetchall()
+    assert rows == connection.execute(sql_query).fetchall()[:5]
+
+
+def test_page_token_rejects_tampering():
+    paginator: Paginator = Paginator(10, b"secret")
+    encoded: str = paginator.encode_token(PageToken("SELECT * FROM movies", "id", 42))
+    token: PageToken = paginator.decode_token(encoded)
+    assert (token.sql, token.key, token.after) == ("SELECT * FROM movies", "id", 42)
+    with pytest.raises(ValueError):
+        Paginator(10, b"other secret").decode_token(encoded)
+    with pytest.raises(ValueError):
+        paginator.decode_token("not a token")
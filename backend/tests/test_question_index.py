@@ -0,0 +1,56 @@
+from question_cache import QuestionCache
+from question_index import QuestionIndex, normalize_question, question_shape, sql_aggregate_shape, substitute_numbers
+
+
+def test_normalize_removes_stopwords_accents_and_numbers():
+    tokens, numbers = normalize_question("Quali sono i film usciti nell'anno 2010 da Città?")
+    assert tokens == ["quali", "film", "#", "citta"]
+    assert numbers == ["2010"]
+
+
+def test_normalize_keeps_intent_and_aggregation_words():
+    for word in ("quanti", "quante", "quale", "quali", "elenca", "mostra", "tutti"):
+        assert normalize_question(f"{word} film")[0] == [word, "film"]
+
+
+def test_question_and_sql_shape():
+    assert question_shape(normalize_question("Quanti film del 2020?")[0]) == {"count"}
+    assert question_shape(normalize_question("Quali film del 2020?")[0]) == frozenset()
+    assert sql_aggregate_shape("SELECT COUNT(*), max (anno) FROM movies") == {"count", "max"}
+    assert sql_aggregate_shape("SELECT titolo FROM movies WHERE titolo = 'count(x)'") == frozenset()
+
+
+def test_find_requires_same_aggregation():
+    index: QuestionIndex = QuestionIndex(0.5)
+    index.add("list", "quali film del 2020", "partition")
+    match = index.find("quanti film del 2020", "partition")
+    assert match is None
+
+
+def test_find_similar_question_with_different_number():
+    index: QuestionIndex = QuestionIndex(0.8)
+    index.add("key", "Quali film del 2020?", "partition")
+    match = index.find("quali sono i film usciti nel 2010", "partition")
+    assert match is not None
+    assert match[0] == "key" and match[2] == ["2020"] and match[3] == ["2010"]
+    assert index.find("quali sono i film usciti nel 2010", "other partition") is None
+
+
+def test_substitute_numbers():
+    sql_query: str = "SELECT titolo FROM movies WHERE anno = 2020 LIMIT 20"
+    assert substitute_numbers(sql_query, ["2020"], ["2010"]) == "SELECT titolo FROM movies WHERE anno = 2010 LIMIT 20"
+    assert substitute_numbers(sql_query, ["2020"], ["2020"]) == sql_query
+    # Il numero non compare nella query: la sostituzione non è sicura
+    assert substitute_numbers(sql_query, ["1999"], ["2010"]) is None
+    # Lo stesso numero non può diventare due numeri diversi
+    assert substitute_numbers("SELECT 5 + 5", ["5", "5"], ["1", "2"]) is None
+    # Le cifre dentro un numero decimale o un identificatore non vengono toccate
+    assert substitute_numbers("SELECT 20.5, t20 FROM x WHERE a = 20", ["20"], ["30"]) == "SELECT 20.5, t20 FROM x WHERE a = 30"
+
+
+def test_cache_discards_similar_query_without_requested_aggregation():
+    cache: QuestionCache = QuestionCache(10, 100, None, 0.5)
+    cache.put("quanti film del 2020", "model", "fingerprint", "SELECT titolo FROM movies WHERE anno = 2020")
+    assert cache.get_similar("quanti film del 2011", "model", "fingerprint") is None
+    cache.put("quanti film del 2020", "model", "fingerprint", "SELECT COUNT(*) FROM movies WHERE anno = 2020")
+    assert cache.get_similar("quanti film del 2011", "model", "fingerprint") == "SELECT COUNT(*) FROM movies WHERE anno = 2011"
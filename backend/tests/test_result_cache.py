@@ -0,0 +1,50 @@
+from typing import Dict, List, Set, Tuple
+
+from result_cache import ResultCache, is_cacheable, normalize_sql, referenced_tables
+
+SCHEMA_TABLES: Set[str] = {"movies", "directors", "platforms"}
+
+
+def test_normalize_collapses_whitespace_outside_literals():
+    assert normalize_sql("  SELECT  *\n\tFROM movies ;  ") == "SELECT * FROM movies"
+    assert normalize_sql("SELECT * FROM movies WHERE titolo = 'a  b'") == "SELECT * FROM movies WHERE titolo = 'a  b'"
+    assert normalize_sql("SELECT `a  b` FROM movies") == "SELECT `a  b` FROM movies"
+
+
+def test_normalize_keeps_case():
+    # In MariaDB i nomi delle tabelle possono distinguere maiuscole e minuscole
+    assert normalize_sql("SELECT * FROM Movies") != normalize_sql("SELECT * FROM movies")
+
+
+def test_referenced_tables():
+    sql_query: str = "SELECT m.titolo, d.nome FROM movies m JOIN `Directors` d ON m.id_director = d.id"
+    assert referenced_tables(sql_query, SCHEMA_TABLES) == {"movies", "directors"}
+    assert referenced_tables("SELECT * FROM movies WHERE titolo = 'platforms'", SCHEMA_TABLES) == {"movies"}
+    assert referenced_tables("SELECT 1", SCHEMA_TABLES) == set()
+
+
+def test_is_cacheable():
+    assert is_cacheable("SELECT * FROM movies WHERE anno = 2020")
+    assert is_cacheable("SELECT * FROM movies WHERE titolo = 'now'")
+    assert not is_cacheable("SELECT * FROM movies ORDER BY RAND()")
+    assert not is_cacheable("SELECT * FROM movies WHERE anno = YEAR(NOW())")
+    assert not is_cacheable("SELECT * FROM information_schema.tables")
+
+
+def test_write_invalidates_only_dependent_results():
+    cache: ResultCache = ResultCache(max_bytes=1024 * 1024, max_entry_bytes=1024 * 1024, ttl=60)
+    rows: List[Tuple] = [("film", 2020)]
+    cache.put("movies query", {"movies"}, ["titolo", "anno"], rows, cache.generation({"movies"}))
+    cache.put("platforms query", {"platforms"}, ["nome"], [("a",)], cache.generation({"platforms"}))
+
+    cache.invalidate_tables({"Movies"})
+    assert cache.get("movies query") is None
+    assert cache.get("platforms query") == (["nome"], [("a",)])
+
+
+def test_result_read_before_a_write_is_not_stored():
+    cache: ResultCache = ResultCache(max_bytes=1024 * 1024, max_entry_bytes=1024 * 1024, ttl=60)
+    generation: Dict[str, int] = cache.generation({"movies"})
+    cache.invalidate_tables({"movies"})
+    cache.put("movies query", {"movies"}, ["titolo"], [("film",)], generation)
+    assert cache.get("movies query") is None
@@ -0,0 +1,47 @@
+from typing import Any, Dict, List, Optional
+
+from tracing import (SPAN_KIND_CLIENT, SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, Span, current_trace_id, finish_trace,
+                     otlp_request, outgoing_headers, parse_traceparent, span, start_trace)
+
+
+def test_parse_traceparent():
+    assert parse_traceparent("00-" + "a" * 32 + "-" + "b" * 16 + "-01") == ("a" * 32, "b" * 16)
+    assert parse_traceparent("00-" + "0" * 32 + "-" + "b" * 16 + "-01") is None
+    assert parse_traceparent("garbage") is None
+    assert parse_traceparent(None) is None
+
+
+def test_trace_continues_caller_and_records_span_kinds():
+    root, token = start_trace("POST /sql_search", "00-" + "a" * 32 + "-" + "b" * 16 + "-01")
+    with span("execute"):
+        pass
+    with span("backend POST /sql_search", SPAN_KIND_CLIENT) as client_span:
+        # Il traceparent inviato all'altro servizio ha come padre lo span della chiamata
+        assert outgoing_headers() == {"traceparent": f"00-{'a' * 32}-{client_span.span_id}-01"}
+    finish_trace(root, token)
+    assert current_trace_id() is None
+
+    spans: List[Dict[str, Any]] = otlp_request("test", [root.trace])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    kinds: Dict[str, int] = {entry["name"]: entry["kind"] for entry in spans}
+    assert kinds == {"POST /sql_search": SPAN_KIND_SERVER, "execute": SPAN_KIND_INTERNAL, "backend POST /sql_search": SPAN_KIND_CLIENT}
+    parents: Dict[str, Optional[str]] = {entry["name"]: entry.get("parentSpanId") for entry in spans}
+    assert parents["POST /sql_search"] == "b" * 16
+    assert parents["execute"] == parents["backend POST /sql_search"] == root.span_id
+
+
+def test_span_outside_a_trace_does_nothing():
+    with span("startup") as startup_span:
+        assert startup_span is None
+    assert outgoing_headers() == {}
+
+
+def test_failed_span_is_marked_as_error():
+    root, token = start_trace("GET /schema_summary")
+    try:
+        with span("query"):
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    finish_trace(root, token)
+    failed: Span = [child for child in root.trace.snapshot() if child.name == "query"][0]
+    assert failed.status == "error" and "boom" in failed.attributes["error"]
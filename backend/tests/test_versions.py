@@ -0,0 +1,31 @@
+from versions import DataVersions, etag_matches
+
+
+def test_etag_matches():
+    etag: str = '"abc"'
+    assert etag_matches('"abc"', etag)
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"other", W/"abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches("abc", etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("", etag)
+
+
+def test_etag_changes_only_with_read_tables():
+    versions: DataVersions = DataVersions(ttl=0)
+    etag: str = versions.etag({"movies"}, "schema", "SELECT * FROM movies", "json")
+    assert etag == versions.etag({"movies"}, "schema", "SELECT * FROM movies", "json")
+    assert etag != versions.etag({"movies"}, "schema", "SELECT * FROM movies", "columnar")
+
+    versions.bump({"platforms"})
+    assert etag == versions.etag({"movies"}, "schema", "SELECT * FROM movies", "json")
+    versions.bump({"Movies"})
+    assert etag != versions.etag({"movies"}, "schema", "SELECT * FROM movies", "json")
+    assert versions.stats() == {"platforms": 1, "movies": 1}
+
+
+def test_etag_changes_after_restart():
+    # Le versioni ripartono da zero a ogni avvio: il boot id evita che un ETag vecchio risulti ancora valido
+    assert DataVersions(ttl=0).etag({"movies"}, "query") != DataVersions(ttl=0).etag({"movies"}, "query")
@@ -0,0 +1,182 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import reprlib
+import sys
+import threading
+from typing import Any, Dict, Optional
+
+"""
+Questo file configura il logging del backend, che sostituisce le print usate in precedenza, e del frontend:
+si trova in common/src e viene copiato in entrambe le immagini, quindi i due servizi campionano, troncano e scartano
+i messaggi allo stesso modo e leggono le stesse variabili d'ambiente.
+I messaggi passano da una coda: il thread che gestisce la richiesta inserisce il record nella coda (QueueHandler)
+e un thread separato (QueueListener) lo scrive su stdout, quindi la scrittura non rallenta le risposte.
+Se la coda è piena i messaggi vengono scartati invece di bloccare la richiesta.
+Prima di entrare nella coda ogni messaggio viene:
+- campionato: i messaggi con l'attributo sample_rate (ad esempio logger.debug(..., extra={"sample_rate": 0.01}))
+  vengono tenuti solo in quella frazione dei casi; i messaggi DEBUG senza sample_rate usano LOG_DEBUG_SAMPLE_RATE;
+  gli avvisi e gli errori non vengono mai scartati;
+- troncato: gli argomenti vengono convertiti con reprlib (liste, tuple e dizionari grandi sono abbreviati senza
+  convertirli per intero) e il messaggio finale è limitato a LOG_MAX_LENGTH caratteri.
+I messaggi DEBUG (righe lette dal database, risultati delle ricerche, schema, richieste e risposte del modello)
+non vengono nemmeno formattati se il livello è INFO o superiore.
+Variabili d'ambiente:
+- LOG_LEVEL: livello minimo dei messaggi (DEBUG, INFO, WARNING, ERROR).
+- LOG_FORMAT: "text" (predefinito) oppure "json", un oggetto JSON per riga.
+- LOG_MAX_LENGTH: lunghezza massima di un messaggio, in caratteri.
+- LOG_DEBUG_SAMPLE_RATE: frazione (da 0 a 1) dei messaggi DEBUG scritti.
+- LOG_QUEUE_SIZE: numero massimo di messaggi in attesa di essere scritti.
+"""
+
+# Logger radice dei servizi: i logger dei moduli sono suoi figli (text2sql.backend, text2sql.frontend, ...)
+ROOT_LOGGER: str = "text2sql"
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Questo filtro scarta una parte dei messaggi campionati (vedi sample_rate). Gli avvisi e gli errori passano sempre.
+    """
+    def __init__(self, debug_sample_rate: float):
+        super().__init__()
+        self.debug_sample_rate: float = debug_sample_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate: Optional[float] = getattr(record, "sample_rate", None)
+        if rate is None:
+            rate = self.debug_sample_rate if record.levelno <= logging.DEBUG else 1.0
+        return rate >= 1.0 or random.random() < rate
+
+
+class TruncatingFilter(logging.Filter):
+    """
+    Questo filtro costruisce il messaggio con argomenti abbreviati e lo tronca a max_length caratteri,
+    così nella coda entra solo una stringa di dimensione limitata.
+    """
+    def __init__(self, max_length: int):
+        super().__init__()
+        self.max_length: int = max_length
+        self.repr: reprlib.Repr = reprlib.Repr()
+        self.repr.maxstring = max_length
+        self.repr.maxother = max_length
+        self.repr.maxlist = self.repr.maxtuple = self.repr.maxdict = self.repr.maxset = 20
+        self.repr.maxlevel = 4
+
+    def shorten(self, value: Any) -> Any:
+        if isinstance(value, str):
+            return self.truncate(value)
+        if isinstance(value, (int, float, bool)) or value is None:
+            return value
+        return self.repr.repr(value)
+
+    def truncate(self, message: str) -> str:
+        if len(message) <= self.max_length:
+            return message
+        return f"{message[:self.max_length]}... (+{len(message) - self.max_length} caratteri)"
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.args:
+            args = record.args
+            if isinstance(args, dict):
+                record.args = {key: self.shorten(value) for key, value in args.items()}
+            else:
+                record.args = tuple(self.shorten(value) for value in args)
+        record.msg = self.truncate(record.getMessage())
+        record.args = None
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Questo handler inserisce i messaggi nella coda senza mai attendere: se la coda è piena il messaggio viene scartato e contato.
+    """
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped: int = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Questo formatter scrive ogni messaggio come oggetto JSON su una riga.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_handler: Optional[DroppingQueueHandler] = None
+_setup_lock: threading.Lock = threading.Lock()
+
+def setup_logging() -> None:
+    """
+    Questa funzione configura il logger radice leggendo le variabili d'ambiente e avvia il thread di scrittura.
+    Le chiamate successive alla prima non fanno nulla.
+    """
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        formatter: logging.Formatter = (
+            JsonFormatter() if os.getenv("LOG_FORMAT", "text").lower() == "json"
+            else logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+        )
+        stream_handler: logging.StreamHandler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(formatter)
+
+        _handler = DroppingQueueHandler(queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", 10000))))
+        _handler.addFilter(SamplingFilter(float(os.getenv("LOG_DEBUG_SAMPLE_RATE", 1.0))))
+        _handler.addFilter(TruncatingFilter(int(os.getenv("LOG_MAX_LENGTH", 1000))))
+
+        root: logging.Logger = logging.getLogger(ROOT_LOGGER)
+        root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+        root.addHandler(_handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(_handler.queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+def shutdown_logging() -> None:
+    """
+    Questa funzione ferma il thread di scrittura dopo aver scritto i messaggi ancora in coda.
+    """
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Questa funzione restituisce il logger di un modulo, configurando il logging alla prima chiamata.
+    """
+    setup_logging()
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+def logging_stats() -> Dict[str, float]:
+    """
+    Questa funzione restituisce le metriche del logging: messaggi in coda e messaggi scartati perché la coda era piena.
+    """
+    if _handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
@@ -0,0 +1,366 @@
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+from app_logging import get_logger
+
+"""
+Questo file contiene il tracing delle richieste: permette di vedere, per una singola ricerca, quanto tempo è stato speso
+nel frontend, in ogni fase del backend, in Ollama e in MariaDB.
+Il modulo si trova in common/src e viene copiato nelle immagini del backend e del frontend, che registrano gli span allo stesso modo.
+Una traccia è formata da span, ciascuno con nome, tipo, inizio, durata, attributi e span padre:
+- lo span radice (SERVER) viene aperto dal middleware del servizio per ogni richiesta HTTP;
+- gli span figli vengono aperti con span(...) attorno alle fasi della richiesta (INTERNAL) e alle chiamate verso
+  altri servizi (CLIENT, ad esempio le chiamate del frontend al backend).
+Lo span corrente è in una ContextVar, quindi segue la richiesta anche nei task asyncio e nel threadpool.
+L'identificativo della traccia viene propagato con l'intestazione W3C traceparent (00-<trace id>-<span id>-<flag>):
+se la richiesta arriva dal frontend con un traceparent, la traccia del backend continua quella del frontend;
+altrimenti ne viene creata una nuova. L'identificativo viene restituito al client nell'intestazione X-Trace-Id.
+Le tracce completate vengono tenute in memoria (TraceStore, consultabile nel backend con /debug/traces), riassunte nel log
+a livello DEBUG (durata di ogni span) e, se TRACE_EXPORT_PATH è impostato, scritte da un thread separato su file nel formato
+OTLP/JSON, una richiesta di esportazione per riga, leggibile dal ricevitore otlpjsonfile dell'OpenTelemetry Collector.
+Variabili d'ambiente:
+- TRACE_ENABLED: se "false", nessuno span viene creato.
+- TRACE_STORE_SIZE: numero di tracce recenti tenute in memoria, e numero di tracce lente tenute a parte.
+- TRACE_SLOW_THRESHOLD_MS: durata minima delle tracce lente, che sono anche quelle restituite da /debug/traces se non è
+  indicata un'altra durata minima. Le tracce lente hanno un buffer separato, quindi le richieste veloci non le sostituiscono.
+- TRACE_EXPORT_PATH: file su cui esportare le tracce in formato OTLP/JSON (vuoto = nessuna esportazione).
+- TRACE_EXPORT_QUEUE_SIZE: numero massimo di tracce in attesa di essere scritte; oltre vengono scartate.
+- TRACE_SERVICE_NAME: nome del servizio riportato nelle tracce esportate (il Dockerfile del frontend imposta text2sql-frontend).
+"""
+
+logger = get_logger("tracing")
+
+TRACEPARENT_HEADER: str = "traceparent"
+TRACE_ID_HEADER: str = "X-Trace-Id"
+TRACEPARENT_PATTERN: re.Pattern = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+# Lunghezza massima dei valori testuali degli attributi (ad esempio le query SQL)
+MAX_ATTRIBUTE_LENGTH: int = 500
+# Tipi di span OTLP: la fase di una richiesta, la richiesta ricevuta, una chiamata verso un altro servizio
+SPAN_KIND_INTERNAL: int = 1
+SPAN_KIND_SERVER: int = 2
+SPAN_KIND_CLIENT: int = 3
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str]]:
+    """
+    Questa funzione legge un'intestazione traceparent e restituisce (trace id, span id del chiamante),
+    oppure None se l'intestazione manca o non è valida.
+    """
+    if not header:
+        return None
+    match: Optional[re.Match] = TRACEPARENT_PATTERN.match(header.strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return (match.group(1), match.group(2))
+
+
+def format_traceparent(trace_id: str, span_id: str) -> str:
+    return f"00-{trace_id}-{span_id}-01"
+
+
+class Span:
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Optional[Dict[str, Any]] = None,
+                 kind: int = SPAN_KIND_INTERNAL):
+        self.trace: "Trace" = trace
+        self.name: str = name
+        self.kind: int = kind
+        self.span_id: str = new_span_id()
+        self.parent_id: Optional[str] = parent_id
+        self.attributes: Dict[str, Any] = {}
+        self.status: str = "ok"
+        self.start_ns: int = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._start_perf: float = time.perf_counter()
+        if attributes:
+            self.set_attributes(**attributes)
+
+    def set_attributes(self, **attributes: Any) -> None:
+        """
+        Questo metodo aggiunge attributi allo span; i testi lunghi vengono troncati e i valori None ignorati.
+        """
+        for key, value in attributes.items():
+            if value is None:
+                continue
+            if not isinstance(value, (bool, int, float)):
+                value = str(value)
+                if len(value) > MAX_ATTRIBUTE_LENGTH:
+                    value = value[:MAX_ATTRIBUTE_LENGTH] + "..."
+            self.attributes[key] = value
+
+    def end(self, status: Optional[str] = None) -> None:
+        if self.end_ns is not None:
+            return
+        # La durata viene misurata con il contatore monotono, l'istante di inizio con l'orologio di sistema
+        self.end_ns = self.start_ns + int((time.perf_counter() - self._start_perf) * 1e9)
+        if status is not None:
+            self.status = status
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns: int = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    def __init__(self, trace_id: str, remote_parent_id: Optional[str] = None):
+        self.trace_id: str = trace_id
+        # Span del chiamante (ad esempio il frontend) da cui è partita la richiesta, se presente
+        self.remote_parent_id: Optional[str] = remote_parent_id
+        self.spans: List[Span] = []
+        self.root: Optional[Span] = None
+        self._lock: threading.Lock = threading.Lock()
+
+    def start_span(self, name: str, parent_id: Optional[str], attributes: Optional[Dict[str, Any]] = None,
+                   kind: int = SPAN_KIND_INTERNAL) -> Span:
+        span: Span = Span(self, name, parent_id, attributes, kind)
+        with self._lock:
+            if self.root is None:
+                self.root = span
+            self.spans.append(span)
+        return span
+
+    def snapshot(self) -> List[Span]:
+        with self._lock:
+            return list(self.spans)
+
+    @property
+    def duration_ms(self) -> float:
+        return self.root.duration_ms if self.root is not None else 0.0
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span: Optional[Span] = _current_span.get()
+    return span.trace.trace_id if span is not None else None
+
+
+def outgoing_headers() -> Dict[str, str]:
+    """
+    Questa funzione restituisce l'intestazione traceparent da aggiungere alle chiamate verso altri servizi,
+    con lo span corrente come padre. Se non c'è una traccia attiva restituisce un dizionario vuoto.
+    """
+    span: Optional[Span] = _current_span.get()
+    if span is None:
+        return {}
+    return {TRACEPARENT_HEADER: format_traceparent(span.trace.trace_id, span.span_id)}
+
+
+@contextmanager
+def span(name: str, kind: int = SPAN_KIND_INTERNAL, **attributes: Any) -> Iterator[Optional[Span]]:
+    """
+    Questo context manager apre uno span figlio dello span corrente per la durata del blocco with
+    (con kind=SPAN_KIND_CLIENT per le chiamate verso altri servizi).
+    Se il blocco lancia un'eccezione, lo span viene chiuso con lo stato "error" e l'eccezione viene rilanciata.
+    Fuori da una richiesta tracciata (ad esempio all'avvio del server) non fa nulla e restituisce None.
+    """
+    parent: Optional[Span] = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child: Span = parent.trace.start_span(name, parent.span_id, attributes, kind)
+    token: Token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.set_attributes(error=repr(e))
+        child.end("error")
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+def start_trace(name: str, traceparent: Optional[str] = None, **attributes: Any) -> Tuple[Span, Token]:
+    """
+    Questa funzione apre lo span radice di una richiesta, continuando la traccia del chiamante se traceparent è valido,
+    e lo rende lo span corrente. Restituisce lo span e il token da passare a finish_trace.
+    """
+    remote: Optional[Tuple[str, str]] = parse_traceparent(traceparent)
+    trace: Trace = Trace(remote[0], remote[1]) if remote is not None else Trace(new_trace_id())
+    root: Span = trace.start_span(name, trace.remote_parent_id, attributes, SPAN_KIND_SERVER)
+    return (root, _current_span.set(root))
+
+
+def finish_trace(root: Span, token: Token, status: Optional[str] = None) -> None:
+    """
+    Questa funzione chiude lo span radice, ripristina lo span corrente, scrive nel log (a livello DEBUG) la durata
+    degli span e consegna la traccia al TraceStore e all'esportatore.
+    """
+    root.end(status)
+    _current_span.reset(token)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Trace %s: %s", root.trace.trace_id, ", ".join(
+            f"{child.name} {child.duration_ms:.1f} ms" + (" (error)" if child.status == "error" else "")
+            for child in root.trace.snapshot()))
+    trace_store.add(root.trace)
+    if exporter is not None:
+        exporter.export(root.trace)
+
+
+# ---------------------------------------------------------- ARCHIVIO IN MEMORIA ---------------------------------------------------
+
+class TraceStore:
+    def __init__(self, capacity: int, slow_threshold_ms: float):
+        self.capacity: int = capacity
+        self.slow_threshold_ms: float = slow_threshold_ms
+        # Tutte le tracce recenti e, a parte, solo quelle lente (durata di almeno slow_threshold_ms)
+        self._traces: Deque[Trace] = deque(maxlen=capacity)
+        self._slow_traces: Deque[Trace] = deque(maxlen=capacity)
+        self._lock: threading.Lock = threading.Lock()
+
+    def add(self, trace: Trace) -> None:
+        with self._lock:
+            self._traces.append(trace)
+            if trace.duration_ms >= self.slow_threshold_ms:
+                self._slow_traces.append(trace)
+
+    def recent(self, min_duration_ms: Optional[float] = None, limit: int = 20) -> List[Trace]:
+        """
+        Questo metodo restituisce le tracce più recenti (dalla più recente) che sono durate almeno min_duration_ms
+        (predefinito: TRACE_SLOW_THRESHOLD_MS), al massimo limit.
+        Con una durata minima di almeno TRACE_SLOW_THRESHOLD_MS le tracce vengono lette dal buffer delle tracce lente,
+        altrimenti da quello di tutte le tracce recenti.
+        """
+        threshold: float = self.slow_threshold_ms if min_duration_ms is None else min_duration_ms
+        with self._lock:
+            traces: List[Trace] = list(self._slow_traces if threshold >= self.slow_threshold_ms else self._traces)
+        slow: List[Trace] = [trace for trace in reversed(traces) if trace.duration_ms >= threshold]
+        return slow[:limit]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._traces.clear()
+            self._slow_traces.clear()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"size": len(self._traces), "slow": len(self._slow_traces), "capacity": self.capacity}
+
+
+# ---------------------------------------------------------- ESPORTAZIONE OTLP/JSON ---------------------------------------------------
+
+def otlp_attribute_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # In OTLP/JSON gli interi a 64 bit sono stringhe
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": otlp_attribute_value(value)} for key, value in attributes.items()]
+
+
+def otlp_span(span: Span) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {
+        "traceId": span.trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns if span.end_ns is not None else span.start_ns),
+        "attributes": otlp_attributes(span.attributes),
+        # 1 = OK, 2 = ERROR
+        "status": {"code": 2 if span.status == "error" else 1},
+    }
+    if span.parent_id is not None:
+        entry["parentSpanId"] = span.parent_id
+    return entry
+
+
+def otlp_request(service_name: str, traces: List[Trace]) -> Dict[str, Any]:
+    """
+    Questa funzione costruisce una richiesta di esportazione OTLP (ExportTraceServiceRequest) con gli span delle tracce indicate.
+    """
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({"service.name": service_name})},
+            "scopeSpans": [{
+                "scope": {"name": "text2sql.tracing"},
+                "spans": [otlp_span(span) for trace in traces for span in trace.snapshot()],
+            }],
+        }]
+    }
+
+
+class OtlpFileExporter:
+    """
+    Questa classe scrive le tracce su file in formato OTLP/JSON da un thread separato, così la scrittura non rallenta le risposte.
+    Le tracce in attesa vengono scritte a gruppi, una riga per gruppo; se la coda è piena le tracce vengono scartate e contate.
+    """
+    def __init__(self, path: str, service_name: str, queue_size: int):
+        self.path: str = path
+        self.service_name: str = service_name
+        self.queue: "queue.Queue[Trace]" = queue.Queue(maxsize=queue_size)
+        self.exported: int = 0
+        self.dropped: int = 0
+        self.errors: int = 0
+        self._thread: threading.Thread = threading.Thread(target=self._run, name="otlp-file-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, trace: Trace) -> None:
+        try:
+            self.queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            traces: List[Trace] = [self.queue.get()]
+            while True:
+                try:
+                    traces.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(otlp_request(self.service_name, traces), separators=(",", ":")) + "\n")
+                self.exported += len(traces)
+            except OSError as e:
+                self.errors += 1
+                logger.warning("Traces not exported to %s: %s", self.path, e)
+
+    def stats(self) -> Dict[str, float]:
+        return {"exported": self.exported, "dropped": self.dropped, "errors": self.errors, "queued": self.queue.qsize()}
+
+
+TRACE_ENABLED: bool = os.getenv("TRACE_ENABLED", "true").lower() == "true"
+
+trace_store: TraceStore = TraceStore(
+    capacity=int(os.getenv("TRACE_STORE_SIZE", 200)),
+    slow_threshold_ms=float(os.getenv("TRACE_SLOW_THRESHOLD_MS", 500)),
+)
+
+exporter: Optional[OtlpFileExporter] = (
+    OtlpFileExporter(
+        path=os.getenv("TRACE_EXPORT_PATH"),
+        service_name=os.getenv("TRACE_SERVICE_NAME", "text2sql-backend"),
+        queue_size=int(os.getenv("TRACE_EXPORT_QUEUE_SIZE", 1000)),
+    ) if os.getenv("TRACE_EXPORT_PATH") else None
+)
@@ -1,11 +1,19 @@
 from fastapi import FastAPI, HTTPException, Request, Form
 from fastapi.templating import Jinja2Templates
-import requests
+from contextlib import asynccontextmanager
+import asyncio
+import httpx
+import json
+from collections import OrderedDict
 from pathlib import Path
 import re
 from re import Match
-from typing import Dict, List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
 import os
+import time
+from fastapi.responses import Response
+from app_logging import get_logger, shutdown_logging
+from tracing import SPAN_KIND_CLIENT, TRACE_ENABLED, TRACE_ID_HEADER, TRACEPARENT_HEADER, current_trace_id, finish_trace, outgoing_headers, span, start_trace
 
 """
 Questo file contiene il codice del server frontend FastAPI che gestisce le richieste HTTP e le pagine web.
@@ -14,15 +22,187 @@ Questi sono gli endpoint principali:
 2. /sql_search: per eseguire una query SQL direttamente sul database.
 3. /schema_summary: per ottenere lo schema del database, ovvero i nomi delle tabelle e le colonne di ogni tabella.
 4. /add: per aggiungere un nuovo film al database.
+I messaggi di log passano da app_logging (common/src/app_logging.py, lo stesso modulo del backend, configurato con le stesse
+variabili d'ambiente LOG_*); i risultati completi delle ricerche e lo schema sono a livello DEBUG (LOG_LEVEL) e i risultati
+vengono scritti solo per una frazione LOG_DATA_SAMPLE_RATE delle risposte, come le righe lette dal database nel backend.
+Ogni richiesta ha una traccia (vedi tracing.py, in comune con il backend) con uno span per la pagina e uno per ogni chiamata
+al backend; la durata degli span viene scritta nel log a livello DEBUG e, con TRACE_EXPORT_PATH, esportata su file in OTLP/JSON.
+L'identificativo della traccia viene inviato al backend con l'intestazione traceparent e restituito al browser in X-Trace-Id:
+con lo stesso identificativo si trovano i tempi del frontend nel log e quelli del backend in /debug/traces.
+
+Gli endpoint sono asincroni e le chiamate al backend passano da un unico client HTTP condiviso, che riutilizza le connessioni
+(keep-alive): mentre il backend interroga il modello, la richiesta non occupa un thread del server.
+Al massimo BACKEND_MAX_CONCURRENT_REQUESTS chiamate al backend sono in corso contemporaneamente; le altre attendono
+fino a BACKEND_QUEUE_TIMEOUT secondi, poi la pagina risponde con lo status 503 invece di accumulare richieste sul backend.
+Variabili d'ambiente:
+- BACKEND_CONNECT_TIMEOUT: secondi massimi per aprire la connessione con il backend.
+- BACKEND_READ_TIMEOUT: secondi massimi di attesa della risposta del backend (una ricerca comprende la generazione della query).
+- BACKEND_MAX_CONNECTIONS: numero massimo di connessioni aperte verso il backend.
+- BACKEND_MAX_CONCURRENT_REQUESTS: numero massimo di chiamate al backend in corso contemporaneamente.
+- BACKEND_QUEUE_TIMEOUT: secondi massimi di attesa di una chiamata quando il limite è raggiunto.
+- RESPONSE_CACHE_SIZE: numero massimo di risposte del backend tenute in cache (0 = cache disattivata).
+- RESPONSE_CACHE_MAX_ENTRY_BYTES: dimensione massima di una risposta salvata in cache.
+- LOG_DATA_SAMPLE_RATE: frazione (da 0 a 1) delle risposte di cui scrivere i risultati nel log a livello DEBUG.
+
+Le risposte di /schema_summary e /sql_search che hanno un ETag vengono tenute in cache: alla richiesta successiva uguale
+il frontend invia l'ETag in If-None-Match e, se il backend risponde 304 (dati non cambiati), usa la risposta in cache
+senza riceverla di nuovo. Anche lo schema raggruppato per tabella viene riusato finché l'ETag non cambia.
 """
 
-app = FastAPI()
+logger = get_logger("frontend")
+
+BACKEND_CONNECT_TIMEOUT: float = float(os.getenv("BACKEND_CONNECT_TIMEOUT", 5))
+BACKEND_READ_TIMEOUT: float = float(os.getenv("BACKEND_READ_TIMEOUT", 180))
+BACKEND_MAX_CONNECTIONS: int = int(os.getenv("BACKEND_MAX_CONNECTIONS", 20))
+BACKEND_MAX_CONCURRENT_REQUESTS: int = int(os.getenv("BACKEND_MAX_CONCURRENT_REQUESTS", 20))
+BACKEND_QUEUE_TIMEOUT: float = float(os.getenv("BACKEND_QUEUE_TIMEOUT", 2))
+# Messaggio mostrato quando il backend è saturo (limite di chiamate raggiunto o status 503 del backend)
+BACKEND_BUSY_MESSAGE: str = "Il servizio è momentaneamente sovraccarico, riprova tra qualche secondo."
+# Frazione delle risposte di cui scrivere nel log (a livello DEBUG) i risultati delle ricerche
+DATA_LOG_SAMPLE_RATE: float = float(os.getenv("LOG_DATA_SAMPLE_RATE", 0.1))
+
+API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:800")
+
+client: httpx.AsyncClient = httpx.AsyncClient(
+    base_url=API_BASE_URL,
+    timeout=httpx.Timeout(BACKEND_READ_TIMEOUT, connect=BACKEND_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_connections=BACKEND_MAX_CONNECTIONS, max_keepalive_connections=BACKEND_MAX_CONNECTIONS),
+)
+backend_slots: asyncio.Semaphore = asyncio.Semaphore(BACKEND_MAX_CONCURRENT_REQUESTS)
+
+RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", 256))
+RESPONSE_CACHE_MAX_ENTRY_BYTES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRY_BYTES", 1024 * 1024))
+# Risposte del backend con ETag, dalla meno usata di recente: richiesta (metodo, percorso, corpo) -> (ETag, corpo della risposta)
+response_cache: "OrderedDict[str, Tuple[str, bytes]]" = OrderedDict()
+# Schema raggruppato per tabella e ETag della risposta da cui è stato costruito
+schema_summary_groups: Optional[Tuple[str, Dict[str, List[str]]]] = None
+
+class BackendBusyError(Exception):
+    """
+    Questa eccezione indica che il backend è saturo: nessuna chiamata si è liberata entro BACKEND_QUEUE_TIMEOUT secondi.
+    """
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Alla chiusura del server viene chiuso il client HTTP e le connessioni aperte verso il backend,
+    poi vengono scritti i messaggi di log ancora in coda.
+    """
+    yield
+    await client.aclose()
+    shutdown_logging()
+
+app = FastAPI(lifespan=lifespan)
 
 # Funziona in docker
 TEMPLATES_DIR = Path(__file__).resolve().parent / "templates"
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
-API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:800")
+@app.middleware("http")
+async def trace_request(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
+    """
+    Questo middleware apre lo span radice della traccia di ogni richiesta, lo chiude alla fine della richiesta
+    e restituisce l'identificativo della traccia nell'intestazione X-Trace-Id.
+    """
+    if not TRACE_ENABLED:
+        return await call_next(request)
+    root, token = start_trace(f"{request.method} {request.url.path}", request.headers.get(TRACEPARENT_HEADER),
+                              **{"http.method": request.method, "http.target": request.url.path})
+    status: int = 500
+    try:
+        response: Response = await call_next(request)
+        status = response.status_code
+        response.headers[TRACE_ID_HEADER] = root.trace.trace_id
+        return response
+    finally:
+        root.set_attributes(**{"http.status_code": status})
+        finish_trace(root, token, "error" if status >= 500 else None)
+
+async def backend_request(method: str, path: str, revalidate: bool = False, **kwargs: Any) -> httpx.Response:
+    """
+    Questa funzione invia una richiesta all'API del backend con il client condiviso (vedi send_backend_request).
+    Se il backend risponde con lo status 503, lancia BackendBusyError.
+    Con revalidate=True la risposta viene salvata in cache se ha un ETag e, alla richiesta successiva uguale, viene rivalidata
+    con If-None-Match: se il backend risponde 304, viene restituita la risposta in cache con lo status 200.
+    If-None-Match viene inviato solo se la cache contiene il corpo della risposta; se il backend risponde comunque 304
+    senza una risposta in cache da usare, la richiesta viene ripetuta senza If-None-Match.
+    """
+    cache_key: Optional[str] = None
+    cached: Optional[Tuple[str, bytes]] = None
+    if revalidate and RESPONSE_CACHE_SIZE > 0:
+        cache_key = f"{method} {path} {json.dumps(kwargs.get('json'), sort_keys=True)}"
+        # La risposta in cache viene letta ora: mentre si attende il backend potrebbe essere eliminata da un'altra richiesta
+        cached = response_cache.get(cache_key)
+    response: httpx.Response = await send_backend_request(method, path, cached[0] if cached is not None else None, **kwargs)
+    if response.status_code == 304 and cached is None:
+        logger.warning("Backend answered 304 without a cached response, request repeated: %s %s", method, path)
+        response = await send_backend_request(method, path, None, **kwargs)
+    if response.status_code == 503:
+        raise BackendBusyError(BACKEND_BUSY_MESSAGE)
+    if cache_key is not None:
+        return cache_response(cache_key, cached, response)
+    return response
+
+async def send_backend_request(method: str, path: str, if_none_match: Optional[str], **kwargs: Any) -> httpx.Response:
+    """
+    Questa funzione invia una richiesta al backend e la registra come span della traccia della richiesta in corso
+    (attesa di un posto libero compresa), propagata al backend con l'intestazione traceparent.
+    Se BACKEND_MAX_CONCURRENT_REQUESTS chiamate sono già in corso attende che se ne liberi una; dopo BACKEND_QUEUE_TIMEOUT secondi
+    lancia BackendBusyError.
+    """
+    with span(f"backend {method} {path}", SPAN_KIND_CLIENT, **{"http.method": method, "http.url": path}) as backend_span:
+        headers: Dict[str, str] = outgoing_headers()
+        if if_none_match is not None:
+            headers["If-None-Match"] = if_none_match
+        start: float = time.perf_counter()
+        try:
+            await asyncio.wait_for(backend_slots.acquire(), timeout=BACKEND_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Backend saturated: %s %s rejected (trace %s)", method, path, current_trace_id())
+            raise BackendBusyError(BACKEND_BUSY_MESSAGE)
+        try:
+            if backend_span is not None:
+                backend_span.set_attributes(queue_ms=round((time.perf_counter() - start) * 1000, 3))
+            response: httpx.Response = await client.request(method, path, headers=headers, **kwargs)
+        finally:
+            backend_slots.release()
+        if backend_span is not None:
+            backend_span.set_attributes(**{"http.status_code": response.status_code})
+    return response
+
+def cache_response(cache_key: str, cached: Optional[Tuple[str, bytes]], response: httpx.Response) -> httpx.Response:
+    """
+    Questa funzione aggiorna la cache delle risposte con la risposta del backend.
+    Se la risposta è 304 restituisce cached, la risposta in cache il cui ETag è stato inviato in If-None-Match;
+    se è 200 con un ETag la salva (se non supera RESPONSE_CACHE_MAX_ENTRY_BYTES).
+    """
+    if response.status_code == 304 and cached is not None:
+        logger.debug("Response not modified, served from cache: %s", cache_key)
+        store_response(cache_key, cached)
+        return httpx.Response(200, content=cached[1], headers={"ETag": cached[0], "Content-Type": "application/json"},
+                              request=response.request)
+
+    etag: Optional[str] = response.headers.get("ETag")
+    if response.status_code == 200 and etag is not None and len(response.content) <= RESPONSE_CACHE_MAX_ENTRY_BYTES:
+        store_response(cache_key, (etag, response.content))
+    else:
+        response_cache.pop(cache_key, None)
+    return response
+
+def store_response(cache_key: str, entry: Tuple[str, bytes]) -> None:
+    """
+    Questa funzione salva una risposta in cache come la più recente, eliminando le meno usate oltre RESPONSE_CACHE_SIZE.
+    """
+    response_cache[cache_key] = entry
+    response_cache.move_to_end(cache_key)
+    while len(response_cache) > RESPONSE_CACHE_SIZE:
+        response_cache.popitem(last=False)
+
+def busy_response(request: Request, template: str, error: BackendBusyError):
+    """
+    Questa funzione restituisce la pagina indicata con il messaggio di backend saturo e lo status 503.
+    """
+    return templates.TemplateResponse(template, {"request": request, "error": str(error)}, status_code=503)
 
 @app.get("/")
 def index(request: Request):
@@ -34,29 +214,38 @@ def index(request: Request):
 # ---------------------------------------------------------- ENDPOINT /search ---------------------------------------------------
 
 @app.post("/search")
-def search(request: Request, search_request: str = Form(...), model: str = Form(...)):
+async def search(request: Request, search_request: str = Form(...), model: str = Form(...), page_token: str = Form("")):
     """
     Questa funzione gestisce la richiesta di ricerca nel database.
     Prende in input una domanda in linguaggio naturale e un modello, chiama l'API per ottenere i risultati della ricerca
+    Se è presente page_token, chiede all'API la pagina successiva dei risultati.
     """
-    print("Search request:", search_request, flush=True)
-    print("Model:", model, flush=True)
+    logger.info("Search request: %s", search_request)
+    logger.info("Model: %s", model)
     data: Dict[str, str] = {
         "question" : search_request,
         "model": model
     }
+    if page_token:
+        data["page_token"] = page_token
     try:
-        response = requests.post(f"{API_BASE_URL}/search", json=data)
+        response = await backend_request("POST", "/search", json=data)
         response.raise_for_status()
         search_results: Dict[str, str] = response.json()
         sql: str = search_results["sql"]
         sql_validation: str = search_results["sql_validation"]
         results: str = search_results["results"]
-        print("SQL:", sql, flush=True)
-        print("SQL Validation:", sql_validation, flush=True)
-        print("Results:", results, flush=True)
-        return templates.TemplateResponse("search.html",{"request": request, "sql": sql, "sql_validation": sql_validation, "results": results })
-    except requests.HTTPError as e:
+        next_page_token: str = search_results.get("next_page_token")
+        logger.info("SQL: %s", sql)
+        logger.info("SQL Validation: %s", sql_validation)
+        logger.debug("Results: %s", results, extra={"sample_rate": DATA_LOG_SAMPLE_RATE})
+        return templates.TemplateResponse("search.html",{"request": request, "sql": sql, "sql_validation": sql_validation, "results": results,
+                                                         "search_request": search_request, "model": model,
+                                                         "next_page_token": next_page_token, "truncated": search_results.get("truncated", False),
+                                                         "detail": search_results.get("detail")})
+    except BackendBusyError as e:
+        return busy_response(request, "search.html", e)
+    except httpx.HTTPStatusError as e:
         # Cattura l'errore HTTP e mostra un messaggio all'utente
         try:
             error_detail = response.json().get("detail", str(e))
@@ -84,27 +273,35 @@ def sql_search_page(request: Request):
     return templates.TemplateResponse("sql_search.html", {"request": request, "isfirst_time": isfirst_time})
 
 @app.post("/sql_search")
-def sql_search(request: Request, sql_query: str = Form(...), model: str = Form(...)):
+async def sql_search(request: Request, sql_query: str = Form(...), model: str = Form(...), page_token: str = Form("")):
     """
     Questa funzione gestisce la richiesta per eseguire una query SQL sul database.
     Prende in input una query SQL e un modello, chiama l'API per ottenere i risultati della ricerca.
+    Se è presente page_token, chiede all'API la pagina successiva dei risultati.
     """
-    print("SQL Query:", sql_query, flush=True)
-    print("Model:", model, flush=True)
+    logger.info("SQL Query: %s", sql_query)
+    logger.info("Model: %s", model)
     data: Dict[str, str] = {
         "sql_query" : sql_query,
         "model": model
     }
+    if page_token:
+        data["page_token"] = page_token
     try:
-        response = requests.post(f"{API_BASE_URL}/sql_search", json=data)
+        response = await backend_request("POST", "/sql_search", revalidate=True, json=data)
         response.raise_for_status()
         sql_search_results: Dict[str, str] = response.json()
         sql_validation: str = sql_search_results["sql_validation"]
         results: str = sql_search_results["results"]
-        print("SQL Validation:", sql_validation, flush=True)
-        print("Results:", results, flush=True)
-        return templates.TemplateResponse("sql_search.html",{"request": request, "sql_validation": sql_validation, "results": results, "isfirst_time": False})
-    except requests.HTTPError as e:
+        next_page_token: str = sql_search_results.get("next_page_token")
+        logger.info("SQL Validation: %s", sql_validation)
+        logger.debug("Results: %s", results, extra={"sample_rate": DATA_LOG_SAMPLE_RATE})
+        return templates.TemplateResponse("sql_search.html",{"request": request, "sql_validation": sql_validation, "results": results, "isfirst_time": False,
+                                                             "sql_query": sql_query, "model": model,
+                                                             "next_page_token": next_page_token, "truncated": sql_search_results.get("truncated", False)})
+    except BackendBusyError as e:
+        return busy_response(request, "sql_search.html", e)
+    except httpx.HTTPStatusError as e:
         # Cattura l'errore HTTP e mostra un messaggio all'utente
         try:
             error_detail = response.json().get("detail", str(e))
@@ -124,25 +321,35 @@ def sql_search(request: Request, sql_query: str = Form(...), model: str = Form(.
 # ---------------------------------------------------------- ENDPOINT /schema_summary ---------------------------------------------------
 
 @app.get("/schema_summary")
-def schema_summary(request: Request):
+async def schema_summary(request: Request):
     """
     Questa funzione gestisce la richiesta per ottenere lo schema del database.
     Chiama l'API per ottenere i risultati e restituisce la pagina con i risultati in schema_summary.html.
+    Se lo schema non è cambiato (stesso ETag), viene riusato lo schema già raggruppato per tabella.
     """
+    global schema_summary_groups
     try:
-        response = requests.get(f"{API_BASE_URL}/schema_summary")
+        response = await backend_request("GET", "/schema_summary", revalidate=True)
         response.raise_for_status()
-        schema_summary_response: List[Dict[str, str]] = response.json()
-        schema_summary: Dict[str, List[str]] = {}
-        for item in schema_summary_response:
-            table_name: str = item["table_name"]
-            table_column: str = item["table_column"]
-            if table_name not in schema_summary:
-                schema_summary[table_name] = []
-            schema_summary[table_name].append(table_column)
-        print("Schema Summary:", schema_summary, flush=True)
+        etag: Optional[str] = response.headers.get("ETag")
+        if etag is not None and schema_summary_groups is not None and schema_summary_groups[0] == etag:
+            schema_summary: Dict[str, List[str]] = schema_summary_groups[1]
+        else:
+            schema_summary_response: List[Dict[str, str]] = response.json()
+            schema_summary = {}
+            for item in schema_summary_response:
+                table_name: str = item["table_name"]
+                table_column: str = item["table_column"]
+                if table_name not in schema_summary:
+                    schema_summary[table_name] = []
+                schema_summary[table_name].append(table_column)
+            if etag is not None:
+                schema_summary_groups = (etag, schema_summary)
+        logger.debug("Schema Summary: %s", schema_summary)
         return templates.TemplateResponse("schema_summary.html", {"request": request, "schema_summary": schema_summary})
-    except requests.RequestException as e:
+    except BackendBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except httpx.HTTPError as e:
         raise HTTPException(status_code=500, detail=f"Error fetching schema summary: {e}")
 
 # ---------------------------------------------------------- ENDPOINT /add ---------------------------------------------------
@@ -156,28 +363,28 @@ def add_page(request: Request):
 
 
 @app.post("/add")
-def add(request: Request, title: str = Form(...), director: str = Form(...), age: int = Form(...), year: int = Form(...), genre: str = Form(...), platform1: str = Form(...), platform2: str = Form(...)):
+async def add(request: Request, title: str = Form(...), director: str = Form(...), age: int = Form(...), year: int = Form(...), genre: str = Form(...), platform1: str = Form(...), platform2: str = Form(...)):
     """
     Questa funzione gestisce la richiesta per aggiungere un nuovo film al database.
     Prende in input una serie di dati, li sistema nel formato corretto e chiama l'API per aggiungere il film.
     Se si verifica un errore durante la chiamata all'API, restituisce un messaggio di errore.
     """
-    print("Add request:", title, director, age, year, genre, platform1, platform2, flush=True)
+    logger.info("Add request: %s %s %s %s %s %s %s", title, director, age, year, genre, platform1, platform2)
 
     data_line: str = f"{title},{director},{age},{year},{genre},{platform1},{platform2}"
-    print("Data line:", data_line, flush=True)
+    logger.debug("Data line: %s", data_line)
 
     # Verifica se l'input è corretto con l'espressione regolare
     pattern: str = r'^([^,]+),([^,]+),(\d{1,3}),(\d{4}),([^,]+),([^,]*),([^,]*)$'
     match: Match[str] = re.fullmatch(pattern, data_line)
 
     if match:
-        print("Match", flush=True)
+        logger.debug("Match")
         data: Dict[str, str] = {
             "data_line": data_line
         }
         try:
-            response = requests.post(f"{API_BASE_URL}/add", json=data)
+            response = await backend_request("POST", "/add", json=data)
             response.raise_for_status()
             add_response: Dict[str, str] = response.json()
             status: str = add_response["status"]
@@ -187,7 +394,9 @@ def add(request: Request, title: str = Form(...), director: str = Form(...), age
                 "status": status
             })
     
-        except requests.HTTPError as e:
+        except BackendBusyError as e:
+            return busy_response(request, "add.html", e)
+        except httpx.HTTPStatusError as e:
             # Cattura l'errore HTTP e mostra un messaggio all'utente
             try:
                 error_detail = response.json().get("detail", str(e))
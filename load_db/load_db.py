@@ -1,12 +1,33 @@
 import csv
+import hashlib
 import mariadb
 import os
 import time
 
 """
 Questo script carica i dati da un file TSV in un database MariaDB all'avvio dell'applicazione, segue la stessa logica dell'endpoint /add.
+Sono disponibili due modalità (variabile d'ambiente LOAD_DB_MODE):
+- "row": una riga alla volta, con una SELECT e un'eventuale INSERT/UPDATE per ogni film. Registi e piattaforme vengono letti
+  all'avvio e tenuti in memoria, quindi vengono scritti solo se nuovi (o, per i registi, se l'età è maggiore);
+- "bulk" (predefinita): per file grandi. Registi e piattaforme vengono letti una sola volta e tenuti in memoria,
+  le righe vengono caricate a blocchi con executemany in una tabella di staging e unite a movies con una sola
+  INSERT ... SELECT ... ON DUPLICATE KEY UPDATE per blocco. Ogni blocco viene confermato (commit) separatamente
+  e viene stampato l'avanzamento in righe al secondo.
+  Il caricamento è incrementale e riprendibile: nelle tabelle load_db_files e load_db_rows vengono salvati, nella stessa
+  transazione di ogni blocco, l'impronta del file, la posizione (byte) raggiunta con l'impronta della parte già letta
+  e l'impronta del contenuto di ogni riga caricata. All'avvio:
+  * se il file è identico all'ultimo caricamento completato, non viene fatto nulla;
+  * se la parte già letta non è cambiata (crash a metà caricamento o righe aggiunte in fondo), si riparte da quella posizione;
+  * altrimenti il file viene riletto dall'inizio, ma vengono scritte solo le righe nuove o modificate.
+Altre variabili d'ambiente:
+- LOAD_DB_FILE: file TSV da caricare.
+- LOAD_DB_CHUNK_SIZE: numero di righe per blocco nella modalità bulk.
 """
 
+LOAD_DB_MODE = os.getenv("LOAD_DB_MODE", "bulk")
+LOAD_DB_FILE = os.getenv("LOAD_DB_FILE", "data.tsv")
+LOAD_DB_CHUNK_SIZE = int(os.getenv("LOAD_DB_CHUNK_SIZE", "10000"))
+
 # Configurazione connessione a MariaDB
 db_config = {
     "user": os.getenv("MARIADB_USER", "root"),
@@ -27,31 +48,34 @@ def connect_db(retries=10, delay=3):
             time.sleep(delay)
     return None
     
-def get_or_create_director(cursor, name, age):
+def get_or_create_director(cursor, name, age, directors):
     # Sto dando per scontato che il nome riconosca il regista, e che l'età sia un campo che può cambiare
-    cursor.execute("SELECT id, nome, eta FROM directors WHERE nome = ?", [name])
-    director = cursor.fetchone()
+    # directors è il dizionario in memoria nome in minuscolo -> (id, nome, età), vedi load_dimension
+    director = directors.get(name.lower())
     # Se il regista esiste, controlla se l'età è cambiata, e restituisci l'ID
     if director:
         # Se l'età è cambiata, aggiornala
         if director[2] < age:
             cursor.execute("UPDATE directors SET eta = ? WHERE id = ?", [age, director[0]])
+            directors[name.lower()] = (director[0], director[1], age)
         return director[0]
     # Se il regista non esiste, crealo e restituisci l'ID
     else:
         cursor.execute("INSERT INTO directors (nome, eta) VALUES (?, ?)", [name, age])
+        directors[name.lower()] = (cursor.lastrowid, name, age)
         return cursor.lastrowid
     
-def get_or_create_platform(cursor, name):
+def get_or_create_platform(cursor, name, platforms):
     # Sto dando per scontato che il nome riconosca la piattaforma
-    cursor.execute("SELECT id FROM platforms WHERE nome = ?", [name])
-    platform = cursor.fetchone()
+    # platforms è il dizionario in memoria nome in minuscolo -> (id, nome), vedi load_dimension
+    platform = platforms.get(name.lower())
     # Se la piattaforma esiste, restituisci l'ID
     if platform:
         return platform[0]
     # Se la piattaforma non esiste, creala e restituisci l'ID
     else:
         cursor.execute("INSERT INTO platforms (nome) VALUES (?)", [name])
+        platforms[name.lower()] = (cursor.lastrowid, name)
         return cursor.lastrowid
     
 def get_or_create_movie(cursor, title, year, genre, id_director, id_platform1, id_platform2):
@@ -82,33 +106,219 @@ def get_or_create_movie(cursor, title, year, genre, id_director, id_platform1, i
                        [title, year, genre, id_director, id_platform1, id_platform2])
         return cursor.lastrowid
     
+def parse_row(row):
+    # Restituisce (titolo, regista, età, anno, genere, piattaforma1, piattaforma2) da una riga del file TSV
+    title = row[0].strip()
+    director = row[1].strip()
+    director_age = int(row[2].strip())
+    year = int(row[3].strip())
+    genre = row[4].strip()
+    platform1 = row[5].strip() if len(row) > 5 else ""
+    platform2 = row[6].strip() if len(row) > 6 else ""
+    return title, director, director_age, year, genre, platform1 or None, platform2 or None
+
+def load_rows(conn, cursor, reader):
+    # Modalità "row": una riga alla volta, un solo commit alla fine.
+    # Registi e piattaforme sono letti una volta sola: se il caricamento fallisce l'intera transazione viene annullata
+    # e il processo termina, quindi i dizionari in memoria non possono contenere id annullati.
+    directors = load_dimension(cursor, "SELECT id, nome, eta FROM directors")
+    platforms = load_dimension(cursor, "SELECT id, nome FROM platforms")
+    for row in reader:
+        print(row, flush=True)
+        title, director, director_age, year, genre, platform1, platform2 = parse_row(row)
+
+        id_director = get_or_create_director(cursor, director, director_age, directors)
+        id_platform1 = get_or_create_platform(cursor, platform1, platforms) if platform1 else None
+        id_platform2 = get_or_create_platform(cursor, platform2, platforms) if platform2 else None
+
+        get_or_create_movie(cursor, title, year, genre, id_director, id_platform1, id_platform2)
+
+    conn.commit()
+
+# ---------------------------------------------------------- MODALITÀ BULK ---------------------------------------------------
+
+def load_dimension(cursor, query):
+    # Legge una tabella di dimensione (registi o piattaforme) in un dizionario nome in minuscolo -> riga
+    # (MariaDB confronta i nomi senza distinguere maiuscole e minuscole)
+    cursor.execute(query)
+    return {row[1].lower(): row for row in cursor.fetchall()}
+
+def resolve_directors(cursor, directors, chunk):
+    # Inserisce i registi nuovi e aggiorna l'età di quelli esistenti se è maggiore, poi aggiorna il dizionario in memoria
+    ages = {}
+    for _, director, director_age, _, _, _, _ in chunk:
+        ages[director] = max(director_age, ages.get(director, director_age))
+    changed = [(name, age) for name, age in ages.items()
+               if name.lower() not in directors or directors[name.lower()][2] < age]
+    if not changed:
+        return
+    cursor.executemany("INSERT INTO directors (nome, eta) VALUES (?, ?) ON DUPLICATE KEY UPDATE eta = GREATEST(eta, VALUES(eta))", changed)
+    placeholders = ", ".join("?" for _ in changed)
+    cursor.execute(f"SELECT id, nome, eta FROM directors WHERE nome IN ({placeholders})", [name for name, _ in changed])
+    for row in cursor.fetchall():
+        directors[row[1].lower()] = row
+
+def resolve_platforms(cursor, platforms, chunk):
+    # Inserisce le piattaforme nuove e aggiorna il dizionario in memoria
+    new_platforms = {platform for row in chunk for platform in row[5:7]
+                     if platform and platform.lower() not in platforms}
+    if not new_platforms:
+        return
+    cursor.executemany("INSERT INTO platforms (nome) VALUES (?) ON DUPLICATE KEY UPDATE nome = nome", [(name,) for name in new_platforms])
+    placeholders = ", ".join("?" for _ in new_platforms)
+    cursor.execute(f"SELECT id, nome FROM platforms WHERE nome IN ({placeholders})", list(new_platforms))
+    for row in cursor.fetchall():
+        platforms[row[1].lower()] = row
+
+def merge_chunk(cursor, directors, platforms, chunk, first_row):
+    # Carica un blocco di righe nella tabella di staging e lo unisce a movies con una sola query
+    resolve_directors(cursor, directors, chunk)
+    resolve_platforms(cursor, platforms, chunk)
+
+    staged = [
+        (first_row + i, title, year, genre, directors[director.lower()][0],
+         platforms[platform1.lower()][0] if platform1 else None,
+         platforms[platform2.lower()][0] if platform2 else None)
+        for i, (title, director, _, year, genre, platform1, platform2) in enumerate(chunk)
+    ]
+    cursor.executemany("INSERT INTO movies_staging (riga, titolo, anno, genere, id_director, id_platform1, id_platform2) "
+                       "VALUES (?, ?, ?, ?, ?, ?, ?)", staged)
+    # Le righe vengono unite nell'ordine del file: se un titolo compare più volte, vale l'ultima riga
+    cursor.execute("INSERT INTO movies (titolo, anno, genere, id_director, id_platform1, id_platform2) "
+                   "SELECT titolo, anno, genere, id_director, id_platform1, id_platform2 FROM movies_staging ORDER BY riga "
+                   "ON DUPLICATE KEY UPDATE anno = VALUES(anno), genere = VALUES(genere), id_director = VALUES(id_director), "
+                   "id_platform1 = VALUES(id_platform1), id_platform2 = VALUES(id_platform2)")
+    cursor.execute("DELETE FROM movies_staging")
+
+# ---------------------------------------------------------- CARICAMENTO INCREMENTALE ---------------------------------------------------
+
+def create_bookkeeping_tables(cursor):
+    # Tabelle con lo stato del caricamento: una riga per file e l'impronta del contenuto di ogni film caricato
+    cursor.execute("CREATE TABLE IF NOT EXISTS load_db_files ("
+                   "file_name varchar(255) primary key, checksum char(64) not null, byte_offset bigint not null, "
+                   "prefix_hash char(64) not null, completed boolean not null, "
+                   "updated_at timestamp not null default current_timestamp on update current_timestamp)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS load_db_rows (titolo varchar(255) primary key, row_hash char(64) not null)")
+
+def file_checksum(file):
+    # Impronta SHA-256 dell'intero file, letto a blocchi
+    hasher = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def row_hash(row):
+    # Impronta del contenuto di una riga già letta con parse_row
+    return hashlib.sha256("\t".join("" if value is None else str(value) for value in row).encode("utf-8")).hexdigest()
+
+def read_prefix(f, hasher, byte_offset):
+    # Legge i primi byte_offset byte del file aggiornando l'impronta; restituisce False se il file è più corto
+    remaining = byte_offset
+    while remaining > 0:
+        block = f.read(min(remaining, 1024 * 1024))
+        if not block:
+            return False
+        hasher.update(block)
+        remaining -= len(block)
+    return True
+
+def changed_rows(cursor, chunk):
+    # Restituisce le righe del blocco nuove o diverse dall'ultimo caricamento, confrontando le impronte salvate
+    titles = list({row[0] for row in chunk})
+    placeholders = ", ".join("?" for _ in titles)
+    cursor.execute(f"SELECT titolo, row_hash FROM load_db_rows WHERE titolo IN ({placeholders})", titles)
+    stored = {title: stored_hash for title, stored_hash in cursor.fetchall()}
+    return [row for row in chunk if stored.get(row[0]) != row_hash(row)]
+
+def save_progress(cursor, file, checksum, chunk, byte_offset, prefix_hash, completed):
+    # Salva le impronte delle righe del blocco e la posizione raggiunta, nella stessa transazione dei dati
+    if chunk:
+        cursor.executemany("INSERT INTO load_db_rows (titolo, row_hash) VALUES (?, ?) ON DUPLICATE KEY UPDATE row_hash = VALUES(row_hash)",
+                           [(row[0], row_hash(row)) for row in chunk])
+    cursor.execute("INSERT INTO load_db_files (file_name, checksum, byte_offset, prefix_hash, completed) VALUES (?, ?, ?, ?, ?) "
+                   "ON DUPLICATE KEY UPDATE checksum = VALUES(checksum), byte_offset = VALUES(byte_offset), "
+                   "prefix_hash = VALUES(prefix_hash), completed = VALUES(completed)",
+                   [file, checksum, byte_offset, prefix_hash, completed])
+
+def load_bulk(conn, cursor, file):
+    # Modalità "bulk": blocchi di LOAD_DB_CHUNK_SIZE righe, un commit per blocco, solo righe nuove o modificate
+    create_bookkeeping_tables(cursor)
+    file_name = os.path.basename(file)
+    checksum = file_checksum(file)
+    cursor.execute("SELECT checksum, byte_offset, prefix_hash, completed FROM load_db_files WHERE file_name = ?", [file_name])
+    state = cursor.fetchone()
+    conn.commit()
+    if state and state[0] == checksum and state[3]:
+        print(f"Il file {file} non è cambiato dall'ultimo caricamento.", flush=True)
+        return
+
+    directors = load_dimension(cursor, "SELECT id, nome, eta FROM directors")
+    platforms = load_dimension(cursor, "SELECT id, nome FROM platforms")
+    cursor.execute("CREATE TEMPORARY TABLE IF NOT EXISTS movies_staging ("
+                   "riga bigint not null primary key, titolo varchar(255) not null, anno int not null, genere varchar(255) not null, "
+                   "id_director int not null, id_platform1 int, id_platform2 int)")
+
+    with open(file, 'rb') as f:
+        hasher = hashlib.sha256()
+        byte_offset = 0
+        if state and state[1] > 0 and read_prefix(f, hasher, state[1]) and hasher.hexdigest() == state[2]:
+            byte_offset = state[1]
+            print(f"Ripresa del caricamento dal byte {byte_offset}.", flush=True)
+        else:
+            f.seek(0)
+            hasher = hashlib.sha256()
+            header = f.readline() # Salta l'intestazione
+            hasher.update(header)
+            byte_offset = len(header)
+
+        start = time.monotonic()
+        read = 0
+        loaded = 0
+        chunk = []
+        while True:
+            line = f.readline()
+            if line:
+                hasher.update(line)
+                byte_offset += len(line)
+                text = line.decode("utf-8").rstrip("\r\n")
+                if text.strip():
+                    chunk.append(parse_row(next(csv.reader([text], delimiter='\t'))))
+            if chunk and (len(chunk) >= LOAD_DB_CHUNK_SIZE or not line):
+                changed = changed_rows(cursor, chunk)
+                if changed:
+                    merge_chunk(cursor, directors, platforms, changed, read)
+                save_progress(cursor, file_name, checksum, changed, byte_offset, hasher.hexdigest(), False)
+                conn.commit()
+                read += len(chunk)
+                loaded += len(changed)
+                chunk = []
+                elapsed = max(time.monotonic() - start, 0.001)
+                print(f"{read} righe lette, {loaded} caricate ({read / elapsed:.0f} righe/s)", flush=True)
+            if not line:
+                break
+
+        save_progress(cursor, file_name, checksum, [], byte_offset, hasher.hexdigest(), True)
+        conn.commit()
+
+    elapsed = max(time.monotonic() - start, 0.001)
+    print(f"Totale: {read} righe lette, {loaded} nuove o modificate, in {elapsed:.1f} s ({read / elapsed:.0f} righe/s)", flush=True)
+
 def main():
-    file = "data.tsv"
+    file = LOAD_DB_FILE
 
     conn = connect_db()
     cursor = conn.cursor()
 
     try:
-        with open(file, 'r', encoding='utf-8') as tsvfile:
-            reader = csv.reader(tsvfile, delimiter='\t')
-            next(reader) # Salta l'intestazione
-            for row in reader:
-                print(row, flush=True)
-                title = row[0].strip()
-                director = row[1].strip()
-                director_age = int(row[2].strip())
-                year = int(row[3].strip())
-                genre = row[4].strip()
-                platform1 = row[5].strip()
-                platform2 = row[6].strip() if len(row) > 6 else None
-
-                id_director = get_or_create_director(cursor, director, director_age)
-                id_platform1 = get_or_create_platform(cursor, platform1) if platform1 else None
-                id_platform2 = get_or_create_platform(cursor, platform2) if platform2 else None
-
-                get_or_create_movie(cursor, title, year, genre, id_director, id_platform1, id_platform2)
+        if LOAD_DB_MODE == "row":
+            with open(file, 'r', encoding='utf-8') as tsvfile:
+                reader = csv.reader(tsvfile, delimiter='\t')
+                next(reader) # Salta l'intestazione
+                load_rows(conn, cursor, reader)
+        else:
+            load_bulk(conn, cursor, file)
 
-        conn.commit()
         print("Dati caricati con successo!")
     
     except Exception as e:
@@ -121,4 +331,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
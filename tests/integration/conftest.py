@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+"""
+I test di integrazione richiedono i servizi avviati con docker compose (backend, MariaDB e Ollama) e modificano il database
+(/add): per questo sono disattivati per impostazione predefinita e vanno abilitati con l'opzione --extended.
+I test si eseguono con: python -m pytest tests/integration --extended
+Variabili d'ambiente:
+- BACKEND_URL: indirizzo del backend (predefinito http://localhost:8003).
+- SQL_SEARCH_QUERY_TIMEOUT: tempo massimo di esecuzione di /sql_search configurato nel backend, in secondi (predefinito 30).
+- TEST_MODEL: modello usato per le domande in linguaggio naturale (predefinito gemma3:1b-it-qat).
+"""
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    parser.addoption("--extended", action="store_true", default=False,
+                     help="Esegue i test di integrazione sul backend avviato con docker compose.")
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items) -> None:
+    if config.getoption("--extended"):
+        return
+    skip: pytest.MarkDecorator = pytest.mark.skip(reason="test di integrazione: usare --extended")
+    for item in items:
+        # L'hook riceve tutti i test della sessione: vengono saltati solo quelli di questa cartella
+        if str(item.path).startswith(os.path.dirname(os.path.abspath(__file__))):
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def backend_url() -> str:
+    return os.getenv("BACKEND_URL", "http://localhost:8003").rstrip("/") + "/"
+
+
+@pytest.fixture(scope="session")
+def sql_search_timeout() -> float:
+    return float(os.getenv("SQL_SEARCH_QUERY_TIMEOUT", 30))
+
+
+@pytest.fixture(scope="session")
+def model_name() -> str:
+    return os.getenv("TEST_MODEL", "gemma3:1b-it-qat")
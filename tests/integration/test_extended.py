@@ -0,0 +1,126 @@
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import urljoin
+
+import pytest
+
+requests = pytest.importorskip("requests")
+
+"""
+Test di integrazione delle funzionalità aggiunte al backend che lo script di valutazione (test_backend_progetto_finale.py)
+non copre: gli stati "too_expensive", "timeout" e "cancelled", la paginazione con page_token e le richieste condizionali con ETag.
+Vanno eseguiti con il backend avviato da docker compose (vedi conftest.py): python -m pytest tests/integration --extended
+"""
+
+MOVIES_OF_YEAR: str = "SELECT movies.titolo, movies.anno FROM movies WHERE movies.anno = {year}"
+SOCIAL_NETWORK_LINE: str = "The Social Network,David Fincher,62,2010,Drama,Netflix,Amazon Prime Video"
+# Prodotto cartesiano del catalogo con sé stesso: la query conta ogni combinazione e dura diversi minuti
+SLOW_SQL_QUERY: str = "SELECT COUNT(*) AS n FROM movies m1, movies m2, movies m3, movies m4, movies m5, movies m6, movies m7"
+
+
+def post_sql_search(backend_url: str, payload: Dict[str, Any], **kwargs: Any) -> "requests.Response":
+    return requests.post(urljoin(backend_url, "sql_search"), json=payload, **kwargs)
+
+
+# ---------------------------------------------------------- STATI DELLE QUERY ---------------------------------------------------
+
+def test_search_too_expensive(backend_url: str, model_name: str):
+    # La query generata dipende dal modello: lo stato too_expensive viene verificato solo se il modello genera il join cartesiano
+    question: str = "Elenca tutte le combinazioni di film, registi e piattaforme, anche quelle non collegate tra loro."
+    response = requests.post(urljoin(backend_url, "search"), json={"question": question, "model": model_name}, timeout=180)
+    assert response.status_code == 200, response.text
+    data: Dict[str, Any] = response.json()
+    assert data["sql_validation"] in ("valid", "invalid", "unsafe", "too_expensive", "timeout")
+    if data["sql_validation"] != "too_expensive":
+        pytest.skip(f"il modello ha generato una query con stato {data['sql_validation']}: {data['sql']}")
+    assert data["results"] is None
+    assert data["detail"]
+
+
+def test_sql_search_timeout(backend_url: str, sql_search_timeout: float):
+    try:
+        response = post_sql_search(backend_url, {"sql_query": SLOW_SQL_QUERY}, timeout=sql_search_timeout + 60)
+    except requests.exceptions.Timeout:
+        pytest.fail(f"la query non è stata interrotta dopo {sql_search_timeout} secondi (SQL_SEARCH_QUERY_TIMEOUT)")
+    assert response.status_code == 200, response.text
+    assert response.json() == {"sql_validation": "timeout", "results": None, "next_page_token": None, "truncated": False}
+    # Le risposte interrotte non dipendono solo dai dati e non ricevono l'ETag
+    assert "ETag" not in response.headers
+
+
+@pytest.mark.parametrize("response_format", [None, "ndjson"])
+def test_sql_search_cancelled_on_disconnect(backend_url: str, response_format: Optional[str]):
+    # Il client si disconnette dopo 2 secondi: la query deve essere interrotta e la connessione tornare al pool
+    # molto prima del tempo massimo di esecuzione, anche quando viene eseguita sulla connessione dedicata allo streaming
+    params: Dict[str, str] = {"format": response_format} if response_format else {}
+    with pytest.raises(requests.exceptions.Timeout):
+        post_sql_search(backend_url, {"sql_query": SLOW_SQL_QUERY}, params=params, timeout=2)
+
+    deadline: float = time.monotonic() + 10
+    in_use: Optional[float] = None
+    while time.monotonic() < deadline:
+        in_use = requests.get(urljoin(backend_url, "pool_stats")).json()["in_use"]
+        if in_use == 0:
+            break
+        time.sleep(0.5)
+    assert in_use == 0
+
+
+# ---------------------------------------------------------- PAGINAZIONE ---------------------------------------------------
+
+def test_sql_search_pages_return_every_movie_once(backend_url: str):
+    # Con il catalogo iniziale il risultato sta in una pagina: per leggerne diverse avviare il backend con RESULT_PAGE_SIZE piccolo
+    payload: Dict[str, Any] = {"sql_query": "SELECT movies.id, movies.titolo FROM movies"}
+    ids: List[str] = []
+    last_token: Optional[str] = None
+    while True:
+        response = post_sql_search(backend_url, payload)
+        assert response.status_code == 200, response.text
+        data: Dict[str, Any] = response.json()
+        assert data["sql_validation"] == "valid" and data["truncated"] is False
+        for item in data["results"]:
+            ids.extend(prop["property_value"] for prop in item["properties"] if prop["property_name"] == "id")
+        if data["next_page_token"] is None:
+            break
+        last_token = data["next_page_token"]
+        payload = {"page_token": last_token}
+
+    count: Dict[str, Any] = post_sql_search(backend_url, {"sql_query": "SELECT COUNT(*) AS n FROM movies"}).json()
+    assert len(ids) == int(count["results"][0]["properties"][0]["property_value"])
+    assert len(set(ids)) == len(ids)
+
+    if last_token is not None:
+        tampered: str = last_token[:-2] + ("BB" if last_token.endswith("AA") else "AA")
+        assert post_sql_search(backend_url, {"page_token": tampered}).status_code == 422
+
+
+# ---------------------------------------------------------- ETAG ---------------------------------------------------
+
+def test_schema_summary_not_modified(backend_url: str):
+    urlpath: str = urljoin(backend_url, "schema_summary")
+    response = requests.get(urlpath)
+    assert response.status_code == 200
+    etag: str = response.headers["ETag"]
+    for if_none_match in (etag, f"W/{etag}", f'"other", {etag}'):
+        response = requests.get(urlpath, headers={"If-None-Match": if_none_match})
+        assert response.status_code == 304 and not response.content
+    assert requests.get(urlpath, headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_sql_search_not_modified_until_write(backend_url: str):
+    payload: Dict[str, Any] = {"sql_query": MOVIES_OF_YEAR.format(year=2010)}
+    response = post_sql_search(backend_url, payload)
+    assert response.status_code == 200, response.text
+    etag: str = response.headers["ETag"]
+
+    assert post_sql_search(backend_url, payload, headers={"If-None-Match": etag}).status_code == 304
+    other_payload: Dict[str, Any] = {"sql_query": MOVIES_OF_YEAR.format(year=2011)}
+    assert post_sql_search(backend_url, other_payload, headers={"If-None-Match": etag}).status_code == 200
+
+    # Una scrittura su movies (anche se riscrive gli stessi dati) aumenta la versione della tabella e cambia l'ETag
+    add_response = requests.post(urljoin(backend_url, "add"), json={"data_line": SOCIAL_NETWORK_LINE})
+    assert add_response.status_code == 200, add_response.text
+    response = post_sql_search(backend_url, payload, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json()["sql_validation"] == "valid"
@@ -1,50 +1,130 @@
-import requests
-from models import Question, ModelRequest, ModelResponse, ModelPullRequest
-from typing import List, Tuple
+import httpx
+import json
+import logging
+import os
+from contextlib import nullcontext
+from models import Question, ModelRequest, ModelResponse, ModelPullRequest, ModelStreamChunk
+from sql_stream import FirstStatementDetector
+from typing import Any, ContextManager, Dict, List, Optional, Tuple
 
 """
 Questo file contiene la classe ModelController che gestisce l'interazione con il modello di intelligenza artificiale.
 La classe consente di caricare un modello specifico e di inviare domande al modello per ottenere risposte in formato SQL.
+Le richieste a Ollama sono asincrone e passano da un unico client HTTP condiviso, che riutilizza le connessioni (keep-alive).
+Variabili d'ambiente:
+- OLLAMA_CONNECT_TIMEOUT: secondi massimi per aprire la connessione con Ollama.
+- OLLAMA_READ_TIMEOUT: secondi massimi di attesa di una risposta (o di un frammento di risposta) da Ollama.
+- OLLAMA_PULL_TIMEOUT: secondi massimi di attesa durante il download del modello.
+- OLLAMA_MAX_CONNECTIONS: numero massimo di connessioni aperte verso Ollama.
+- OLLAMA_STREAM: se "true", la risposta viene ricevuta in streaming e la generazione viene interrotta
+  appena arriva la fine del primo statement SQL.
+Metriche e tracing non dipendono da questo modulo: chi crea il ModelController può passare un ModelHooks
+che registra token, durate ed esito di ogni richiesta e apre uno span per ogni richiesta a Ollama (il backend usa
+i suoi metrics.py e tracing.py). Senza hooks queste operazioni non fanno nulla.
 """
 
+# Logger standard: il backend configura i logger "text2sql.*" (vedi app_logging.py), altrimenti vale la configurazione di default
+logger = logging.getLogger("text2sql.model_controller")
+
+
+class ModelHooks:
+    """
+    Questa classe raccoglie le operazioni di osservabilità eseguite durante le richieste a Ollama.
+    L'implementazione predefinita non fa nulla; il chiamante può estenderla per collegare metriche e tracing.
+    """
+    def span(self, name: str, **attributes: Any) -> ContextManager[Optional[Any]]:
+        """
+        Questo metodo apre uno span per la richiesta a Ollama. Restituisce un context manager che fornisce lo span
+        (con i metodi set_attributes e la proprietà duration_ms) oppure None se il tracing non è attivo.
+        """
+        return nullcontext(None)
+
+    def outgoing_headers(self) -> Dict[str, str]:
+        """
+        Questo metodo restituisce le intestazioni da aggiungere alla richiesta per propagare la traccia (ad esempio traceparent).
+        """
+        return {}
+
+    def record_response(self, response: Any) -> None:
+        """
+        Questo metodo registra le statistiche di una risposta completa di Ollama (ModelResponse o l'ultimo ModelStreamChunk).
+        """
+
+    def record_outcome(self, model: str, outcome: str, eval_tokens: int = 0) -> None:
+        """
+        Questo metodo registra una richiesta terminata senza statistiche di Ollama: "stopped" se lo streaming è stato
+        interrotto dopo eval_tokens token, "error" se la richiesta è fallita.
+        """
+
+
 class ModelController:
-    def __init__(self, api_url: str):
+    def __init__(self, api_url: str, hooks: Optional[ModelHooks] = None):
         self.api_url: str = api_url
+        self.hooks: ModelHooks = hooks if hooks is not None else ModelHooks()
         self.model: str = "gemma3:1b-it-qat"  # Default model
         self.is_model_loaded: bool = False 
+        self.stream: bool = os.getenv("OLLAMA_STREAM", "true").lower() == "true"
+
+        connect_timeout: float = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", 5))
+        self.read_timeout: float = float(os.getenv("OLLAMA_READ_TIMEOUT", 120))
+        self.pull_timeout: float = float(os.getenv("OLLAMA_PULL_TIMEOUT", 600))
+        max_connections: int = int(os.getenv("OLLAMA_MAX_CONNECTIONS", 10))
+        self.client: httpx.AsyncClient = httpx.AsyncClient(
+            base_url=self.api_url,
+            timeout=httpx.Timeout(self.read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def aclose(self) -> None:
+        """
+        Questa funzione chiude il client HTTP e le connessioni aperte verso Ollama.
+        """
+        await self.client.aclose()
 
-    def pull_model(self) -> bool:
+    async def pull_model(self) -> bool:
         """
         Questa funzione invia una richiesta al server per caricare il modello specificato.
         Restituisce True se il modello è stato caricato con successo, altrimenti False.
         """
-        print(f"Pulling model {self.model} from {self.api_url}", flush=True)
+        logger.info("Pulling model %s from %s", self.model, self.api_url)
         try:
-            response = requests.post(f"{self.api_url}/api/pull", json=ModelPullRequest(model=self.model).model_dump())
+            response = await self.client.post("/api/pull", json=ModelPullRequest(model=self.model).model_dump(),
+                                              timeout=httpx.Timeout(self.pull_timeout, connect=self.client.timeout.connect))
             response.raise_for_status()
             if response.status_code == 200:
                 self.is_model_loaded = True
-                print(f"Model {self.model} pulled successfully", flush=True)
+                logger.info("Model %s pulled successfully", self.model)
                 return True
             else:
-                print(f"Failed to pull model {self.model}: {response.status_code}")
+                logger.error("Failed to pull model %s: %d", self.model, response.status_code)
                 return False
-        except requests.exceptions.RequestException as e:
-            print(f"Pull failed: {e}")
+        except httpx.HTTPError as e:
+            logger.error("Pull failed: %s", e)
             return False
 
-    def ask_question(self, question: str, schema_summary: List[Tuple[str, str]]) -> str:
+    @staticmethod
+    def format_schema_summary(schema_summary: List[Tuple[str, str]]) -> str:
+        """
+        Questa funzione trasforma lo schema del database nel testo inserito nel prompt del modello.
+        """
+        return "\n".join([f"{table_name}: {columns}" for table_name, columns in schema_summary])
+
+    async def ask_question(self, question: str, schema_summary: List[Tuple[str, str]], schema_summary_str: Optional[str] = None) -> str:
         """
         Questa funzione invia una domanda al modello e restituisce la risposta in formato SQL.
         Prende in input una domanda in linguaggio naturale e lo schema del database.
+        Se schema_summary_str è fornito (ad esempio dalla cache dello schema), viene usato direttamente senza riformattare lo schema.
         Prepara una richiesta al modello per far si che quest'ultimo generi una query SQL.
         Restituisce la query SQL generata dal modello.
+        Se la coroutine viene cancellata (ad esempio perché il client si è disconnesso), la richiesta a Ollama viene interrotta.
+        In modalità streaming, la generazione viene interrotta appena il primo statement SQL è completo.
         """
-        print(f"Received question from backend: {question}", flush=True)
-        print(f"Schema summary: {schema_summary}", flush=True)
+        logger.info("Received question from backend: %s", question)
+        logger.debug("Schema summary: %s", schema_summary)
 
-        schema_summary_str = "\n".join([f"{table_name}: {columns}" for table_name, columns in schema_summary])
-        print(f"Schema summary string: {schema_summary_str}", flush=True)
+        if schema_summary_str is None:
+            schema_summary_str = self.format_schema_summary(schema_summary)
+        logger.debug("Schema summary string: %s", schema_summary_str)
 
         final_question: str = (
             "Sei un assistente che trasforma domande in linguaggio naturale in query SQL valide per un database relazionale.\n\n"
@@ -63,23 +143,86 @@ class ModelController:
             messages=[
                 Question(role="user", content=final_question)
             ],
-            stream=False
+            stream=self.stream
         )
-        print(f"Model request: {model_request}", flush=True)
+        logger.debug("Model request: %s", model_request)
+
+        if self.stream:
+            return await self.ask_question_streaming(model_request)
 
         try:
-            response = requests.post(f"{self.api_url}/api/chat", json=model_request.model_dump())
-            response.raise_for_status()
+            with self.hooks.span("ollama.chat", model=self.model, stream=False) as ollama_span:
+                response = await self.client.post("/api/chat", json=model_request.model_dump(), headers=self.hooks.outgoing_headers())
+                response.raise_for_status()
 
-            model_response: ModelResponse = ModelResponse(**response.json())
-            print(f"Model response: {model_response}", flush=True)
+                model_response: ModelResponse = ModelResponse(**response.json())
+                if ollama_span is not None:
+                    ollama_span.set_attributes(prompt_tokens=model_response.prompt_eval_count, eval_tokens=model_response.eval_count)
+            logger.debug("Model response: %s", model_response)
+            self.hooks.record_response(model_response)
 
             if not model_response.done:
-                print("Model response not done yet")
+                logger.warning("Model response not done yet")
                 return ""
 
             answer:str = model_response.message.content
             return answer
-        except requests.exceptions.RequestException as e:
-            print(f"Request failed: {e}")
+        except httpx.HTTPError as e:
+            logger.error("Request failed: %s", e)
+            self.hooks.record_outcome(self.model, "error")
+            return ""
+
+    async def ask_question_streaming(self, model_request: ModelRequest) -> str:
+        """
+        Questa funzione invia la richiesta al modello in modalità streaming e legge la risposta un frammento alla volta.
+        Appena il primo statement SQL è completo (punto e virgola o chiusura del blocco di codice) smette di leggere:
+        chiudendo la risposta, Ollama interrompe la generazione del testo successivo, che verrebbe comunque scartato.
+        Restituisce il testo ricevuto fino alla fine del primo statement.
+        Se Ollama interrompe lo streaming con una riga di errore ({"error": ...}) o invia una riga non valida,
+        restituisce una stringa vuota e registra l'errore, come la versione senza streaming.
+        """
+        detector: FirstStatementDetector = FirstStatementDetector()
+        # Ogni frammento contiene un token: se la generazione viene interrotta, Ollama non invia le statistiche finali
+        # e i token generati vengono contati dai frammenti ricevuti
+        chunks: int = 0
+        try:
+            with self.hooks.span("ollama.chat", model=model_request.model, stream=True) as ollama_span:
+                async with self.client.stream("POST", "/api/chat", json=model_request.model_dump(),
+                                              headers=self.hooks.outgoing_headers()) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        data: Any = json.loads(line)
+                        if isinstance(data, dict) and "error" in data:
+                            logger.error("Model error: %s", data["error"])
+                            self.hooks.record_outcome(model_request.model, "error")
+                            if ollama_span is not None:
+                                ollama_span.set_attributes(error=str(data["error"]))
+                            return ""
+                        chunk: ModelStreamChunk = ModelStreamChunk.model_validate(data)
+                        if chunks == 0 and ollama_span is not None:
+                            # Tempo fino al primo token: comprende il caricamento del modello e la valutazione del prompt
+                            ollama_span.set_attributes(first_token_ms=round(ollama_span.duration_ms, 3))
+                        if chunk.message is not None and detector.feed(chunk.message.content):
+                            logger.info("First SQL statement complete, generation stopped.")
+                            self.hooks.record_outcome(model_request.model, "stopped", eval_tokens=chunks + 1)
+                            if ollama_span is not None:
+                                ollama_span.set_attributes(stopped=True, eval_tokens=chunks + 1)
+                            break
+                        if chunk.done:
+                            logger.debug("Model response: %s", chunk)
+                            self.hooks.record_response(chunk)
+                            if ollama_span is not None:
+                                ollama_span.set_attributes(prompt_tokens=chunk.prompt_eval_count, eval_tokens=chunk.eval_count)
+                            break
+                        chunks += 1
+
+            answer: str = detector.statement_text()
+            logger.info("Model answer: %s", answer)
+            return answer
+        except (httpx.HTTPError, ValueError) as e:
+            # ValueError comprende le righe che non sono JSON e gli errori di validazione di Pydantic
+            logger.error("Request failed: %s", e)
+            self.hooks.record_outcome(model_request.model, "error")
             return ""
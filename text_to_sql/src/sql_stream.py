@@ -0,0 +1,135 @@
+import re
+from typing import Optional
+
+"""
+Questo file contiene la classe FirstStatementDetector, che riceve la risposta del modello un frammento alla volta
+e riconosce appena possibile la fine del primo statement SQL: il primo punto e virgola fuori da stringhe e commenti,
+oppure la chiusura del blocco di codice Markdown (```) che contiene la query.
+Tutto quello che il modello genera dopo viene comunque scartato da clean_sql_output, quindi la generazione può essere interrotta.
+Lo statement inizia dopo la riga di apertura del blocco di codice (``` o ```sql), se il modello ne apre uno; altrimenti
+con una parola chiave SQL all'inizio di una riga. Una parola chiave in mezzo a una frase ("Ecco la query with a join:")
+non viene considerata: se lo statement non viene riconosciuto, la generazione semplicemente non viene interrotta.
+"""
+
+# Parole chiave con cui inizia uno statement SQL, all'inizio di una riga; il testo che le precede (es. "Ecco la query:") non viene analizzato
+STATEMENT_START_PATTERN: re.Pattern = re.compile(r"^[ \t]*(select|with|insert|update|delete|drop|create|alter)\b",
+                                                 re.IGNORECASE | re.MULTILINE)
+
+FENCE: str = "```"
+
+
+class FirstStatementDetector:
+    def __init__(self):
+        self.text: str = ""
+        self.end: Optional[int] = None
+        self._start: Optional[int] = None
+        self._position: int = 0
+        self._in_fence: bool = False
+        self._quote: Optional[str] = None
+        self._comment: Optional[str] = None
+
+    def feed(self, chunk: str) -> bool:
+        """
+        Questo metodo aggiunge un frammento della risposta e restituisce True se il primo statement è completo.
+        """
+        if self.end is not None:
+            return True
+        self.text += chunk
+        if self._start is None and not self._find_start():
+            return False
+        return self._scan()
+
+    def statement_text(self) -> str:
+        """
+        Questo metodo restituisce il testo ricevuto fino alla fine del primo statement (o tutto il testo, se non è ancora finito).
+        """
+        return self.text if self.end is None else self.text[:self.end]
+
+    def _find_start(self) -> bool:
+        """
+        Questo metodo cerca l'inizio dello statement: la riga dopo l'apertura del blocco di codice, oppure una parola chiave
+        all'inizio di una riga, quale delle due viene prima.
+        Una parola chiave alla fine del testo potrebbe essere incompleta (es. "SELECTED"), e la riga di apertura del blocco
+        potrebbe non contenere ancora il linguaggio (es. "```sq"), quindi in questi casi si attende il frammento successivo.
+        """
+        match: Optional[re.Match] = STATEMENT_START_PATTERN.search(self.text)
+        if match is not None and match.end() >= len(self.text):
+            return False
+        fence: int = self.text.find(FENCE)
+        if fence != -1 and (match is None or fence < match.start(1)):
+            newline: int = self.text.find("\n", fence + len(FENCE))
+            if newline == -1:
+                return False
+            self._start = newline + 1
+            self._in_fence = True
+        elif match is not None:
+            self._start = match.start(1)
+        else:
+            return False
+        self._position = self._start
+        return True
+
+    def _scan(self) -> bool:
+        """
+        Questo metodo analizza il testo dalla posizione raggiunta in precedenza, tenendo traccia di stringhe e commenti.
+        Si ferma prima di un possibile delimitatore incompleto alla fine del testo, che verrà completato dal frammento successivo.
+        """
+        text: str = self.text
+        i: int = self._position
+        while i < len(text):
+            char: str = text[i]
+
+            if self._quote is not None:
+                if char == "\\":
+                    if i + 1 >= len(text):
+                        break
+                    i += 2
+                    continue
+                if char == self._quote:
+                    self._quote = None
+                i += 1
+                continue
+
+            if self._comment == "line":
+                if char == "\n":
+                    self._comment = None
+                i += 1
+                continue
+            if self._comment == "block":
+                if char == "*":
+                    if i + 1 >= len(text):
+                        break
+                    if text[i + 1] == "/":
+                        self._comment = None
+                        i += 2
+                        continue
+                i += 1
+                continue
+
+            if char in ("'", '"'):
+                self._quote = char
+            elif char == "`":
+                if i + 2 >= len(text):
+                    break
+                if text.startswith(FENCE, i):
+                    self.end = i + len(FENCE) if self._in_fence else i
+                    return True
+                self._quote = char
+            elif char == ";":
+                self.end = i + 1
+                return True
+            elif char == "#":
+                self._comment = "line"
+            elif char in ("-", "/"):
+                if i + 1 >= len(text):
+                    break
+                if text.startswith("--", i):
+                    self._comment = "line"
+                elif text.startswith("/*", i):
+                    self._comment = "block"
+                    i += 2
+                    continue
+            i += 1
+
+        self._position = i
+        return False
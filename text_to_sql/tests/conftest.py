@@ -0,0 +1,10 @@
+import os
+import sys
+
+"""
+I moduli di text_to_sql si importano per nome, come nell'immagine Docker del backend:
+per i test la cartella src viene aggiunta al percorso di ricerca dei moduli.
+I test si eseguono con: python -m pytest text_to_sql/tests
+"""
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
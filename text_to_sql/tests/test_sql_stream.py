@@ -0,0 +1,77 @@
+from typing import List, Optional
+
+import pytest
+
+from sql_stream import FirstStatementDetector
+
+
+def feed_all(chunks: List[str]) -> Optional[int]:
+    """
+    Invia i frammenti al detector e restituisce l'indice del frammento in cui il primo statement risulta completo.
+    """
+    detector: FirstStatementDetector = FirstStatementDetector()
+    for index, chunk in enumerate(chunks):
+        if detector.feed(chunk):
+            return index
+    return None
+
+
+def first_statement(text: str, chunk_size: int) -> str:
+    detector: FirstStatementDetector = FirstStatementDetector()
+    for i in range(0, len(text), chunk_size):
+        if detector.feed(text[i:i + chunk_size]):
+            break
+    return detector.statement_text()
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("SELECT * FROM movies; SELECT 2;", "SELECT * FROM movies;"),
+    ("Ecco la query:\nSELECT titolo FROM movies WHERE anno = 2020;\nSpiegazione...", "Ecco la query:\nSELECT titolo FROM movies WHERE anno = 2020;"),
+    # Punto e virgola dentro stringhe, anche con apici escapati
+    ("SELECT * FROM movies WHERE titolo = 'a;b' OR titolo = \"c;d\";", "SELECT * FROM movies WHERE titolo = 'a;b' OR titolo = \"c;d\";"),
+    ("SELECT * FROM movies WHERE titolo = 'l\\'ultimo; film'; x", "SELECT * FROM movies WHERE titolo = 'l\\'ultimo; film';"),
+    # Punto e virgola dentro commenti
+    ("SELECT * -- commento; ancora\nFROM movies; x", "SELECT * -- commento; ancora\nFROM movies;"),
+    ("SELECT * # commento;\nFROM movies; x", "SELECT * # commento;\nFROM movies;"),
+    ("SELECT /* a; b */ * FROM movies; x", "SELECT /* a; b */ * FROM movies;"),
+    # Identificatori tra backtick
+    ("SELECT `a;b` FROM movies; x", "SELECT `a;b` FROM movies;"),
+    # Blocco di codice Markdown: la chiusura termina lo statement anche senza punto e virgola
+    ("```sql\nSELECT * FROM movies\n```\nQuesta query...", "```sql\nSELECT * FROM movies\n```"),
+    ("```sql\nSELECT * FROM movies;\n```", "```sql\nSELECT * FROM movies;"),
+    # Testo prima del blocco di codice: le parole chiave in mezzo alla frase non iniziano lo statement
+    ("Here is the query with a join:\n```sql\nSELECT * FROM movies JOIN directors ON movies.id_director = directors.id\n```\nIt returns...",
+     "Here is the query with a join:\n```sql\nSELECT * FROM movies JOIN directors ON movies.id_director = directors.id\n```"),
+    ("Uso select e with; ecco:\n```\nWITH m AS (SELECT 1) SELECT * FROM m\n```", "Uso select e with; ecco:\n```\nWITH m AS (SELECT 1) SELECT * FROM m\n```"),
+])
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 1000])
+def test_first_statement(text: str, expected: str, chunk_size: int):
+    assert first_statement(text, chunk_size) == expected
+
+
+def test_statement_not_finished():
+    detector: FirstStatementDetector = FirstStatementDetector()
+    assert not detector.feed("SELECT * FROM movies WHERE titolo = 'a;")
+    assert detector.statement_text() == "SELECT * FROM movies WHERE titolo = 'a;"
+    assert detector.feed("b';")
+
+
+def test_keyword_split_between_chunks():
+    # "SEL" + "ECT": la parola chiave viene riconosciuta solo quando è completa
+    assert feed_all(["Risposta:\nSEL", "ECT 1", ";"]) == 2
+    # Il punto e virgola prima dell'inizio dello statement non conta
+    assert feed_all(["Nota;\n", "SELECT 1", " FROM movies;"]) == 2
+    # Una parola chiave in mezzo a una frase non inizia lo statement
+    assert feed_all(["Ecco la query select; ", "con i film;"]) is None
+
+
+def test_fence_split_between_chunks():
+    # La riga di apertura del blocco viene letta solo quando è completa
+    assert feed_all(["Query with a join:\n`", "``sq", "l\nSELECT 1;", " FROM movies;"]) == 2
+    assert feed_all(["Query with a join:\n```sql\nSELECT 1\n", "``", "`"]) == 2
+
+
+def test_delimiters_split_between_chunks():
+    assert feed_all(["SELECT 1 -", "- x;\n", "FROM movies;"]) == 2
+    assert feed_all(["SELECT 1 /", "* x; *", "/ FROM movies;"]) == 2
+    assert feed_all(["```sql\nSELECT 1\n`", "`", "`"]) == 2